@@ -1,23 +1,68 @@
-from flask import Flask, request, redirect, url_for, render_template, flash, abort, jsonify
+from flask import Flask, request, redirect, url_for, render_template, flash, abort, jsonify, g, has_app_context, has_request_context, send_file, send_from_directory, session, make_response, get_template_attribute, stream_with_context
+from werkzeug.exceptions import NotFound
 from werkzeug.utils import secure_filename
+from werkzeug.middleware.proxy_fix import ProxyFix
 import os
+import sys
 import uuid
+import hashlib
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+import sqlite3
 from flask_migrate import Migrate
 try:
     from flask_socketio import SocketIO, join_room, leave_room, emit
     SOCKETIO_ENABLED = True
 except Exception:
     SOCKETIO_ENABLED = False
+try:
+    import qrcode
+    QRCODE_ENABLED = True
+except Exception:
+    QRCODE_ENABLED = False
+try:
+    import redis
+    REDIS_ENABLED = True
+except Exception:
+    REDIS_ENABLED = False
+try:
+    from PIL import Image, ImageOps
+    PIL_ENABLED = True
+except Exception:
+    PIL_ENABLED = False
+try:
+    import brotli
+    BROTLI_ENABLED = True
+except Exception:
+    BROTLI_ENABLED = False
 from werkzeug.security import generate_password_hash, check_password_hash
 from flask_wtf import FlaskForm
-from wtforms import StringField, PasswordField, SubmitField, TextAreaField, DateField, SelectField, SelectMultipleField, DecimalField, FileField
+from wtforms import StringField, PasswordField, SubmitField, TextAreaField, DateField, SelectField, SelectMultipleField, DecimalField, FileField, BooleanField
 from wtforms.validators import InputRequired, Email, Length, EqualTo, ValidationError, Regexp, Optional
-from flask_wtf.file import FileField, FileAllowed, FileSize
+from flask_wtf.file import FileField, FileAllowed, FileSize, FileRequired
+from flask_wtf.csrf import validate_csrf
 import re
+import unicodedata
+import io
+import csv
+import json
+import gzip
+import mimetypes
+import random
+import threading
+import time
+import queue
+import atexit
+from concurrent.futures import ThreadPoolExecutor
 from flask_login import LoginManager, UserMixin, login_user, logout_user, login_required, current_user
 from functools import wraps
-from datetime import date, datetime
+from collections import Counter, OrderedDict, defaultdict
+from datetime import date, datetime, timedelta
+from markupsafe import Markup, escape
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+import click
 
 # --- Initialize app ---
 app = Flask(__name__)
@@ -26,6 +71,15 @@ app = Flask(__name__)
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'dev-secret')  # change in production
 app.config['WTF_CSRF_ENABLED'] = True
 app.config['WTF_CSRF_TIME_LIMIT'] = 3600  # 1 hour CSRF token validity
+# Browsers then leave the login cookies off POSTs that other sites make (links still work)
+app.config['SESSION_COOKIE_SAMESITE'] = 'Lax'
+app.config['REMEMBER_COOKIE_SAMESITE'] = 'Lax'
+# Reverse proxies in front of the app (e.g. 1 for nginx); their X-Forwarded-For/-Proto/-Host are then
+# trusted, so request.remote_addr is the client's address. Leave at 0 when clients connect directly
+app.config['TRUSTED_PROXIES'] = int(os.environ.get('TRUSTED_PROXIES', 0))
+if app.config['TRUSTED_PROXIES']:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['TRUSTED_PROXIES'],
+                            x_proto=app.config['TRUSTED_PROXIES'], x_host=app.config['TRUSTED_PROXIES'])
 
 # Upload settings
 app.config['UPLOAD_FOLDER'] = os.path.join(app.root_path, 'static', 'uploads')
@@ -34,16 +88,65 @@ app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
 app.config['UPLOAD_EXTENSIONS'] = ['.jpg', '.jpeg', '.png']
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg'}
 
+# Rendered invite QR codes (not under static: only members may fetch them)
+app.config['QR_FOLDER'] = os.path.join(app.instance_path, 'qr')
+
+# Chunked (resumable) chat uploads are assembled here, then moved to UPLOAD_FOLDER
+app.config['CHUNKED_UPLOAD_FOLDER'] = os.path.join(app.instance_path, 'chunked_uploads')
+app.config['CHAT_UPLOAD_MAX_BYTES'] = int(os.environ.get('CHAT_UPLOAD_MAX_BYTES', 50 * 1024 * 1024))
+app.config['CHAT_UPLOAD_CHUNK_BYTES'] = 1024 * 1024  # per request, well under MAX_CONTENT_LENGTH
+
+# Collecting upload files nothing refers to any more (`flask --app app gc-uploads`, or periodically in serve.py)
+app.config['UPLOAD_GC_GRACE'] = int(os.environ.get('UPLOAD_GC_GRACE', 3600))  # never touch files younger than this
+app.config['UPLOAD_GC_INTERVAL'] = int(os.environ.get('UPLOAD_GC_INTERVAL', 6 * 3600))  # seconds, 0 = no periodic sweep
+app.config['UPLOAD_GC_BATCH'] = int(os.environ.get('UPLOAD_GC_BATCH', 500))  # names per database lookup
+app.config['UPLOAD_GC_PAUSE'] = float(os.environ.get('UPLOAD_GC_PAUSE', 0.05))  # seconds between batches
+app.config['CHUNKED_UPLOAD_EXPIRY'] = int(os.environ.get('CHUNKED_UPLOAD_EXPIRY', 24 * 3600))  # idle resumable uploads
+
+# Downscaled copies of chat photos; the chat shows these and links to the original
+app.config['MEDIA_VARIANTS_FOLDER'] = os.path.join(app.config['UPLOAD_FOLDER'], 'variants')
+app.config['MEDIA_WORKERS'] = int(os.environ.get('MEDIA_WORKERS', 2))  # background resize threads
+MEDIA_VARIANTS = {
+    # name: (max width, max height, format)
+    'thumb': (480, 480, 'JPEG'),
+    'thumb_webp': (480, 480, 'WEBP'),
+    'large_webp': (1600, 1600, 'WEBP'),
+}
+# Trip cover renditions are fixed-width (height follows the picture); templates pick one via srcset
+COVER_RENDITIONS = {
+    'thumb': (160, None, 'JPEG'),
+    'thumb_webp': (160, None, 'WEBP'),
+    'card': (480, None, 'JPEG'),
+    'card_webp': (480, None, 'WEBP'),
+    'hero': (1200, None, 'JPEG'),
+    'hero_webp': (1200, None, 'WEBP'),
+}
+
+# Compress HTML/JSON responses larger than this (set COMPRESS_RESPONSES=0 when a proxy does it)
+app.config['COMPRESS_RESPONSES'] = os.environ.get('COMPRESS_RESPONSES', '1') != '0'
+app.config['COMPRESS_MIN_BYTES'] = int(os.environ.get('COMPRESS_MIN_BYTES', 1024))
+
+# Fingerprinted copies of static/ made by `flask --app app build-assets`
+app.config['ASSET_FOLDER'] = os.path.join(app.static_folder, 'dist')
+app.config['ASSET_MAX_AGE'] = 365 * 24 * 3600  # the name changes whenever the content does
+
 # Ensure upload directories exist
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 os.makedirs(app.config['TRIP_COVERS_FOLDER'], exist_ok=True)
+os.makedirs(app.config['QR_FOLDER'], exist_ok=True)
+os.makedirs(app.config['CHUNKED_UPLOAD_FOLDER'], exist_ok=True)
+os.makedirs(app.config['MEDIA_VARIANTS_FOLDER'], exist_ok=True)
 
 def allowed_file(filename):
     """Check if the uploaded file has an allowed extension."""
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 def save_trip_cover(file):
-    """Save an uploaded trip cover image and return the filename."""
+    """
+    Save an uploaded trip cover under a content-hash name and return its path
+    relative to static (None if it can't be saved). Uploading the same picture
+    again reuses the stored file; the renditions are made in the background.
+    """
     try:
         if not file:
             return None
@@ -56,28 +159,42 @@ def save_trip_cover(file):
             app.logger.error(f'Invalid file type: {file.filename}')
             return None
             
-        # Generate a secure filename with UUID to prevent duplicates
         try:
             ext = file.filename.rsplit('.', 1)[1].lower()
         except IndexError:
             app.logger.error(f'Invalid filename format: {file.filename}')
             return None
-            
-        filename = f"{str(uuid.uuid4())}.{ext}"
+        if ext == 'jpeg':
+            ext = 'jpg'
         
         # Ensure the upload directory exists
         os.makedirs(app.config['TRIP_COVERS_FOLDER'], exist_ok=True)
         
-        # Save the file
-        file_path = os.path.join(app.config['TRIP_COVERS_FOLDER'], filename)
+        # Stream to a temporary file while hashing, then move it to its content-hash name
+        tmp_path = os.path.join(app.config['TRIP_COVERS_FOLDER'], f'.{uuid.uuid4().hex}.upload')
+        digest = hashlib.sha256()
         try:
-            file.save(file_path)
+            with open(tmp_path, 'wb') as out:
+                for chunk in iter(lambda: file.stream.read(64 * 1024), b''):
+                    digest.update(chunk)
+                    out.write(chunk)
+            if PIL_ENABLED:
+                with Image.open(tmp_path) as image:
+                    image.verify()
+            filename = f"{digest.hexdigest()[:32]}.{ext}"
+            file_path = os.path.join(app.config['TRIP_COVERS_FOLDER'], filename)
+            if os.path.exists(file_path):
+                os.remove(tmp_path)  # the same picture was uploaded before
+                os.utime(file_path)  # keeps the upload sweep off it until the trip is saved
+            else:
+                os.replace(tmp_path, file_path)
         except Exception as e:
             app.logger.error(f'Error saving file: {str(e)}')
-            if os.path.exists(file_path):
-                os.remove(file_path)
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
             return None
         
+        cover_renditions.schedule(filename)
         # Return the relative path for database storage
         return f"uploads/trip_covers/{filename}"
         
@@ -89,8 +206,104 @@ def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 # --- Database config and init ---
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///tripmates.db'
+# Point DATABASE_URL at a file on fast local disk in production, e.g. sqlite:////srv/tripmates/tripmates.db
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///tripmates.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+
+# SQLite tuning, applied to every new connection (set SQLITE_TUNING=0 to get SQLite defaults)
+app.config['SQLITE_TUNING'] = os.environ.get('SQLITE_TUNING', '1') != '0'
+app.config['SQLITE_PRAGMAS'] = {
+    'journal_mode': os.environ.get('SQLITE_JOURNAL_MODE', 'WAL'),  # readers no longer block the writer
+    'synchronous': os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL'),  # safe with WAL, one fsync per checkpoint
+    'cache_size': int(os.environ.get('SQLITE_CACHE_SIZE', -64000)),  # negative = KiB, so 64 MB
+    'mmap_size': int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024)),
+    'busy_timeout': int(os.environ.get('SQLITE_BUSY_TIMEOUT', 5000)),  # ms to wait for a lock
+    'temp_store': 'MEMORY',
+}
+# Connection pool (ignored for in-memory SQLite, which always uses a single connection)
+app.config['DB_POOL_SIZE'] = int(os.environ.get('DB_POOL_SIZE', 10))
+app.config['DB_MAX_OVERFLOW'] = int(os.environ.get('DB_MAX_OVERFLOW', 20))
+app.config['DB_POOL_TIMEOUT'] = int(os.environ.get('DB_POOL_TIMEOUT', 30))  # seconds
+
+
+def engine_options(uri):
+    """SQLAlchemy engine options for the configured database."""
+    in_memory = uri in ('sqlite://', 'sqlite:///:memory:') or 'mode=memory' in uri
+    if in_memory:
+        return {}
+    options = {
+        'pool_size': app.config['DB_POOL_SIZE'],
+        'max_overflow': app.config['DB_MAX_OVERFLOW'],
+        'pool_timeout': app.config['DB_POOL_TIMEOUT'],
+        'pool_pre_ping': not uri.startswith('sqlite'),
+    }
+    if uri.startswith('sqlite'):
+        # pooled connections are handed between threads (and green threads under Socket.IO)
+        options['connect_args'] = {
+            'check_same_thread': False,
+            'timeout': app.config['SQLITE_PRAGMAS']['busy_timeout'] / 1000,
+        }
+    return options
+
+
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config['SQLALCHEMY_DATABASE_URI'])
+
+
+@event.listens_for(Engine, 'connect')
+def apply_sqlite_pragmas(dbapi_connection, connection_record):
+    """Tune each new SQLite connection (no-op for other databases)."""
+    if not isinstance(dbapi_connection, sqlite3.Connection) or not app.config['SQLITE_TUNING']:
+        return
+    cursor = dbapi_connection.cursor()
+    try:
+        for name, value in app.config['SQLITE_PRAGMAS'].items():
+            cursor.execute(f'PRAGMA {name} = {value}')
+    finally:
+        cursor.close()
+
+
+# Settlement settings: 'optimal' minimises the number of transfers, 'greedy' is always fast
+app.config['SETTLEMENT_MODE'] = os.environ.get('SETTLEMENT_MODE', 'optimal')
+app.config['SETTLEMENT_TIME_BUDGET'] = float(os.environ.get('SETTLEMENT_TIME_BUDGET', 0.25))  # seconds
+app.config['SETTLEMENT_MAX_OPTIMAL_PARTIES'] = 20  # subset search is 2^n, beyond this use greedy
+
+# Chat write-behind: messages are broadcast at once and saved in batches
+app.config['CHAT_WRITE_BEHIND'] = os.environ.get('CHAT_WRITE_BEHIND', '1') != '0'
+app.config['CHAT_BATCH_SIZE'] = int(os.environ.get('CHAT_BATCH_SIZE', 100))  # rows per insert
+app.config['CHAT_FLUSH_INTERVAL_MS'] = int(os.environ.get('CHAT_FLUSH_INTERVAL_MS', 50))
+app.config['CHAT_MAX_PENDING'] = int(os.environ.get('CHAT_MAX_PENDING', 10000))  # backpressure limit
+app.config['CHAT_ENQUEUE_TIMEOUT'] = 2.0  # seconds a sender waits when the queue is full
+# Workers save their batches on their own schedules, so a message can show up after one with a
+# higher id; ?since= syncs re-send messages this recent (seconds) and clients skip ids they have
+app.config['CHAT_SYNC_LAG'] = float(os.environ.get('CHAT_SYNC_LAG', 10))
+
+# Socket.IO fan-out between workers. Leave unset for a single process. With several
+# workers set it to redis://host:6379/0, or unix:///path/broker.sock for scripts/socket_broker.py.
+# Other schemes (amqp://, kafka://, zmq+tcp://) are passed to Flask-SocketIO as they are.
+app.config['SOCKETIO_MESSAGE_QUEUE'] = os.environ.get('SOCKETIO_MESSAGE_QUEUE') or None
+app.config['SOCKETIO_CHANNEL'] = os.environ.get('SOCKETIO_CHANNEL', 'tripmates')
+# eventlet, gevent or threading; unset picks the best installed one (serve.py sets it)
+app.config['SOCKETIO_ASYNC_MODE'] = os.environ.get('SOCKETIO_ASYNC_MODE') or None
+app.config['CHAT_ID_COUNTER_KEY'] = 'tripmates:group_message:id'
+# Presence: online/offline changes are batched per room and sent after this delay,
+# so a connection that drops and comes back within it causes no broadcast at all
+app.config['PRESENCE_DEBOUNCE_MS'] = int(os.environ.get('PRESENCE_DEBOUNCE_MS', 3000))
+# Socket connections cache membership; re-check it this often since other workers may change it
+app.config['SOCKET_MEMBERSHIP_TTL'] = int(os.environ.get('SOCKET_MEMBERSHIP_TTL', 30))  # seconds
+
+# Password hashing runs on a few OS threads (see PasswordHasher); hashes made with other
+# settings are upgraded to PASSWORD_HASH_METHOD when their owner signs in
+app.config['PASSWORD_HASH_METHOD'] = os.environ.get('PASSWORD_HASH_METHOD', 'scrypt')  # a Werkzeug method string
+app.config['PASSWORD_HASH_WORKERS'] = int(os.environ.get('PASSWORD_HASH_WORKERS', 2))  # 0 = hash in the request
+app.config['PASSWORD_HASH_MAX_PENDING'] = int(os.environ.get('PASSWORD_HASH_MAX_PENDING', 32))  # then "try again"
+# One address gets LOGIN_MAX_FAILURES tries at an account's password per LOGIN_LOCKOUT_SECONDS (a
+# successful sign-in resets them), and all addresses together get LOGIN_ACCOUNT_MAX_FAILURES, so
+# rotating addresses doesn't buy unlimited guesses while one address can't lock the owner out
+app.config['LOGIN_MAX_FAILURES'] = int(os.environ.get('LOGIN_MAX_FAILURES', 5))
+app.config['LOGIN_ACCOUNT_MAX_FAILURES'] = int(os.environ.get('LOGIN_ACCOUNT_MAX_FAILURES', 100))
+app.config['LOGIN_LOCKOUT_SECONDS'] = int(os.environ.get('LOGIN_LOCKOUT_SECONDS', 900))
+
+app.config['ITINERARY_CACHE_BYTES'] = int(os.environ.get('ITINERARY_CACHE_BYTES', 8 * 1024 * 1024))  # rendered day HTML
 db = SQLAlchemy(app)
 migrate = Migrate(app, db)
 
@@ -99,22 +312,216 @@ login_manager = LoginManager(app)
 login_manager.login_view = 'login'
 
 # --- SocketIO (optional) ---
+REDIS_PROTOCOL_SCHEMES = ('redis://', 'rediss://', 'unix://')
+
+
+def uses_redis_protocol(url):
+    return bool(url) and url.startswith(REDIS_PROTOCOL_SCHEMES)
+
+
+def socketio_options():
+    """SocketIO server options; adds the shared message queue when one is configured."""
+    options = {'cors_allowed_origins': '*'}
+    if app.config['SOCKETIO_ASYNC_MODE']:
+        options['async_mode'] = app.config['SOCKETIO_ASYNC_MODE']
+    url = app.config['SOCKETIO_MESSAGE_QUEUE']
+    if not url:
+        return options
+    if uses_redis_protocol(url):
+        if not REDIS_ENABLED:
+            raise RuntimeError('SOCKETIO_MESSAGE_QUEUE needs the redis package (pip install redis)')
+        # Flask-SocketIO would hand unix:// URLs to kombu, so build the Redis manager here
+        from socketio import RedisManager
+        options['client_manager'] = RedisManager(url, channel=app.config['SOCKETIO_CHANNEL'])
+    else:
+        options['message_queue'] = url
+        options['channel'] = app.config['SOCKETIO_CHANNEL']
+    return options
+
+
 socketio = None
 if SOCKETIO_ENABLED:
-    socketio = SocketIO(app, cors_allowed_origins='*')
+    socketio = SocketIO(app, **socketio_options())
+
+
+def green_threads():
+    """
+    'eventlet' or 'gevent' when that library has monkey-patched threading in this
+    process (serve.py), else None. socketio.async_mode can't tell: it says
+    'eventlet' whenever eventlet is installed, even under `python app.py`.
+    """
+    if 'eventlet' in sys.modules:
+        from eventlet import patcher
+        if patcher.is_monkey_patched('thread'):
+            return 'eventlet'
+    if 'gevent' in sys.modules:
+        from gevent import monkey
+        if monkey.is_module_patched('threading'):
+            return 'gevent'
+    return None
+
+
+def run_in_os_thread(fn, *args):
+    """
+    Call fn(*args) on a real OS thread and wait for it without blocking other
+    green threads. eventlet/gevent patch threading, so even a ThreadPoolExecutor
+    runs on the hub there and CPU-heavy work (hashing, image decoding) stalls
+    every socket of the worker. Unpatched, the caller already is an OS thread.
+    """
+    hub = green_threads()
+    if hub == 'eventlet':
+        from eventlet import tpool
+        return tpool.execute(fn, *args)
+    if hub == 'gevent':
+        import gevent
+        return gevent.get_hub().threadpool.apply(fn, args)
+    return fn(*args)
+
+# --- Password hashing ---
+class HashingBusy(Exception):
+    """Raised when too many password hashes are already waiting for a worker thread."""
+
+
+class PasswordHasher:
+    """
+    Werkzeug password hashing on at most `workers` OS threads, so a login
+    doesn't stall the other connections of an eventlet/gevent worker (their
+    green threads can't run while one of them is inside scrypt/PBKDF2).
+    Calls beyond `workers` wait, up to max_pending of them; more than that
+    raises HashingBusy. workers=0 hashes in the caller (the old behaviour).
+    """
+
+    def __init__(self, method, workers, max_pending):
+        self.method = method
+        self.workers = workers
+        self._slots = threading.BoundedSemaphore(workers + max_pending)
+        self._running = threading.BoundedSemaphore(max(workers, 1))
+        self._pool = None
+        self._params = None  # the method's full parameters, e.g. 'scrypt:32768:8:1'
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password, self.method)
+
+    def verify_and_update(self, pwhash, password):
+        """(password matches, new hash or None); the new hash uses the configured method when pwhash doesn't."""
+        return self._run(self._verify_and_update, pwhash, password)
+
+    def _verify_and_update(self, pwhash, password):
+        # one job, so an upgrade doesn't queue a second time behind other logins
+        if not check_password_hash(pwhash, password):
+            return False, None
+        if self._params is None:
+            self._params = generate_password_hash('', self.method).split('$', 1)[0]
+        if pwhash.split('$', 1)[0] == self._params:
+            return True, None
+        return True, generate_password_hash(password, self.method)
+
+    def _run(self, fn, *args):
+        if self.workers <= 0:
+            return fn(*args)
+        if not self._slots.acquire(blocking=False):
+            raise HashingBusy('too many sign-ins in progress')
+        try:
+            with self._running:
+                return self._call(fn, *args)
+        finally:
+            self._slots.release()
+
+    def _call(self, fn, *args):
+        if green_threads():
+            return run_in_os_thread(fn, *args)
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='password')
+        return self._pool.submit(fn, *args).result()
+
+
+password_hasher = PasswordHasher(app.config['PASSWORD_HASH_METHOD'], app.config['PASSWORD_HASH_WORKERS'],
+                                 app.config['PASSWORD_HASH_MAX_PENDING'])
+
+
+class LocalLoginThrottle:
+    """Sign-in attempts per key for a single worker, forgotten window seconds after the first one."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._attempts = OrderedDict()  # key -> [count, expires at]; oldest first
+
+    def attempt(self, key, window):
+        """Count an attempt and return how many this window has seen, this one included."""
+        now = time.monotonic()
+        with self._lock:
+            # every entry lasts the same window, so the expired ones are at the front
+            while self._attempts and next(iter(self._attempts.values()))[1] <= now:
+                self._attempts.popitem(last=False)
+            entry = self._attempts.setdefault(key, [0, now + window])
+            entry[0] += 1
+            return entry[0]
+
+    def refund(self, key, window):
+        """Take back an attempt that never got to check the password."""
+        with self._lock:
+            entry = self._attempts.get(key)
+            if entry and entry[0] > 0:
+                entry[0] -= 1
+
+    def clear(self, key):
+        with self._lock:
+            self._attempts.pop(key, None)
+
+
+class RedisLoginThrottle:
+    """Sign-in attempts per key in Redis, shared by all workers, expiring window seconds after the first."""
+
+    def __init__(self, url, prefix='tripmates:login-attempts:'):
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def _add(self, key, window, step):
+        # the key is created with its expiry, so a worker dying between the two can't leave it forever
+        pipe = self.client.pipeline(transaction=False)
+        pipe.set(self.prefix + key, 0, ex=window, nx=True)
+        pipe.incrby(self.prefix + key, step)
+        return int(pipe.execute()[1])
+
+    def attempt(self, key, window):
+        """Count an attempt and return how many this window has seen, this one included."""
+        return self._add(key, window, 1)
+
+    def refund(self, key, window):
+        """Take back an attempt that never got to check the password."""
+        self._add(key, window, -1)
+
+    def clear(self, key):
+        self.client.delete(self.prefix + key)
+
+
+def login_throttle_store():
+    """Sign-in attempt counts shared between workers when several run, else in-process ones."""
+    url = app.config['SOCKETIO_MESSAGE_QUEUE']
+    if uses_redis_protocol(url):
+        return RedisLoginThrottle(url)
+    return LocalLoginThrottle()
+
+
+login_throttle = login_throttle_store()
+
 
 # --- User model ---
 class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(50), nullable=False)
     email = db.Column(db.String(120), unique=True, nullable=False)
-    password_hash = db.Column(db.String(128), nullable=False)
+    password_hash = db.Column(db.String(255), nullable=False)
 
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = password_hasher.hash(password)
 
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        """Check a password; a hash made with older settings is replaced (the caller commits)."""
+        matches, new_hash = password_hasher.verify_and_update(self.password_hash, password)
+        if new_hash:
+            self.password_hash = new_hash
+        return matches
 
 
 @login_manager.user_loader
@@ -126,22 +533,29 @@ def load_user(user_id):
 
 
 # --- Trip model ---
+def initial_version():
+    # start from the clock so a reused id never repeats an older row's version stamp
+    return int(time.time() * 1000)
+
+
 class Trip(db.Model):
     """
     Represents a travel trip. 
     Connected to User (who created it) and optionally a Group.
     """
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False) # The owner of the trip
-    group_id = db.Column(db.Integer, db.ForeignKey('group.id'), nullable=True) # Optional group link
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True) # The owner of the trip
+    group_id = db.Column(db.Integer, db.ForeignKey('group.id'), nullable=True, index=True) # Optional group link
     
     title = db.Column(db.String(120), nullable=False)
     destination = db.Column(db.String(120), nullable=False)
     start_date = db.Column(db.Date, nullable=False)
     end_date = db.Column(db.Date, nullable=False)
     description = db.Column(db.Text, nullable=True)
-    cover_image = db.Column(db.String(255), nullable=True)
+    cover_image = db.Column(db.String(255), nullable=True, index=True)
     share_token = db.Column(db.String(64), unique=True, nullable=True)
+    # Bumped whenever the trip, its itinerary or its expenses change (see _bump_versions)
+    version = db.Column(db.BigInteger, nullable=False, default=initial_version)
 
     # Relationships: This allows us to access trip.owner easily
     owner = db.relationship('User', backref='trips')
@@ -174,9 +588,32 @@ class ItineraryItem(db.Model):
     location = db.Column(db.String(200), nullable=True)
     cost = db.Column(db.Numeric(10,2), nullable=True)
     tags = db.Column(db.String(255), nullable=True)
+    # Raised on every edit; view_trip's day fragments are keyed by (count, sum of versions)
+    version = db.Column(db.BigInteger, nullable=False, default=initial_version)
 
     trip = db.relationship('Trip', backref='itinerary_items')
 
+    __table_args__ = (
+        # Itineraries are always read per trip in time order
+        db.Index('ix_itinerary_item_trip_id_datetime', 'trip_id', 'datetime'),
+    )
+
+
+class ItineraryTag(db.Model):
+    """
+    One tag of an itinerary item, normalized (see split_tags), so items can be
+    found by tag. Rewritten from ItineraryItem.tags whenever that changes.
+    """
+    item_id = db.Column(db.Integer, db.ForeignKey('itinerary_item.id'), primary_key=True)
+    tag = db.Column(db.String(60), primary_key=True)
+    trip_id = db.Column(db.Integer, db.ForeignKey('trip.id'), nullable=False)
+
+    __table_args__ = (
+        # exact and prefix tag lookups, narrowed down to the trips a user can see
+        db.Index('ix_itinerary_tag_tag_trip_id', 'tag', 'trip_id'),
+        db.Index('ix_itinerary_tag_trip_id', 'trip_id'),
+    )
+
 
 # --- Phase 3: Groups & Membership ---
 class Group(db.Model):
@@ -191,6 +628,7 @@ class Group(db.Model):
     created_at = db.Column(db.DateTime, nullable=False, default=db.func.current_timestamp())
     is_active = db.Column(db.Boolean, nullable=False, default=True)
     approval_required = db.Column(db.Boolean, nullable=False, default=False) # New: admin must approve
+    version = db.Column(db.BigInteger, nullable=False, default=initial_version) # Bumped on group/member changes
 
     admin = db.relationship('User', backref='owned_groups')
     members = db.relationship('GroupMember', backref='group', cascade='all, delete-orphan')
@@ -216,8 +654,8 @@ class Group(db.Model):
         return GroupMember.query.filter_by(group_id=self.id).count()
 
     def is_member(self, user_id):
-        """Check if a user is a member of this group."""
-        return GroupMember.query.filter_by(group_id=self.id, user_id=user_id, status='active').first() is not None
+        """Check if a user is an active member of this group."""
+        return is_group_member(self.id, user_id)
 
 
 class GroupMember(db.Model):
@@ -232,6 +670,8 @@ class GroupMember(db.Model):
 
     __table_args__ = (
         db.UniqueConstraint('group_id', 'user_id', name='unique_group_member'),
+        # "Which groups is this user active in?" runs on almost every request
+        db.Index('ix_group_member_user_id_status', 'user_id', 'status'),
     )
 
 
@@ -249,12 +689,22 @@ class GroupMessage(db.Model):
 
     user = db.relationship('User', backref='group_messages')
 
+    __table_args__ = (
+        # Chat history is paged by id within a group
+        db.Index('ix_group_message_group_id_id', 'group_id', 'id'),
+        db.Index('ix_group_message_group_id_timestamp', 'group_id', 'timestamp'),
+        # the upload sweep asks which photo files are still in use
+        db.Index('ix_group_message_media_filename', 'media_filename'),
+    )
+
 
 # --- Phase 5: Expenses & Budgeting ---
 # Many-to-Many relationship table: Links Expenses to multiple Users (participants)
 expense_participants = db.Table('expense_participants',
     db.Column('expense_id', db.Integer, db.ForeignKey('expense.id'), primary_key=True),
-    db.Column('user_id', db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    db.Column('user_id', db.Integer, db.ForeignKey('user.id'), primary_key=True),
+    # The primary key covers lookups by expense; this one covers lookups by user
+    db.Index('ix_expense_participants_user_id', 'user_id')
 )
 
 class Expense(db.Model):
@@ -263,7 +713,7 @@ class Expense(db.Model):
     Tracks who paid (payer) and who shared the cost (participants).
     """
     id = db.Column(db.Integer, primary_key=True)
-    trip_id = db.Column(db.Integer, db.ForeignKey('trip.id'), nullable=False)
+    trip_id = db.Column(db.Integer, db.ForeignKey('trip.id'), nullable=False, index=True)
     title = db.Column(db.String(200), nullable=False)
     amount = db.Column(db.Numeric(12,2), nullable=False)
     payer_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
@@ -276,39 +726,474 @@ class Expense(db.Model):
     participants = db.relationship('User', secondary=expense_participants, backref='expenses_participated')
 
 
+class TripBalance(db.Model):
+    """
+    Running net balance of one user within one trip, stored in paise.
+    Kept up to date incrementally by the expense routes so the expenses page
+    does not have to replay every expense on each visit.
+    Positive balance: User is owed money.
+    Negative balance: User owes money.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    trip_id = db.Column(db.Integer, db.ForeignKey('trip.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    balance_minor = db.Column(db.Integer, nullable=False, default=0)
 
-@app.route('/groups/<int:group_id>/messages')
+    user = db.relationship('User')
+
+    __table_args__ = (
+        db.UniqueConstraint('trip_id', 'user_id', name='unique_trip_balance'),
+    )
+
+
+# --- Chat message pipeline ---
+class ChatBackpressure(Exception):
+    """Raised when too many chat messages are waiting to be written."""
+
+
+class MessagePipeline:
+    """
+    Write-behind persistence for group chat messages.
+
+    submit() gives the message its id and timestamp straight away so it can be
+    broadcast at once, then queues the row. A background thread inserts queued
+    rows in batches of up to batch_size, or whatever arrived within
+    flush_interval seconds, in one transaction per batch. The queue holds at
+    most max_pending rows; beyond that submit() waits up to enqueue_timeout
+    seconds and then raises ChatBackpressure. close() writes everything still
+    queued and is registered to run at interpreter exit.
+
+    Ids come from an in-process counter seeded from MAX(group_message.id), or
+    from id_allocator (a callable returning the next id) when several workers
+    share the table, so every GroupMessage must be created through
+    post_group_message() while the pipeline is enabled.
+    """
+
+    def __init__(self, batch_size=100, flush_interval=0.05, max_pending=10000, enqueue_timeout=2.0,
+                 id_allocator=None):
+        self.batch_size = batch_size
+        self.id_allocator = id_allocator
+        self.flush_interval = flush_interval
+        self.enqueue_timeout = enqueue_timeout
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._lock = threading.Lock()
+        self._next_id = None
+        self._thread = None
+        self._closed = False
+
+    def submit(self, row):
+        """Assign id/timestamp to a row dict, queue it and return it."""
+        # allocate and enqueue under one lock so rows are written in id order
+        with self._lock:
+            if self._closed:
+                raise ChatBackpressure('chat pipeline is shut down')
+            self._start()
+            if self.id_allocator is not None:
+                if self._queue.full():
+                    raise ChatBackpressure('too many chat messages waiting to be saved')
+                row = dict(row, id=self.id_allocator(), timestamp=datetime.utcnow())
+                # shared ids are spent once allocated, so never drop the row after this
+                self._queue.put(row)
+                return row
+            if self._next_id is None:
+                self._next_id = (db.session.query(db.func.max(GroupMessage.id)).scalar() or 0) + 1
+            row = dict(row, id=self._next_id, timestamp=datetime.utcnow())
+            try:
+                self._queue.put(row, timeout=self.enqueue_timeout)
+            except queue.Full:
+                raise ChatBackpressure('too many chat messages waiting to be saved')
+            self._next_id += 1
+        return row
+
+    def flush(self):
+        """Block until every row submitted so far has been written."""
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.join()
+        else:
+            self._drain()
+
+    def close(self):
+        """Stop accepting rows and write whatever is still queued."""
+        with self._lock:
+            self._closed = True
+        self.flush()
+
+    def _start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name='chat-writer', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                batch = [self._queue.get(timeout=1.0)]
+            except queue.Empty:
+                if self._closed:
+                    return
+                continue
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            try:
+                self._write(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _drain(self):
+        batch = []
+        while True:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        if batch:
+            try:
+                self._write(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _write(self, batch):
+        with app.app_context():
+            try:
+                db.session.execute(db.insert(GroupMessage), batch)
+                touch_versions(group_ids={row['group_id'] for row in batch})  # new ETags, see group_version
+                db.session.commit()
+                return
+            except Exception:
+                db.session.rollback()
+                app.logger.exception(f'Chat batch of {len(batch)} failed; retrying row by row')
+            # one bad row (e.g. its group was deleted) must not lose the others
+            for row in batch:
+                try:
+                    db.session.execute(db.insert(GroupMessage), [row])
+                    touch_versions(group_ids=[row['group_id']])
+                    db.session.commit()
+                except Exception:
+                    db.session.rollback()
+                    app.logger.exception(f"Dropping chat message id={row['id']} group={row['group_id']}")
+            db.session.remove()
+
+
+class SharedIdAllocator:
+    """
+    Chat message ids from a counter on the Redis server (or scripts/socket_broker.py)
+    behind SOCKETIO_MESSAGE_QUEUE, so pipelines in different workers never hand out
+    the same id. The counter is seeded once from MAX(group_message.id) with SET NX;
+    it has to outlive the workers (if the broker loses it, restart the workers too).
+    """
+
+    def __init__(self, url, key):
+        self.url = url
+        self.key = key
+        self._client = None
+        self._seeded = False
+
+    def __call__(self):
+        try:
+            if self._client is None:
+                self._client = redis.Redis.from_url(self.url)
+            if not self._seeded:
+                floor = db.session.query(db.func.max(GroupMessage.id)).scalar() or 0
+                self._client.set(self.key, floor, nx=True)
+                self._seeded = True
+            return int(self._client.incr(self.key))
+        except redis.RedisError:
+            app.logger.exception('Could not allocate a chat message id')
+            raise ChatBackpressure('chat message ids are unavailable')
+
+
+def chat_id_allocator():
+    """Shared id source for the chat pipeline when several workers run, else None."""
+    url = app.config['SOCKETIO_MESSAGE_QUEUE']
+    if not url or not app.config['CHAT_WRITE_BEHIND']:
+        return None
+    if not uses_redis_protocol(url):
+        # no shared counter on this queue: let the database assign ids instead
+        app.logger.warning('SOCKETIO_MESSAGE_QUEUE is not Redis; chat write-behind is turned off')
+        app.config['CHAT_WRITE_BEHIND'] = False
+        return None
+    return SharedIdAllocator(url, app.config['CHAT_ID_COUNTER_KEY'])
+
+
+message_pipeline = MessagePipeline(
+    batch_size=app.config['CHAT_BATCH_SIZE'],
+    flush_interval=app.config['CHAT_FLUSH_INTERVAL_MS'] / 1000,
+    max_pending=app.config['CHAT_MAX_PENDING'],
+    enqueue_timeout=app.config['CHAT_ENQUEUE_TIMEOUT'],
+    id_allocator=chat_id_allocator(),
+)
+atexit.register(message_pipeline.close)
+
+
+def post_group_message(group_id, user_id, text, **fields):
+    """
+    Save a chat message and return its row (dict with id and timestamp).
+    Goes through the write-behind pipeline unless CHAT_WRITE_BEHIND is off,
+    in which case the row is inserted and committed before returning.
+    May raise ChatBackpressure.
+    """
+    row = dict(group_id=int(group_id), user_id=user_id, message=text,
+               media_filename=fields.get('media_filename'),
+               location_lat=fields.get('location_lat'),
+               location_lng=fields.get('location_lng'),
+               location_label=fields.get('location_label'))
+    if app.config['CHAT_WRITE_BEHIND']:
+        return message_pipeline.submit(row)
+    msg = GroupMessage(timestamp=datetime.utcnow(), **row)
+    db.session.add(msg)
+    db.session.commit()
+    return dict(row, id=msg.id, timestamp=msg.timestamp)
+
+
+def post_status_message(group_id, user_id, text):
+    """Best-effort system message (e.g. 'joined the group'); returns None if chat is overloaded."""
+    try:
+        return post_group_message(group_id, user_id, text)
+    except ChatBackpressure:
+        app.logger.warning(f'Skipped status message for group {group_id}: chat queue full')
+        return None
+
+
+# --- Image variants (chat photos, trip covers) ---
+media_pool = ThreadPoolExecutor(max_workers=app.config['MEDIA_WORKERS'], thread_name_prefix='media')
+atexit.register(media_pool.shutdown, wait=True, cancel_futures=True)
+
+
+class ImageVariants:
+    """
+    Downscaled JPEG/WebP copies of images in source_folder, written to
+    target_folder as <stem>.<variant>.<jpg|webp> on the shared media pool
+    (each render on an OS thread, see run_in_os_thread).
+    variants maps a name to (max width, max height or None, format).
+    schedule() queues every variant of a file once; path() returns a variant,
+    waiting for (or doing) the work if it isn't there yet, e.g. for images
+    uploaded before variants existed.
+    """
+
+    def __init__(self, source_folder, target_folder, variants, pool):
+        self.source_folder = source_folder
+        self.target_folder = target_folder
+        self.variants = variants
+        self._pool = pool
+        self._lock = threading.Lock()
+        self._jobs = {}  # source filename -> future
+
+    def variant_name(self, filename, variant):
+        stem = filename.rsplit('.', 1)[0]
+        ext = 'webp' if self.variants[variant][2] == 'WEBP' else 'jpg'
+        return f'{stem}.{variant}.{ext}'
+
+    def variant_path(self, filename, variant):
+        return os.path.join(self.target_folder, self.variant_name(filename, variant))
+
+    def schedule(self, filename):
+        if not PIL_ENABLED:
+            return None
+        with self._lock:
+            job = self._jobs.get(filename)
+            if job is None:
+                job = self._jobs[filename] = self._pool.submit(run_in_os_thread, self._render, filename)
+                job.add_done_callback(lambda _: self._forget(filename))
+            return job
+
+    def path(self, filename, variant, timeout=30):
+        """Filesystem path of a variant, rendering it first if needed; None if that fails."""
+        target = self.variant_path(filename, variant)
+        if os.path.exists(target):
+            return target
+        job = self.schedule(filename)
+        if job is not None:
+            try:
+                # the decoding happens on an OS thread, so under eventlet/gevent this only parks the request
+                job.result(timeout=timeout)
+            except Exception:
+                app.logger.exception(f'Could not render variants of {filename}')
+        return target if os.path.exists(target) else None
+
+    def discard(self, filename):
+        """Remove every variant of a file (the source itself is the caller's business)."""
+        for variant in self.variants:
+            path = self.variant_path(filename, variant)
+            if os.path.exists(path):
+                os.remove(path)
+
+    def _forget(self, filename):
+        with self._lock:
+            self._jobs.pop(filename, None)
+
+    def _render(self, filename):
+        source = os.path.join(self.source_folder, filename)
+        # largest first, so each smaller one is resized from an already reduced image
+        variants = sorted(self.variants.items(), key=lambda item: -item[1][0])
+        with Image.open(source) as original:
+            # let the JPEG decoder skip detail we're going to throw away anyway
+            width, height = variants[0][1][0], variants[0][1][1]
+            if height is None:
+                height = max(1, original.height * width // max(original.width, 1))
+            original.draft('RGB', (width, height))
+            image = ImageOps.exif_transpose(original)
+            if image.mode not in ('RGB', 'RGBA'):
+                image = image.convert('RGBA' if image.mode in ('LA', 'PA') or 'transparency' in image.info else 'RGB')
+            for variant, (width, height, fmt) in variants:
+                image.thumbnail((width, height or image.height), Image.LANCZOS)
+                target = self.variant_path(filename, variant)
+                tmp = f'{target}.{uuid.uuid4().hex}.tmp'
+                if fmt == 'JPEG':
+                    out = image if image.mode == 'RGB' else image.convert('RGB')
+                    out.save(tmp, fmt, quality=80, optimize=True, progressive=True)
+                else:
+                    image.save(tmp, fmt, quality=80, method=4)
+                os.replace(tmp, target)
+
+
+media_variants = ImageVariants(app.config['UPLOAD_FOLDER'], app.config['MEDIA_VARIANTS_FOLDER'],
+                               MEDIA_VARIANTS, media_pool)
+cover_renditions = ImageVariants(app.config['TRIP_COVERS_FOLDER'], app.config['TRIP_COVERS_FOLDER'],
+                                 COVER_RENDITIONS, media_pool)
+
+
+# --- Trip covers ---
+def _cover_filename(cover_image):
+    """'uploads/trip_covers/<name>' -> '<name>', None for anything else."""
+    prefix = 'uploads/trip_covers/'
+    if cover_image and cover_image.startswith(prefix) and '/' not in cover_image[len(prefix):]:
+        return cover_image[len(prefix):]
+    return None
+
+
+def cover_url(cover_image, rendition='card'):
+    """URL of one cover rendition (the on-demand route until its file exists)."""
+    filename = _cover_filename(cover_image)
+    if filename is None or not PIL_ENABLED:
+        return url_for('static', filename=cover_image) if cover_image else None
+    if os.path.exists(cover_renditions.variant_path(filename, rendition)):
+        name = cover_renditions.variant_name(filename, rendition)
+        return url_for('static', filename=f'uploads/trip_covers/{name}')
+    return url_for('trip_cover_rendition', filename=filename, rendition=rendition)
+
+
+def cover_srcset(cover_image, webp=False):
+    """srcset of every fixed-width cover rendition in one format ('' if there are none)."""
+    if _cover_filename(cover_image) is None or not PIL_ENABLED:
+        return ''
+    return ', '.join(f'{cover_url(cover_image, rendition)} {width}w'
+                     for rendition, (width, _, fmt) in COVER_RENDITIONS.items()
+                     if (fmt == 'WEBP') == webp)
+
+
+app.jinja_env.globals.update(cover_url=cover_url, cover_srcset=cover_srcset)
+
+
+def discard_trip_cover(cover_image):
+    """
+    Delete a cover and its renditions unless another trip still uses the same
+    picture (identical uploads share one file). Call after the trip is gone.
+    A cover touched within UPLOAD_GC_GRACE is kept: save_trip_cover may have
+    just handed it to a trip that isn't committed yet. gc-uploads collects it later.
+    """
+    filename = _cover_filename(cover_image)
+    if filename is None or Trip.query.filter_by(cover_image=cover_image).first() is not None:
+        return
+    try:
+        path = os.path.join(app.config['TRIP_COVERS_FOLDER'], filename)
+        try:
+            if os.stat(path).st_mtime > time.time() - app.config['UPLOAD_GC_GRACE']:
+                return
+        except FileNotFoundError:
+            pass
+        if os.path.exists(path):
+            os.remove(path)
+        cover_renditions.discard(filename)
+        app.logger.info(f"Removed cover image file: {path}")
+    except Exception:
+        app.logger.exception("Failed to delete cover image")
+
+
+@app.route('/covers/<filename>/<rendition>')
+def trip_cover_rendition(filename, rendition):
+    """A cover rendition that the background pool hasn't written yet (or a cover from before renditions)."""
+    if rendition not in COVER_RENDITIONS or filename != secure_filename(filename):
+        abort(404)
+    if not os.path.exists(os.path.join(app.config['TRIP_COVERS_FOLDER'], filename)):
+        abort(404)
+    path = cover_renditions.path(filename, rendition)
+    if path is None:
+        return redirect(url_for('static', filename=f'uploads/trip_covers/{filename}'))
+    # short cache: pages link the static file directly once it exists
+    return send_file(path, max_age=3600)
+
+
+# --- Chat media ---
+def media_urls(group_id, filename):
+    """URLs the chat client uses for a photo: small variants to show, the original on demand."""
+    if not filename:
+        return {}
+    urls = {'media_url': url_for('static', filename=f'uploads/{filename}')}
+    if PIL_ENABLED:
+        for variant in MEDIA_VARIANTS:
+            urls[f'{variant}_url'] = url_for('group_media_variant', group_id=group_id,
+                                             filename=filename, variant=variant)
+    return urls
+
+
+def publish_media_message(group_id, unique_name):
+    """Post a chat message for a saved upload, start its variants and broadcast it."""
+    msg = post_group_message(group_id, current_user.id, '', media_filename=unique_name)
+    media_variants.schedule(unique_name)
+    payload = {'id': msg['id'], 'user': current_user.name, 'user_id': current_user.id, 'text': '',
+               'timestamp': msg['timestamp'].isoformat() + 'Z', 'media_filename': unique_name,
+               **media_urls(group_id, unique_name)}
+    if SOCKETIO_ENABLED and socketio is not None:
+        socketio.emit('new_message', payload, room=f'group_{group_id}')
+    return payload
+
+
+def group_has_media(group_id, filename):
+    """Whether a message of this group carries the upload, so members of one group can't fetch another's photos."""
+    return db.session.query(db.exists().where(GroupMessage.group_id == group_id,
+                                              GroupMessage.media_filename == filename)).scalar()
+
+
+@app.route('/groups/<int:group_id>/media/<path:filename>/<variant>')
 @login_required
-def get_group_messages(group_id):
-    group = Group.query.get_or_404(group_id)
-    # Check if the current user is a member of the group
-    if not GroupMember.query.filter_by(group_id=group_id, user_id=current_user.id).first():
-        return jsonify({'error': 'Not a member'}), 403
-    
-    # Fetch the last 200 messages
-    messages = GroupMessage.query.filter_by(group_id=group_id).order_by(GroupMessage.timestamp.desc()).limit(200).all()
-    
-    message_list = []
-    for msg in messages:
-        message_list.append({
-            'id': msg.id,
-            'user': msg.user.name,
-            'user_id': msg.user_id,
-            'text': msg.message,
-            'timestamp': msg.timestamp.isoformat(),
-            'media_filename': msg.media_filename,
-            'location_lat': msg.location_lat,
-            'location_lng': msg.location_lng,
-            'location_label': msg.location_label,
-        })
-    return jsonify(message_list)
+def group_media_variant(group_id, filename, variant):
+    """A downscaled copy of a chat photo, rendered on first request if the pool hasn't yet."""
+    if variant not in MEDIA_VARIANTS or filename != secure_filename(filename):
+        abort(404)
+    if not is_group_member(group_id, current_user.id):
+        abort(403)
+    if not group_has_media(group_id, filename):
+        # a photo posted a moment ago may still be queued in the write-behind pipeline
+        if app.config['CHAT_WRITE_BEHIND']:
+            message_pipeline.flush()
+        if not group_has_media(group_id, filename):
+            abort(404)
+    if not os.path.exists(os.path.join(app.config['UPLOAD_FOLDER'], filename)):
+        abort(404)
+    path = media_variants.path(filename, variant)
+    if path is None:
+        return redirect(url_for('static', filename=f'uploads/{filename}'))
+    response = send_file(path, conditional=True, max_age=30 * 86400)
+    response.cache_control.public = False
+    response.cache_control.private = True
+    response.cache_control.immutable = True
+    return response
 
 
 @app.route('/groups/<int:group_id>/upload', methods=['POST'])
 @login_required
 def upload_group_media(group_id):
+    """Single-request upload for small files; the chat client uses the chunked API below."""
     grp = Group.query.get_or_404(group_id)
-    if not GroupMember.query.filter_by(group_id=group_id, user_id=current_user.id).first():
+    if not is_group_member(group_id, current_user.id):
         return jsonify({'error': 'not a member'}), 403
     # Quick content-length check (Flask will also enforce MAX_CONTENT_LENGTH)
     if request.content_length is not None and request.content_length > app.config.get('MAX_CONTENT_LENGTH', 0):
@@ -330,30 +1215,501 @@ def upload_group_media(group_id):
     except Exception as e:
         app.logger.exception('Failed to save uploaded file')
         return jsonify({'error': 'failed to save file'}), 500
-    from datetime import datetime
-    msg = GroupMessage(
-        group_id=group_id,
-        user_id=current_user.id,
-        message='',
-        media_filename=unique_name
-    )
-    db.session.add(msg)
-    db.session.commit()
-    # emit
-    room = f'group_{group_id}'
-    media_url = url_for('static', filename=f'uploads/{msg.media_filename}')
-    payload = {'id': msg.id, 'user': current_user.name, 'user_id': current_user.id, 'text': '', 'timestamp': msg.timestamp.isoformat(), 'media_filename': msg.media_filename, 'media_url': media_url}
-    if SOCKETIO_ENABLED and socketio is not None:
-        socketio.emit('message', payload, room=room)
+    try:
+        payload = publish_media_message(group_id, unique_name)
+    except ChatBackpressure:
+        os.remove(save_path)
+        return jsonify({'error': 'chat is busy, try again'}), 503
     return jsonify({'ok': True, 'message': payload})
 
 
+# Resumable uploads: POST creates an upload, PATCH appends chunks at Upload-Offset,
+# GET reports how much arrived so a client can continue after a dropped connection.
+_upload_locks = {}
+_upload_locks_guard = threading.Lock()
+
+
+def _upload_lock(upload_id):
+    with _upload_locks_guard:
+        return _upload_locks.setdefault(upload_id, threading.Lock())
+
+
+def _upload_paths(upload_id):
+    if not re.fullmatch(r'[0-9a-f]{32}', upload_id):
+        abort(404)
+    base = os.path.join(app.config['CHUNKED_UPLOAD_FOLDER'], upload_id)
+    return base + '.json', base + '.part'
+
+
+def _load_upload(group_id, upload_id):
+    meta_path, part_path = _upload_paths(upload_id)
+    try:
+        with open(meta_path) as fh:
+            meta = json.load(fh)
+    except FileNotFoundError:
+        abort(404)
+    if meta['group_id'] != group_id or meta['user_id'] != current_user.id:
+        abort(404)
+    return meta, part_path
+
+
+def _upload_status(group_id, upload_id, meta, offset):
+    return {'upload_id': upload_id, 'offset': offset, 'size': meta['size'],
+            'chunk_size': app.config['CHAT_UPLOAD_CHUNK_BYTES'],
+            'url': url_for('chunked_upload', group_id=group_id, upload_id=upload_id)}
+
+
+@app.route('/groups/<int:group_id>/uploads', methods=['POST'])
+@login_required
+def start_chunked_upload(group_id):
+    """Start a resumable upload: JSON {filename, size}."""
+    if not is_group_member(group_id, current_user.id):
+        return jsonify({'error': 'not a member'}), 403
+    data = request.get_json(silent=True) or {}
+    filename = secure_filename(str(data.get('filename') or ''))
+    try:
+        size = int(data.get('size'))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'size required'}), 400
+    if not filename or not allowed_file(filename):
+        return jsonify({'error': 'file type not allowed'}), 400
+    if size <= 0 or size > app.config['CHAT_UPLOAD_MAX_BYTES']:
+        return jsonify({'error': 'file too large'}), 413
+    upload_id = uuid.uuid4().hex
+    meta = {'group_id': group_id, 'user_id': current_user.id, 'filename': filename,
+            'size': size, 'created': time.time()}
+    meta_path, part_path = _upload_paths(upload_id)
+    open(part_path, 'wb').close()
+    with open(meta_path, 'w') as fh:
+        json.dump(meta, fh)
+    return jsonify(_upload_status(group_id, upload_id, meta, 0)), 201
+
+
+@app.route('/groups/<int:group_id>/uploads/<upload_id>', methods=['GET', 'PATCH', 'DELETE'])
+@login_required
+def chunked_upload(group_id, upload_id):
+    meta, part_path = _load_upload(group_id, upload_id)
+    with _upload_lock(upload_id):
+        if not os.path.exists(part_path):
+            abort(404)  # finished or cancelled by a concurrent request
+        offset = os.path.getsize(part_path)
+        if request.method == 'GET':
+            return jsonify(_upload_status(group_id, upload_id, meta, offset))
+        if request.method == 'DELETE':
+            _discard_upload(upload_id)
+            return jsonify({'ok': True})
+        return _append_chunk(group_id, upload_id, meta, part_path, offset)
+
+
+def _append_chunk(group_id, upload_id, meta, part_path, offset):
+    try:
+        claimed = int(request.headers.get('Upload-Offset', ''))
+    except ValueError:
+        return jsonify({'error': 'Upload-Offset header required'}), 400
+    if claimed != offset:
+        # the client lost track (e.g. a retried chunk that had already arrived): tell it where to resume
+        return jsonify({'error': 'offset mismatch', **_upload_status(group_id, upload_id, meta, offset)}), 409
+    limit = min(app.config['CHAT_UPLOAD_CHUNK_BYTES'], meta['size'] - offset)
+    written = 0
+    with open(part_path, 'ab') as fh:
+        while True:
+            block = request.stream.read(64 * 1024)
+            if not block:
+                break
+            written += len(block)
+            if written > limit:
+                fh.truncate(offset)
+                return jsonify({'error': 'chunk too large', 'offset': offset}), 413
+            fh.write(block)
+    offset += written
+    if offset < meta['size']:
+        return jsonify(_upload_status(group_id, upload_id, meta, offset))
+    return _finish_upload(group_id, upload_id, meta, part_path)
+
+
+def _finish_upload(group_id, upload_id, meta, part_path):
+    if PIL_ENABLED:
+        try:
+            with Image.open(part_path) as image:
+                image.verify()
+        except Exception:
+            _discard_upload(upload_id)
+            return jsonify({'error': 'not an image'}), 400
+    unique_name = f"{uuid.uuid4().hex}_{meta['filename']}"
+    save_path = os.path.join(app.config['UPLOAD_FOLDER'], unique_name)
+    os.replace(part_path, save_path)
+    _discard_upload(upload_id)
+    try:
+        payload = publish_media_message(group_id, unique_name)
+    except ChatBackpressure:
+        os.remove(save_path)
+        return jsonify({'error': 'chat is busy, try again'}), 503
+    return jsonify({'ok': True, 'offset': meta['size'], 'message': payload})
+
+
+def _discard_upload(upload_id):
+    for path in _upload_paths(upload_id):
+        if os.path.exists(path):
+            os.remove(path)
+    with _upload_locks_guard:
+        _upload_locks.pop(upload_id, None)
+
+
+# --- Orphaned uploads ---
+# Upload files can outlive their rows: a commit fails after the file was saved,
+# the worker stops before remove_files_later gets to it, a resumable upload is
+# abandoned. sweep_uploads() marks what is still in use with indexed IN lookups
+# (media_filename, cover_image), UPLOAD_GC_BATCH names at a time as os.scandir
+# streams each folder, and removes the rest. Files younger than UPLOAD_GC_GRACE
+# are left alone: their chat message may still be queued in message_pipeline,
+# or their trip not committed yet.
+_upload_sweep_lock = threading.Lock()
+_SOURCE_EXTENSIONS = [e for ext in sorted(ALLOWED_EXTENSIONS) for e in (ext, ext.upper())]
+
+
+def _upload_batches(folder, size):
+    """Files directly inside folder, size DirEntry objects at a time, read as the directory is walked."""
+    batch = []
+    with os.scandir(folder) as entries:
+        for entry in entries:
+            if entry.is_file(follow_symlinks=False):
+                batch.append(entry)
+                if len(batch) >= size:
+                    yield batch
+                    batch = []
+    if batch:
+        yield batch
+
+
+def _is_temp_upload(name):
+    """A half-written cover upload or variant (see save_trip_cover and ImageVariants._render)."""
+    return (name.startswith('.') and name.endswith('.upload')) or name.endswith('.tmp')
+
+
+def _variant_sources(name, variants):
+    """The names the picture a '<stem>.<variant>.<ext>' file was made from could have."""
+    parts = name.rsplit('.', 2)
+    if len(parts) != 3 or parts[1] not in variants or parts[2] not in ('jpg', 'webp'):
+        return []
+    return [f'{parts[0]}.{ext}' for ext in _SOURCE_EXTENSIONS]
+
+
+def _referenced(column, values):
+    """The given values that some row has in column (an indexed one), in one query."""
+    if not values:
+        return set()
+    with db.engine.connect() as conn:
+        return set(conn.execute(db.select(column).where(column.in_(values)).distinct()).scalars())
+
+
+def _keeps(column, wanted):
+    """wanted maps a column value to the file names it keeps; returns the names some row keeps."""
+    return {name for value in _referenced(column, list(wanted)) for name in wanted[value]}
+
+
+def _live_chat_media(names):
+    # covers saved before trip_covers existed are directly in uploads/ too
+    wanted = defaultdict(list)
+    for name in names:
+        wanted[f'uploads/{name}'].append(name)
+    return _referenced(GroupMessage.media_filename, names) | _keeps(Trip.cover_image, wanted)
+
+
+def _live_media_variants(names):
+    # variants are only a cache: one whose photo is named unexpectedly is rendered again on request
+    wanted = defaultdict(list)
+    for name in names:
+        for source in _variant_sources(name, MEDIA_VARIANTS):
+            wanted[source].append(name)
+    return _keeps(GroupMessage.media_filename, wanted)
+
+
+def _live_trip_covers(names):
+    wanted = defaultdict(list)
+    for name in names:
+        for source in [name] + _variant_sources(name, COVER_RENDITIONS):
+            wanted[f'uploads/trip_covers/{source}'].append(name)
+    return _keeps(Trip.cover_image, wanted)
+
+
+def _live_chunked_uploads(names, cutoff):
+    # the metadata is written once, so it lives as long as chunks keep arriving
+    live = set()
+    for name in names:
+        if name.endswith('.json'):
+            part = os.path.join(app.config['CHUNKED_UPLOAD_FOLDER'], name[:-len('.json')] + '.part')
+            try:
+                if os.stat(part).st_mtime >= cutoff:
+                    live.add(name)
+            except FileNotFoundError:
+                pass
+    return live
+
+
+def sweep_uploads(grace=None, dry_run=False, pause=None):
+    """
+    Remove upload files that no chat message or trip refers to and that are
+    older than grace seconds (UPLOAD_GC_GRACE). Sleeps pause seconds
+    (UPLOAD_GC_PAUSE) between batches to keep the disk and database load low.
+    Returns {folder: {'scanned': n, 'removed': n, 'bytes': n}}; with dry_run
+    nothing is deleted and the report says what would have been.
+    """
+    grace = app.config['UPLOAD_GC_GRACE'] if grace is None else grace
+    pause = app.config['UPLOAD_GC_PAUSE'] if pause is None else pause
+    now = time.time()
+    expired = now - max(grace, app.config['CHUNKED_UPLOAD_EXPIRY'])
+    folders = [
+        (app.config['UPLOAD_FOLDER'], now - grace, _live_chat_media),
+        (app.config['TRIP_COVERS_FOLDER'], now - grace, _live_trip_covers),
+        (app.config['MEDIA_VARIANTS_FOLDER'], now - grace, _live_media_variants),
+        (app.config['CHUNKED_UPLOAD_FOLDER'], expired, lambda names: _live_chunked_uploads(names, expired)),
+    ]
+    report = {}
+    with _upload_sweep_lock:
+        for folder, cutoff, live_names in folders:
+            counts = report[folder] = {'scanned': 0, 'removed': 0, 'bytes': 0}
+            if not os.path.isdir(folder):
+                continue
+            for batch in _upload_batches(folder, app.config['UPLOAD_GC_BATCH']):
+                counts['scanned'] += len(batch)
+                old = []
+                for entry in batch:
+                    if entry.name.startswith('.') and not _is_temp_upload(entry.name):
+                        continue  # e.g. .gitkeep
+                    try:
+                        if entry.stat(follow_symlinks=False).st_mtime < cutoff:
+                            old.append(entry)
+                    except FileNotFoundError:
+                        pass
+                live = live_names([entry.name for entry in old if not _is_temp_upload(entry.name)])
+                for entry in old:
+                    if entry.name in live:
+                        continue
+                    try:
+                        # stat again: save_trip_cover touches a cover it reuses while we were looking it up
+                        stat = os.stat(entry.path)
+                        if stat.st_mtime >= cutoff:
+                            continue
+                        if not dry_run:
+                            os.remove(entry.path)
+                    except FileNotFoundError:
+                        continue
+                    counts['removed'] += 1
+                    counts['bytes'] += stat.st_size
+                if pause:
+                    time.sleep(pause)
+    return report
+
+
+def format_bytes(size):
+    for unit in ('bytes', 'KB', 'MB', 'GB'):
+        if size < 1024 or unit == 'GB':
+            return f'{size} {unit}' if unit == 'bytes' else f'{size:.1f} {unit}'
+        size /= 1024
+
+
+def start_upload_sweeper(interval=None):
+    """
+    Sweep uploads every interval seconds (UPLOAD_GC_INTERVAL, 0 = never) on a
+    daemon thread. serve.py starts one in the first worker only.
+    """
+    interval = app.config['UPLOAD_GC_INTERVAL'] if interval is None else interval
+    if interval <= 0:
+        return None
+
+    def run():
+        while True:
+            # jittered, so workers restarted together don't all hit the disk at the same moment
+            time.sleep(interval * random.uniform(0.5, 1.0))
+            try:
+                with app.app_context():
+                    report = sweep_uploads()
+                removed = sum(counts['removed'] for counts in report.values())
+                reclaimed = sum(counts['bytes'] for counts in report.values())
+                app.logger.info(f'Upload sweep removed {removed} file(s), {format_bytes(reclaimed)} reclaimed')
+            except Exception:
+                app.logger.exception('Upload sweep failed')
+
+    thread = threading.Thread(target=run, name='upload-sweeper', daemon=True)
+    thread.start()
+    return thread
+
+
+_draining = threading.Event()  # set while this worker shuts down
+
+
+def local_socket_ids():
+    """Sids of the sockets connected to this worker (not the whole cluster)."""
+    if socketio is None:
+        return []
+    return [sid for sid, _ in socketio.server.manager.get_participants('/', None)]
+
+
+def drain_sockets(grace=10.0):
+    """
+    Empty this worker's chat rooms before it stops. New connections are refused,
+    connected clients get 'server_draining' so they reconnect (to another worker)
+    on their own, and whoever is still here after grace seconds is disconnected.
+    Finally the chat pipeline is flushed so no queued message is lost.
+    """
+    _draining.set()
+    sids = local_socket_ids()
+    app.logger.info(f'Draining {len(sids)} socket connections')
+    for sid in sids:
+        socketio.emit('server_draining', {'retry_ms': 2000}, to=sid)
+    deadline = time.monotonic() + grace
+    while local_socket_ids() and time.monotonic() < deadline:
+        socketio.sleep(0.1)
+    for sid in local_socket_ids():
+        socketio.server.disconnect(sid)
+    message_pipeline.flush()
+
+
+# --- Presence ---
+class LocalPresenceStore:
+    """Open sockets per (group, user) for a single worker."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = {}  # group_id -> {user_id: sockets}
+
+    def add(self, group_id, user_id, delta):
+        """Change the socket count and return the new one."""
+        with self._lock:
+            users = self._counts.setdefault(group_id, {})
+            count = users.get(user_id, 0) + delta
+            if count > 0:
+                users[user_id] = count
+            else:
+                users.pop(user_id, None)
+            return max(count, 0)
+
+    def count(self, group_id, user_id):
+        with self._lock:
+            return self._counts.get(group_id, {}).get(user_id, 0)
+
+    def online(self, group_id):
+        with self._lock:
+            return set(self._counts.get(group_id, ()))
+
+
+class RedisPresenceStore:
+    """
+    Socket counts in one Redis hash per group, shared by all workers.
+    Counts of a worker that crashes stay behind until those users reconnect and leave.
+    """
+
+    def __init__(self, url, prefix='tripmates:presence:'):
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def add(self, group_id, user_id, delta):
+        return max(int(self.client.hincrby(f'{self.prefix}{group_id}', user_id, delta)), 0)
+
+    def count(self, group_id, user_id):
+        return max(int(self.client.hget(f'{self.prefix}{group_id}', user_id) or 0), 0)
+
+    def online(self, group_id):
+        counts = self.client.hgetall(f'{self.prefix}{group_id}')
+        return {int(user_id) for user_id, count in counts.items() if int(count) > 0}
+
+
+class Presence:
+    """
+    Who is online in each group chat, counting every socket (tabs, devices) of a user.
+
+    Only the first socket coming online and the last one going away change a
+    user's state. Those changes wait debounce seconds and are then sent to the
+    room as one 'presence' event: {'group', 'online': [{id, name}], 'offline': [ids]},
+    leaving out users whose state ended where it started.
+    """
+
+    def __init__(self, store, debounce=3.0):
+        self.store = store
+        self.debounce = debounce
+        self._lock = threading.Lock()
+        self._sockets = {}  # sid -> (user_id, set of group ids)
+        self._pending = {}  # group_id -> {user_id: (was_online, name)}
+
+    def join(self, sid, group_id, user_id, name):
+        with self._lock:
+            _, groups = self._sockets.setdefault(sid, (user_id, set()))
+            if group_id in groups:
+                return
+            groups.add(group_id)
+        if self.store.add(group_id, user_id, 1) == 1:
+            self._changed(group_id, user_id, name, was_online=False)
+
+    def leave(self, sid, group_id):
+        with self._lock:
+            user_id, groups = self._sockets.get(sid, (None, set()))
+            if group_id not in groups:
+                return
+            groups.discard(group_id)
+        if self.store.add(group_id, user_id, -1) == 0:
+            self._changed(group_id, user_id, None, was_online=True)
+
+    def disconnect(self, sid):
+        with self._lock:
+            user_id, groups = self._sockets.pop(sid, (None, set()))
+        for group_id in groups:
+            if self.store.add(group_id, user_id, -1) == 0:
+                self._changed(group_id, user_id, None, was_online=True)
+
+    def snapshot(self, group_id):
+        """[{id, name}] of the users online in the group right now."""
+        user_ids = self.store.online(group_id)
+        if not user_ids:
+            return []
+        rows = db.session.query(User.id, User.name).filter(User.id.in_(user_ids)).order_by(User.name).all()
+        return [{'id': user_id, 'name': name} for user_id, name in rows]
+
+    def _changed(self, group_id, user_id, name, was_online):
+        with self._lock:
+            pending = self._pending.get(group_id)
+            first = pending is None
+            if first:
+                pending = self._pending[group_id] = {}
+            before, known_name = pending.get(user_id, (was_online, None))
+            pending[user_id] = (before, name or known_name)
+        if first:
+            socketio.start_background_task(self._flush_later, group_id)
+
+    def _flush_later(self, group_id):
+        socketio.sleep(self.debounce)
+        with self._lock:
+            pending = self._pending.pop(group_id, {})
+        online, offline = [], []
+        for user_id, (was_online, name) in pending.items():
+            now_online = self.store.count(group_id, user_id) > 0
+            if now_online == was_online:
+                continue  # flapped and came back within the debounce window
+            if now_online:
+                online.append({'id': user_id, 'name': name})
+            else:
+                offline.append(user_id)
+        if online or offline:
+            socketio.emit('presence', {'group': group_id, 'online': online, 'offline': offline},
+                          room=f'group_{group_id}')
+
+
+def presence_store():
+    """Shared presence counts when several workers run, else in-process ones."""
+    url = app.config['SOCKETIO_MESSAGE_QUEUE']
+    if uses_redis_protocol(url):
+        return RedisPresenceStore(url)
+    return LocalPresenceStore()
+
+
+presence = Presence(presence_store(), debounce=app.config['PRESENCE_DEBOUNCE_MS'] / 1000)
 
 
 if SOCKETIO_ENABLED:
     @socketio.on('connect')
     def handle_connect():
         sid = request.sid if hasattr(request, 'sid') else 'unknown'
+        if _draining.is_set():
+            return False
         app.logger.info(f"SocketIO: connect sid={sid} user_authenticated={current_user.is_authenticated}")
         if not current_user.is_authenticated:
             app.logger.info('SocketIO: unauthenticated socket connection')
@@ -362,6 +1718,8 @@ if SOCKETIO_ENABLED:
     def handle_disconnect():
         sid = request.sid if hasattr(request, 'sid') else 'unknown'
         app.logger.info(f"SocketIO: disconnect sid={sid} user={getattr(current_user,'id',None)}")
+        forget_socket_membership(sid)
+        presence.disconnect(sid)
 
     @socketio.on('join')
     def handle_join(data):
@@ -371,36 +1729,37 @@ if SOCKETIO_ENABLED:
             return
         app.logger.info(f"SocketIO: join request group={group_id} user={getattr(current_user,'id',None)}")
         # verify membership
-        if not current_user.is_authenticated or not GroupMember.query.filter_by(group_id=group_id, user_id=current_user.id).first():
+        if not current_user.is_authenticated or not is_group_member(group_id, current_user.id):
             emit('error', {'message': 'not a member or not authenticated'})
             return
+        group_id = int(group_id)
         room = f'group_{group_id}'
         join_room(room)
         app.logger.info(f"SocketIO: {current_user.name} joined room {room}")
-        # notify the joining client that they have joined
-        emit('joined', {'group': group_id})
-        # broadcast status to room
-        emit('new_message', {
-            'text': f'👋 {current_user.name} joined the chat',
-            'is_status': True,
-            'timestamp': datetime.utcnow().isoformat() + 'Z'
-        }, room=room)
+        presence.join(request.sid, group_id, current_user.id, current_user.name)
+        # notify the joining client that they have joined, with who is online
+        emit('joined', {'group': group_id, 'online': presence.snapshot(group_id)})
 
     @socketio.on('leave')
     def handle_leave(data):
         group_id = data.get('group')
         app.logger.info(f"SocketIO: leave request group={group_id} user={getattr(current_user,'id',None)}")
-        if not group_id:
+        try:
+            group_id = int(group_id)
+        except (TypeError, ValueError):
             return
         room = f'group_{group_id}'
         leave_room(room)
         app.logger.info(f"SocketIO: {getattr(current_user,'name',None)} left room {room}")
-        # notify client and broadcast
-        emit('new_message', {
-            'text': f'🚪 {getattr(current_user,"name", "A user")} left the chat',
-            'is_status': True,
-            'timestamp': datetime.utcnow().isoformat() + 'Z'
-        }, room=room)
+        presence.leave(request.sid, group_id)
+
+    @socketio.on('who_is_online')
+    def handle_who_is_online(data):
+        """Snapshot of the room's online users, returned as the event's acknowledgement."""
+        group_id = data.get('group') if isinstance(data, dict) else None
+        if not current_user.is_authenticated or not is_group_member(group_id, current_user.id):
+            return {'error': 'not a member or not authenticated'}
+        return {'group': int(group_id), 'online': presence.snapshot(int(group_id))}
 
     @socketio.on('message')
     def handle_message(data):
@@ -411,25 +1770,22 @@ if SOCKETIO_ENABLED:
             emit('error', {'message': 'group and text required'})
             return
         # membership check
-        if not current_user.is_authenticated or not GroupMember.query.filter_by(group_id=group_id, user_id=current_user.id).first():
+        if not current_user.is_authenticated or not is_group_member(group_id, current_user.id):
             emit('error', {'message': 'not a member or not authenticated'})
             return
-        from datetime import datetime
-        msg = GroupMessage(
-            group_id=group_id,
-            user_id=current_user.id,
-            message=text
-        )
-        db.session.add(msg)
-        db.session.commit()
-        app.logger.info(f"SocketIO: message saved id={msg.id} group={group_id} user={current_user.id}")
+        try:
+            msg = post_group_message(group_id, current_user.id, text)
+        except ChatBackpressure:
+            emit('error', {'message': 'chat is busy, message not sent'})
+            return
+        app.logger.info(f"SocketIO: message queued id={msg['id']} group={group_id} user={current_user.id}")
         room = f'group_{group_id}'
         emit('new_message', {
-            'id': msg.id, 
+            'id': msg['id'], 
             'user': current_user.name, 
             'user_id': current_user.id, 
             'text': text, 
-            'timestamp': msg.timestamp.isoformat() + 'Z'
+            'timestamp': msg['timestamp'].isoformat() + 'Z'
         }, room=room)
 
 
@@ -560,6 +1916,12 @@ class ItineraryForm(FlaskForm):
                 raise ValidationError('Cost must be a number, e.g. 12.50')
 
 
+class ExpenseUploadForm(FlaskForm):
+    file = FileField('CSV file', validators=[FileRequired(), FileAllowed(['csv'], 'Please upload a .csv file.')])
+    skip_invalid = BooleanField('Skip invalid rows')
+    submit = SubmitField('Upload')
+
+
 class ExpenseForm(FlaskForm):
     title = StringField('Title', validators=[InputRequired(), Length(min=1, max=200)])
     amount = StringField('Amount (₹)', validators=[InputRequired()])
@@ -576,82 +1938,211 @@ class ExpenseForm(FlaskForm):
         except Exception:
             raise ValidationError('Enter a numeric amount, e.g. 23.50')
 
-def is_trip_member(trip_id, user_id):
-    # trip owner or group member
-    t = Trip.query.get(trip_id)
-    if not t:
+# --- Membership resolver ---
+# Membership checks used to be a separate query at every call site. They now go
+# through a small cache that holds a user's active group ids (and the trips they
+# were checked against) for the lifetime of one HTTP request, or of one socket
+# connection for Socket.IO events. Routes that change membership call
+# invalidate_membership() so stale entries are dropped everywhere in this process.
+_membership_lock = threading.Lock()
+_membership_versions = {}     # user_id -> bumped whenever their membership changes
+_socket_membership_cache = {}  # socket sid -> {user_id: entry}
+
+
+def _membership_cache():
+    """The cache dict for the current request or socket connection."""
+    sid = getattr(request, 'sid', None) if has_request_context() else None
+    if sid is not None:
+        return _socket_membership_cache.setdefault(sid, {})
+    if has_app_context():
+        if 'membership_cache' not in g:
+            g.membership_cache = {}
+        return g.membership_cache
+    return {}
+
+
+def _membership_entry(user_id):
+    cache = _membership_cache()
+    version = _membership_versions.get(user_id, 0)
+    entry = cache.get(user_id)
+    now = time.monotonic()
+    # socket caches live as long as the connection, and other workers can't bump our versions
+    if entry is None or entry['version'] != version or now - entry['loaded'] > app.config['SOCKET_MEMBERSHIP_TTL']:
+        rows = (db.session.query(GroupMember.group_id)
+                .filter_by(user_id=user_id, status='active')
+                .all())
+        entry = {'version': version, 'loaded': now, 'groups': frozenset(gid for (gid,) in rows), 'trips': {}}
+        cache[user_id] = entry
+    return entry
+
+
+def active_group_ids(user_id):
+    """Ids of the groups where the user is an active (not pending) member."""
+    return _membership_entry(user_id)['groups']
+
+
+def is_group_member(group_id, user_id):
+    """True if the user is an active member of the group."""
+    try:
+        group_id = int(group_id)
+    except (TypeError, ValueError):
         return False
-    if t.user_id == user_id:
-        return True
-    # if trip is linked to a group, check group membership
-    if getattr(t, 'group_id', None):
-        if GroupMember.query.filter_by(group_id=t.group_id, user_id=user_id).first():
-            return True
-    return False
-
-def compute_balances(trip_id):
-    """
-    Calculate how much each user owes or is owed for a specific trip.
-    Returns a dictionary: user_id -> balance
-    Positive balance: User is owed money.
-    Negative balance: User owes money.
+    return group_id in active_group_ids(user_id)
+
+
+def invalidate_membership(*user_ids):
+    """Forget cached membership for these users after their GroupMember rows change."""
+    with _membership_lock:
+        for user_id in user_ids:
+            _membership_versions[user_id] = _membership_versions.get(user_id, 0) + 1
+    if has_app_context() and 'membership_cache' in g:
+        for user_id in user_ids:
+            g.membership_cache.pop(user_id, None)
+
+
+def forget_socket_membership(sid):
+    """Drop the cache of a socket connection when it disconnects."""
+    _socket_membership_cache.pop(sid, None)
+
+
+def is_trip_member(trip_id, user_id):
+    # trip owner or active member of the trip's group
+    entry = _membership_entry(user_id)
+    if trip_id in entry['trips']:
+        return entry['trips'][trip_id]
+    t = db.session.get(Trip, trip_id)
+    allowed = bool(t) and (t.user_id == user_id or (t.group_id is not None and t.group_id in entry['groups']))
+    entry['trips'][trip_id] = allowed
+    return allowed
+
+def to_minor_units(amount):
+    """Convert a rupee amount (float, str or Decimal) to integer paise."""
+    return int((Decimal(str(amount)) * 100).quantize(Decimal('1'), rounding=ROUND_HALF_UP))
+
+
+MAX_AMOUNT = Decimal('1e10')  # Expense.amount is NUMERIC(12, 2)
+
+
+def parse_amount(text):
     """
-    # Fetch all expenses related to this trip
-    expenses = Expense.query.filter_by(trip_id=trip_id).all()
-    balances = {}
+    A rupee amount (form field or imported row) as a Decimal rounded to paise, the
+    way to_minor_units rounds it, so the stored amount and the ledger agree.
+    ValueError, with the reason as its message, unless 0 < amount < MAX_AMOUNT.
+    """
+    try:
+        amount = Decimal(str(text).strip()).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+    except InvalidOperation:
+        raise ValueError('must be a number, e.g. 23.50')
+    if not amount.is_finite():
+        raise ValueError('must be a number, e.g. 23.50')
+    if amount <= 0 or amount >= MAX_AMOUNT:
+        raise ValueError(f'must be greater than 0 and less than {MAX_AMOUNT:,.0f}')
+    return amount
 
-    for expense in expenses:
-        total_amount = float(expense.amount)
-        # Participants are the people sharing this expense
-        participants = expense.participants or []
-        
-        if len(participants) > 0:
-            share_per_person = total_amount / len(participants)
-        else:
-            # If no participants, the payer pays for themselves (no split)
-            share_per_person = 0
 
-        # 1. Update Payer's Balance
-        # The payer initially gets the full amount back, minus their own share
-        payer_id = expense.payer_id
-        balances.setdefault(payer_id, 0.0)
-        
-        if share_per_person == 0:
-            balances[payer_id] += total_amount
+def expense_deltas(amount, payer_id, participant_ids):
+    """
+    Return the balance change (in paise) that one expense causes for each user.
+    The payer is credited the full amount and every participant is debited an
+    equal share. Paise left over from an uneven split are charged to the lowest
+    user ids, so the deltas of an expense always add up to exactly zero.
+    If there are no participants the payer paid for themselves and nothing changes.
+    """
+    participant_ids = sorted(set(participant_ids))
+    if not participant_ids:
+        return {}
+    total = to_minor_units(amount)
+    share, remainder = divmod(total, len(participant_ids))
+    deltas = {payer_id: total}
+    for index, user_id in enumerate(participant_ids):
+        owed = share + (1 if index < remainder else 0)
+        deltas[user_id] = deltas.get(user_id, 0) - owed
+    return deltas
+
+
+def deltas_for_expense(expense):
+    """Balance deltas for an Expense row as it currently stands."""
+    return expense_deltas(expense.amount, expense.payer_id, [u.id for u in expense.participants])
+
+
+def apply_balance_deltas(trip_id, deltas, sign=1):
+    """
+    Add (or with sign=-1, subtract) per-user deltas to the trip's balance ledger.
+    Runs inside the caller's transaction; the caller is responsible for commit.
+    Rows are bumped atomically in the database so concurrent writers cannot lose updates.
+    """
+    rows = [{'trip_id': trip_id, 'user_id': user_id, 'balance_minor': sign * delta}
+            for user_id, delta in deltas.items()]
+    if not rows:
+        return
+    dialect = db.session.get_bind().dialect.name
+    if dialect in ('sqlite', 'postgresql'):
+        # one INSERT ... ON CONFLICT DO UPDATE: two writers creating a user's first row can't collide
+        if dialect == 'sqlite':
+            from sqlalchemy.dialects.sqlite import insert
         else:
-            # Payer is owed (Total - their personal share)
-            balances[payer_id] += (total_amount - share_per_person)
-
-        # 2. Update Participants' Balances
-        # Each participant owes their share
-        for participant in participants:
-            # Use participant.id (SQLAlchemy model) or ID directly
-            participant_id = participant.id if hasattr(participant, 'id') else participant
-            
-            # Skip if participant is also the payer (payer's share handled above)
-            if participant_id == payer_id:
-                continue
-                
-            balances.setdefault(participant_id, 0.0)
-            balances[participant_id] -= share_per_person
-            
-    return balances
+            from sqlalchemy.dialects.postgresql import insert
+        stmt = insert(TripBalance).values(rows)
+        db.session.execute(stmt.on_conflict_do_update(
+            index_elements=['trip_id', 'user_id'],
+            set_={'balance_minor': TripBalance.balance_minor + stmt.excluded.balance_minor}))
+        return
+    for row in rows:
+        result = db.session.execute(
+            db.update(TripBalance)
+            .where(TripBalance.trip_id == trip_id, TripBalance.user_id == row['user_id'])
+            .values(balance_minor=TripBalance.balance_minor + row['balance_minor'])
+            .execution_options(synchronize_session=False)
+        )
+        if result.rowcount == 0:
+            db.session.add(TripBalance(**row))
+            db.session.flush()
 
 
-def compute_settlements(balances):
+def get_trip_balances(trip_id):
+    """Read the stored ledger for a trip: user_id -> balance in paise."""
+    rows = db.session.query(TripBalance.user_id, TripBalance.balance_minor).filter_by(trip_id=trip_id).all()
+    return {user_id: balance for user_id, balance in rows}
+
+
+def load_trip_expenses(trip_id):
     """
-    Convert net balances into a list of specific 'who pays whom' transactions.
-    This uses a simple greedy algorithm to minimize the number of payments.
+    Load all expenses of a trip (newest first) together with their payer and
+    participants. Always three statements or fewer, however many expenses
+    there are, so callers can walk e.payer / e.participants without lazy loads.
     """
-    creditors = [] # People people who are owed money (positive balance)
-    debtors = []   # People who owe money (negative balance)
+    return (Expense.query
+            .options(db.joinedload(Expense.payer), db.selectinload(Expense.participants))
+            .filter_by(trip_id=trip_id)
+            .order_by(Expense.id.desc())
+            .all())
 
-    for user_id, balance in balances.items():
-        amount = round(balance, 2)
-        if amount > 0:
-            creditors.append([user_id, amount])
-        elif amount < 0:
-            debtors.append([user_id, -amount]) # Convert to positive for easier math
+
+def compute_balances(trip_id, expenses=None):
+    """
+    Rebuild the balances of a trip from scratch by replaying all of its expenses.
+    Returns a dictionary: user_id -> balance in paise.
+    Pass expenses already returned by load_trip_expenses() to avoid loading them twice.
+    This is the slow path used to verify and repair the TripBalance ledger;
+    pages should read get_trip_balances() instead.
+    """
+    if expenses is None:
+        expenses = load_trip_expenses(trip_id)
+    balances = {}
+    for expense in expenses:
+        for user_id, delta in deltas_for_expense(expense).items():
+            balances[user_id] = balances.get(user_id, 0) + delta
+    return balances
+
+
+def _greedy_settlements(balances):
+    """
+    Match the largest debtor with the largest creditor until everyone is settled.
+    Works on integer paise, so every step zeroes at least one person exactly
+    and n people never need more than n - 1 transfers.
+    """
+    creditors = [[user_id, amount] for user_id, amount in balances.items() if amount > 0]
+    debtors = [[user_id, -amount] for user_id, amount in balances.items() if amount < 0]
 
     # Sort to settle largest debts first
     creditors.sort(key=lambda x: x[1], reverse=True)
@@ -660,43 +2151,291 @@ def compute_settlements(balances):
     settlements = []
     debtor_idx = 0
     creditor_idx = 0
-
-    # Match debtors with creditors until everything is settled
     while debtor_idx < len(debtors) and creditor_idx < len(creditors):
         debtor_id, amount_owed = debtors[debtor_idx]
         creditor_id, amount_due = creditors[creditor_idx]
-
-        # The amount to transfer is the smaller of what's owed or what's due
         transfer_amount = min(amount_owed, amount_due)
-        
-        settlements.append({
-            'from': debtor_id, 
-            'to': creditor_id, 
-            'amount': round(transfer_amount, 2)
-        })
-
-        # Update remaining amounts
+        settlements.append({'from': debtor_id, 'to': creditor_id, 'amount': transfer_amount})
         debtors[debtor_idx][1] -= transfer_amount
         creditors[creditor_idx][1] -= transfer_amount
-
-        # Move to next person if their balance is now zero
         if debtors[debtor_idx][1] == 0:
             debtor_idx += 1
         if creditors[creditor_idx][1] == 0:
             creditor_idx += 1
+    return settlements
+
+
+def _optimal_settlements(balances, deadline):
+    """
+    Minimum number of transfers, or None if the search would not finish in time.
+
+    A group of k people whose balances sum to zero can always settle among
+    themselves in k - 1 transfers, so the fewest transfers overall is
+    n - (the largest number of disjoint zero-sum groups). Exact opposites
+    (+x / -x) always form a group of two and are paired up front; the rest is
+    a memoised search over subsets (dp[mask] = most zero-sum groups inside mask).
+    """
+    settlements = []
+    # pair exact opposites first, they are always part of an optimal answer
+    by_amount = {}
+    remaining = []
+    for user_id, amount in sorted(balances.items(), key=lambda item: item[0]):
+        if amount == 0:
+            continue
+        partner = by_amount.get(-amount)
+        if partner:
+            other = partner.pop()
+            debtor, creditor = (user_id, other) if amount < 0 else (other, user_id)
+            settlements.append({'from': debtor, 'to': creditor, 'amount': abs(amount)})
+            remaining.remove((other, -amount))
+        else:
+            by_amount.setdefault(amount, []).append(user_id)
+            remaining.append((user_id, amount))
+
+    n = len(remaining)
+    if n == 0:
+        return settlements
+    if n > app.config['SETTLEMENT_MAX_OPTIMAL_PARTIES']:
+        return None
+
+    amounts = [amount for _, amount in remaining]
+    full = (1 << n) - 1
+    subset_sum = [0] * (full + 1)
+    best = [0] * (full + 1)
+    for mask in range(1, full + 1):
+        if mask & 0xFFF == 0 and time.monotonic() > deadline:
+            return None
+        low_bit = mask & -mask
+        subset_sum[mask] = subset_sum[mask ^ low_bit] + amounts[low_bit.bit_length() - 1]
+        top = 0
+        bits = mask
+        while bits:
+            bit = bits & -bits
+            if best[mask ^ bit] > top:
+                top = best[mask ^ bit]
+            bits ^= bit
+        best[mask] = top + (1 if subset_sum[mask] == 0 else 0)
+
+    # walk the table back to recover the groups themselves
+    order = []
+    mask = full
+    while mask:
+        target = best[mask] - (1 if subset_sum[mask] == 0 else 0)
+        bits = mask
+        while bits:
+            bit = bits & -bits
+            if best[mask ^ bit] == target:
+                break
+            bits ^= bit
+        order.append(bit.bit_length() - 1)
+        mask ^= bit
+    order.reverse()
+
+    group, running = {}, 0
+    for index in order:
+        user_id, amount = remaining[index]
+        group[user_id] = amount
+        running += amount
+        if running == 0:
+            settlements.extend(_greedy_settlements(group))
+            group = {}
+    return settlements
+
+
+def compute_settlements(balances, mode=None, time_budget=None):
+    """
+    Convert net balances into a list of specific 'who pays whom' transactions.
+    balances: user_id -> balance in paise (integers, summing to zero).
+    Returns a list of {'from': user_id, 'to': user_id, 'amount': paise}.
+
+    mode='greedy' is fast and needs at most n - 1 transfers.
+    mode='optimal' finds the minimum number of transfers; it falls back to the
+    greedy answer for large groups or when it runs past time_budget seconds.
+    Both default to the SETTLEMENT_MODE / SETTLEMENT_TIME_BUDGET config.
+    """
+    mode = mode or app.config['SETTLEMENT_MODE']
+    if time_budget is None:
+        time_budget = app.config['SETTLEMENT_TIME_BUDGET']
+    if mode == 'optimal':
+        if sum(balances.values()) != 0:
+            app.logger.warning('Balances do not sum to zero; using greedy settlements')
+        else:
+            settlements = _optimal_settlements(balances, time.monotonic() + time_budget)
+            if settlements is not None:
+                return settlements
+            app.logger.info(f'Optimal settlement search gave up for {len(balances)} people; using greedy')
+    return _greedy_settlements(balances)
+
+
+# --- HTTP caching and compression ---
+# Pages carry weak ETags built from cheap version stamps: a trip's or group's
+# `version` column (bumped below on every ORM change) and the newest chat message
+# id. A browser revalidating an unchanged page gets a 304 before the view runs.
+COMPRESSIBLE_MIMETYPES = {'text/html', 'application/json', 'text/plain', 'text/css',
+                          'text/javascript', 'application/javascript', 'image/svg+xml'}
+
+
+@event.listens_for(Session, 'before_flush')
+def _bump_versions(session, flush_context, instances):
+    """Bump Trip.version / Group.version (and ItineraryItem.version) for every row touched by this flush."""
+    trip_ids, group_ids = set(), set()
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, Trip):
+            trip_ids.add(obj.id)
+        elif isinstance(obj, ItineraryItem):
+            trip_ids.add(obj.trip_id)
+            if obj in session.dirty and obj.version is not None:
+                obj.version = max(initial_version(), obj.version + 1)
+        elif isinstance(obj, (Expense, TripBalance)):
+            trip_ids.add(obj.trip_id)
+        elif isinstance(obj, Group):
+            group_ids.add(obj.id)
+        elif isinstance(obj, GroupMember):
+            group_ids.add(obj.group_id)
+    touch_versions(trip_ids, group_ids, orm_session=session)
+
+
+def touch_versions(trip_ids=(), group_ids=(), orm_session=None):
+    """Bump version stamps directly; for writes that bypass the ORM (bulk inserts)."""
+    connection = (orm_session or db.session).connection()
+    for table, ids in ((Trip.__table__, trip_ids), (Group.__table__, group_ids)):
+        ids = {i for i in ids if i is not None}  # new rows start from initial_version()
+        if ids:
+            connection.execute(table.update().where(table.c.id.in_(ids)).values(version=table.c.version + 1))
+
+
+def after_commit(callback, *args):
+    """Run callback(*args) once the current transaction commits; forgotten if it rolls back."""
+    db.session.info.setdefault('after_commit', []).append((callback, args))
+
+
+@event.listens_for(Session, 'after_commit')
+def _run_after_commit(session):
+    for callback, args in session.info.pop('after_commit', ()):
+        try:
+            callback(*args)
+        except Exception:
+            app.logger.exception(f'after_commit callback {callback.__name__} failed')
+
+
+@event.listens_for(Session, 'after_rollback')
+def _drop_after_commit(session):
+    session.info.pop('after_commit', None)
+
+
+_release = None
+
+
+def release_stamp():
+    """Hash of the code, templates and asset manifest, so a deploy changes every ETag."""
+    global _release
+    if _release is None:
+        digest = hashlib.sha1(json.dumps(asset_manifest, sort_keys=True).encode())
+        paths = [os.path.abspath(__file__)]
+        for root, dirs, files in os.walk(os.path.join(app.root_path, app.template_folder)):
+            paths.extend(os.path.join(root, name) for name in sorted(files))
+        for path in paths:
+            with open(path, 'rb') as f:
+                digest.update(f.read())
+        _release = digest.hexdigest()[:12]
+    return _release
+
+
+def trip_version(trip_id):
+    """(trip version, group version) for a trip the current user may see, else None."""
+    if not is_trip_member(trip_id, current_user.id):
+        return None
+    return (db.session.query(Trip.version, Group.version)
+            .outerjoin(Group, Group.id == Trip.group_id)
+            .filter(Trip.id == trip_id)
+            .first())
+
+
+def group_version(group_id):
+    """
+    (group version, newest message id) for a group the current user is in, else
+    None. The chat pipeline bumps the version with every batch it saves, since with
+    ids from a shared counter a message can land below the newest id.
+    """
+    if not is_group_member(group_id, current_user.id):
+        return None
+    newest = db.session.query(db.func.max(GroupMessage.id)).filter(GroupMessage.group_id == group_id).scalar_subquery()
+    return db.session.query(Group.version, newest).filter(Group.id == group_id).first()
+
+
+def conditional(version_of, forms=False):
+    """
+    Answer conditional GETs from a version stamp. version_of(**view_args) returns
+    something that changes whenever the response would, or None to always run the
+    view (e.g. when the user may not see the page and the view should refuse).
+    Pages with forms=True embed CSRF tokens, which expire, so their ETag also
+    turns over every half token lifetime.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            stamp = version_of(**kwargs)
+            # a pending flash message has to be rendered, so never answer 304 with one queued
+            if stamp is None or '_flashes' in session:
+                return view(*args, **kwargs)
+            key = (release_stamp(), request.endpoint, current_user.id) + tuple(stamp)
+            if forms:
+                limit = app.config.get('WTF_CSRF_TIME_LIMIT')
+                key += (session.get('csrf_token'), int(time.time() // (limit / 2)) if limit else 0)
+            etag = hashlib.sha1(repr(key).encode()).hexdigest()[:24]
+            if request.if_none_match.contains_weak(etag):
+                response = app.response_class(status=304)
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag, weak=True)
+            # the browser may keep the page but must check back each time
+            response.cache_control.private = True
+            response.cache_control.no_cache = True
+            return response
+        return wrapper
+    return decorator
+
+
+def _compress(data, encoding):
+    if encoding == 'br':
+        return brotli.compress(data, quality=5)
+    return gzip.compress(data, compresslevel=6)
+
+
+@app.after_request
+def compress_response(response):
+    """gzip/Brotli-compress large HTML and JSON bodies (files and streams are left alone)."""
+    if (not app.config['COMPRESS_RESPONSES'] or response.status_code != 200
+            or response.direct_passthrough or response.is_streamed
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+        return response
+    response.vary.add('Accept-Encoding')
+    if response.content_length is not None and response.content_length < app.config['COMPRESS_MIN_BYTES']:
+        return response
+    encodings = ['br', 'gzip'] if BROTLI_ENABLED else ['gzip']
+    encoding = next((e for e in encodings if request.accept_encodings[e]), None)
+    if encoding is None:
+        return response
+    response.set_data(_compress(response.get_data(), encoding))
+    response.headers['Content-Encoding'] = encoding
+    return response
 
-    return settlements
 
 # Expenses routes
 @app.route('/trip/<int:trip_id>/expenses')
 @login_required
+@conditional(trip_version, forms=True)
 def trip_expenses(trip_id):
     trip = Trip.query.get_or_404(trip_id)
     # allow trip owner or participants — using owner check for now
     # TODO: extend to group members if trips can be shared
     if not is_trip_member(trip_id, current_user.id):
         abort(403)
-    expenses = Expense.query.filter_by(trip_id=trip_id).order_by(Expense.id.desc()).all()
+    # one round trip for expenses + payers, one for all participants
+    expenses = load_trip_expenses(trip_id)
     # prepare participants display
     exp_list = []
     for e in expenses:
@@ -708,34 +2447,16 @@ def trip_expenses(trip_id):
             'participants': [u.name for u in e.participants],
             'notes': e.notes
         })
-    balances = compute_balances(trip_id)
-    # translate balances to readable form
-    user_balances = []
-    # get all users involved: trip owner + participants + payers
-    user_ids = set()
-    # Add balance keys (should be user IDs)
-    for uid in balances.keys():
-        user_ids.add(int(uid) if not isinstance(uid, int) else uid)
-    # Add participants and payer IDs
-    for e in expenses:
-        user_ids.update([int(u.id) if hasattr(u, 'id') else int(u) for u in e.participants])
-        user_ids.add(int(e.payer_id))
-    # Ensure all are integers
-    user_ids = {int(uid) for uid in user_ids}
-    users = User.query.filter(User.id.in_(list(user_ids))).all() if user_ids else []
-    user_map = {u.id: u for u in users}
-    
-    # Normalize balances dictionary keys to integers for lookup
-    normalized_balances = {}
-    for key, value in balances.items():
-        normalized_key = int(key.id) if hasattr(key, 'id') else int(key)
-        normalized_balances[normalized_key] = value
-    
-    for uid in user_ids:
-        u = user_map.get(uid)
-        balance = normalized_balances.get(uid, 0.0)
-        user_balances.append({'user_id': uid, 'name': u.name if u else 'Unknown', 'balance': round(balance, 2)})
-    # compute settlements (use normalized balances)
+    # balances come from the incrementally maintained ledger (one row per member)
+    ledger = (db.session.query(TripBalance, User)
+              .join(User, User.id == TripBalance.user_id)
+              .filter(TripBalance.trip_id == trip_id)
+              .all())
+    user_map = {u.id: u for _, u in ledger}
+    normalized_balances = {row.user_id: row.balance_minor for row, _ in ledger}
+    user_balances = [{'user_id': row.user_id, 'name': u.name, 'balance': round(row.balance_minor / 100, 2)}
+                     for row, u in ledger]
+    # compute settlements on exact paise, convert to rupees only for display
     settlements_raw = compute_settlements(normalized_balances)
     settlements = []
     for s in settlements_raw:
@@ -744,11 +2465,12 @@ def trip_expenses(trip_id):
         settlements.append({
             'from': from_id, 
             'to': to_id, 
-            'amount': s['amount'], 
+            'amount': s['amount'] / 100,
             'from_name': user_map.get(from_id).name if user_map.get(from_id) else str(from_id), 
             'to_name': user_map.get(to_id).name if user_map.get(to_id) else str(to_id)
         })
-    return render_template('trip_expenses.html', trip=trip, expenses=exp_list, balances=user_balances, settlements=settlements)
+    return render_template('trip_expenses.html', trip=trip, expenses=exp_list, balances=user_balances, settlements=settlements,
+                           upload_form=ExpenseUploadForm())
 
 
 @app.route('/trip/<int:trip_id>/expenses/create', methods=['GET','POST'])
@@ -761,7 +2483,7 @@ def create_expense(trip_id):
     # populate payer/participants choices from users involved in the trip: owner + group members
     users_q = [trip.owner]
     if getattr(trip, 'group_id', None):
-        members = GroupMember.query.filter_by(group_id=trip.group_id).all()
+        members = GroupMember.query.filter_by(group_id=trip.group_id, status='active').all()
         users_q = [trip.owner] + [m.user for m in members]
     # dedupe
     seen = set()
@@ -783,12 +2505,9 @@ def create_expense(trip_id):
                 
                 # Parse amount
                 try:
-                    amount = float(form.amount.data)
-                    if amount <= 0:
-                        flash('Amount must be greater than 0', 'danger')
-                        return render_template('create_expense.html', trip=trip, form=form)
-                except (ValueError, TypeError):
-                    flash('Invalid amount. Please enter a valid number.', 'danger')
+                    amount = parse_amount(form.amount.data)
+                except ValueError as e:
+                    flash(f'Amount {e}', 'danger')
                     return render_template('create_expense.html', trip=trip, form=form)
                 
                 payer_id = form.payer.data
@@ -814,6 +2533,7 @@ def create_expense(trip_id):
                     exp.participants = users
                 
                 db.session.add(exp)
+                apply_balance_deltas(trip_id, deltas_for_expense(exp))
                 db.session.commit()
                 
                 flash(f'Expense "{title}" added successfully! ₹{amount:.2f}', 'success')
@@ -844,7 +2564,7 @@ def edit_expense(expense_id):
     trip = exp.trip
     users_q = [trip.owner]
     if getattr(trip, 'group_id', None):
-        members = GroupMember.query.filter_by(group_id=trip.group_id).all()
+        members = GroupMember.query.filter_by(group_id=trip.group_id, status='active').all()
         users_q = [trip.owner] + [m.user for m in members]
     seen = set()
     choices = []
@@ -857,19 +2577,17 @@ def edit_expense(expense_id):
     if request.method == 'POST':
         if form.validate_on_submit():
             try:
+                # remember what this expense contributed before it changes
+                old_deltas = deltas_for_expense(exp)
                 exp.title = form.title.data.strip()
                 if not exp.title:
                     flash('Title is required', 'danger')
                     return render_template('create_expense.html', trip=exp.trip, form=form)
                 
                 try:
-                    amount = float(form.amount.data)
-                    if amount <= 0:
-                        flash('Amount must be greater than 0', 'danger')
-                        return render_template('create_expense.html', trip=exp.trip, form=form)
-                    exp.amount = amount
-                except (ValueError, TypeError):
-                    flash('Invalid amount. Please enter a valid number.', 'danger')
+                    exp.amount = parse_amount(form.amount.data)
+                except ValueError as e:
+                    flash(f'Amount {e}', 'danger')
                     return render_template('create_expense.html', trip=exp.trip, form=form)
                 
                 exp.payer_id = form.payer.data
@@ -879,7 +2597,12 @@ def edit_expense(expense_id):
                 else:
                     exp.participants = []
                 exp.notes = (form.notes.data or '').strip() or None
-                
+
+                # apply only the difference to the ledger
+                new_deltas = deltas_for_expense(exp)
+                changes = {uid: new_deltas.get(uid, 0) - old_deltas.get(uid, 0)
+                           for uid in set(old_deltas) | set(new_deltas)}
+                apply_balance_deltas(exp.trip_id, changes)
                 db.session.commit()
                 flash(f'Expense updated successfully! ₹{exp.amount:.2f}', 'success')
                 return redirect(url_for('trip_expenses', trip_id=exp.trip_id))
@@ -908,11 +2631,355 @@ def delete_expense(expense_id):
     exp = Expense.query.get_or_404(expense_id)
     if not is_trip_member(exp.trip_id, current_user.id):
         abort(403)
+    apply_balance_deltas(exp.trip_id, deltas_for_expense(exp), sign=-1)
     db.session.delete(exp)
     db.session.commit()
     flash('Expense deleted', 'info')
     return redirect(url_for('trip_expenses', trip_id=exp.trip_id))
 
+# Bulk expense ingestion: a JSON/CSV API and a CSV upload on the expenses page.
+# Payers and participants are checked against the trip's people fetched once;
+# expenses, participant links and the ledger change go in with Core bulk inserts
+# in one transaction.
+EXPENSE_FORMATS = {'csv': ('text/csv', '.csv'), 'json': ('application/json', '.json')}
+EXPENSE_IMPORT_BATCH = 1000
+EXPENSE_IMPORT_MAX_ERRORS = 100
+
+
+def trip_people(trip):
+    """{user_id: User} for the trip owner and the active members of its group (one query)."""
+    query = User.query.filter(User.id == trip.user_id)
+    if trip.group_id:
+        member_ids = db.session.query(GroupMember.user_id).filter_by(group_id=trip.group_id, status='active')
+        query = User.query.filter(db.or_(User.id == trip.user_id, User.id.in_(member_ids)))
+    return {user.id: user for user in query}
+
+
+def _person_lookup(people):
+    """Resolve a user id, email or (unambiguous) name to a member id, else None."""
+    by_key = {}
+    names = defaultdict(set)
+    for user in people.values():
+        by_key[str(user.id)] = user.id
+        by_key[user.email.lower()] = user.id
+        names[user.name.strip().casefold()].add(user.id)
+    for name, ids in names.items():
+        if len(ids) == 1:
+            by_key.setdefault(name, next(iter(ids)))
+
+    def lookup(value):
+        return by_key.get(str(value).strip().casefold())
+    return lookup
+
+
+def parse_expense_csv(text):
+    return parse_csv_records(text, ('title', 'amount', 'payer'))
+
+
+def parse_expense_json(text):
+    data = json.loads(text)
+    if isinstance(data, dict):
+        data = data.get('expenses')
+    if not isinstance(data, list):
+        raise ValueError('JSON must be a list of expenses or an object with an "expenses" list')
+    for record in data:
+        yield record if isinstance(record, dict) else {}
+
+
+EXPENSE_PARSERS = {'csv': parse_expense_csv, 'json': parse_expense_json}
+
+
+def validate_expense_row(record, lookup, people):
+    """Check one imported expense; returns ((row, participant ids), errors)."""
+    errors = []
+    title = str(record.get('title') or '').strip()
+    if not title or len(title) > 200:
+        errors.append('title: required, at most 200 characters')
+    amount = None
+    try:
+        amount = parse_amount(record.get('amount') or '')
+    except ValueError as e:
+        errors.append(f'amount: {e}')
+    payer = record.get('payer_id', record.get('payer'))
+    payer_id = lookup(payer) if payer not in (None, '') else None
+    if payer_id is None:
+        errors.append(f'payer: {payer!r} is not on this trip' if payer not in (None, '') else 'payer: required')
+    participants = record.get('participant_ids', record.get('participants'))
+    if participants in (None, ''):
+        participants = []
+    elif isinstance(participants, str):
+        participants = list(people) if participants.strip().lower() == 'all' else \
+            [p for p in re.split(r'[;|]', participants) if p.strip()]
+    elif not isinstance(participants, list):
+        participants = [participants]
+    participant_ids = set()
+    for participant in participants:
+        user_id = lookup(participant)
+        if user_id is None:
+            errors.append(f'participants: {participant!r} is not on this trip')
+        else:
+            participant_ids.add(user_id)
+    notes = str(record.get('notes') or '').strip()
+    if errors:
+        return None, errors
+    row = {'title': title, 'amount': amount, 'payer_id': payer_id, 'notes': notes or None}
+    return (row, sorted(participant_ids)), []
+
+
+def ingest_expenses(trip, records, skip_invalid=False, dry_run=False):
+    """
+    Validate and insert many expenses for a trip. Returns (report, status): 422
+    with nothing saved if a row is invalid and skip_invalid is off, else 201.
+    """
+    people = trip_people(trip)
+    lookup = _person_lookup(people)
+    valid, errors = [], []
+    for number, record in enumerate(records, start=1):
+        parsed, row_errors = validate_expense_row(record, lookup, people)
+        if row_errors:
+            errors.append({'row': number, 'title': str(record.get('title') or '')[:80], 'errors': row_errors})
+        else:
+            valid.append(parsed)
+    report = {'rows': len(records), 'imported': 0, 'error_count': len(errors),
+              'errors': errors[:EXPENSE_IMPORT_MAX_ERRORS]}
+    if errors and not skip_invalid:
+        return report, 422
+    if dry_run or not valid:
+        report['valid'] = len(valid)
+        return report, 200
+
+    table = Expense.__table__
+    ledger = defaultdict(int)
+    for start in range(0, len(valid), EXPENSE_IMPORT_BATCH):
+        batch = valid[start:start + EXPENSE_IMPORT_BATCH]
+        rows = [dict(row, trip_id=trip.id) for row, _ in batch]
+        if db.session.get_bind().dialect.name == 'sqlite':
+            # SQLite runs an ordered RETURNING insert row by row. One executemany instead: from
+            # its first row this transaction holds the write lock, so the new ids are consecutive
+            db.session.execute(table.insert(), rows)
+            last_id = db.session.execute(db.select(db.func.max(table.c.id))).scalar()
+            expense_ids = range(last_id - len(rows) + 1, last_id + 1)
+        else:
+            expense_ids = db.session.execute(
+                table.insert().returning(table.c.id, sort_by_parameter_order=True), rows).scalars()
+        links = []
+        for expense_id, (row, participant_ids) in zip(expense_ids, batch):
+            links.extend({'expense_id': expense_id, 'user_id': user_id} for user_id in participant_ids)
+            for user_id, delta in expense_deltas(row['amount'], row['payer_id'], participant_ids).items():
+                ledger[user_id] += delta
+        if links:
+            db.session.execute(expense_participants.insert(), links)
+    apply_balance_deltas(trip.id, {user_id: delta for user_id, delta in ledger.items() if delta})
+    touch_versions(trip_ids=[trip.id])  # the inserts bypass the ORM hook
+    db.session.commit()
+    report['imported'] = len(valid)
+    return report, 201
+
+
+def import_request_error(formats):
+    """
+    Why an import request may have been forged, or None. Any site can make a
+    browser post a form (multipart, urlencoded or text/plain) with our cookies,
+    so a multipart upload needs the CSRF token (form field csrf_token or an
+    X-CSRFToken header). A body sent as one of the formats' content types can't
+    come from another site without a CORS preflight, which is never granted.
+    """
+    if request.mimetype in {mimetype for mimetype, _ in formats.values()}:
+        return None
+    if request.mimetype != 'multipart/form-data':
+        return f"send the file as the body with a {' or '.join(m for m, _ in formats.values())} content type"
+    try:
+        validate_csrf(request.form.get('csrf_token') or request.headers.get('X-CSRFToken'))
+    except ValidationError:
+        return 'missing or invalid CSRF token'
+    return None
+
+
+def _read_import(formats, parsers):
+    """Parse the uploaded file or request body; returns (records, error message)."""
+    fmt = _import_format(formats)
+    if fmt is None:
+        return None, f"unknown format; use {', '.join(formats)}"
+    upload = request.files.get('file')
+    raw = upload.read() if upload else request.get_data()
+    try:
+        return list(parsers[fmt](raw.decode('utf-8-sig'))), None
+    except (UnicodeDecodeError, ValueError, csv.Error) as e:
+        return None, f'could not read the {fmt} file: {e}'
+
+
+@app.route('/trip/<int:trip_id>/expenses/bulk', methods=['POST'])
+@login_required
+def bulk_expenses(trip_id):
+    """
+    Add many expenses at once from JSON or CSV (body or multipart 'file').
+    Each row has title, amount, payer and optionally participants and notes;
+    people are given by user id, email or name, participants separated by ';'
+    in CSV or as a list in JSON ('all' for everyone on the trip). Same
+    ?skip_invalid=1 / ?dry_run=1 switches as the itinerary import.
+    """
+    trip = Trip.query.get_or_404(trip_id)
+    if not is_trip_member(trip_id, current_user.id):
+        return jsonify({'error': 'Unauthorized'}), 403
+    error = import_request_error(EXPENSE_FORMATS)
+    if error:
+        return jsonify({'error': error}), 400
+    records, error = _read_import(EXPENSE_FORMATS, EXPENSE_PARSERS)
+    if error:
+        return jsonify({'error': error}), 400
+    try:
+        report, status = ingest_expenses(trip, records, skip_invalid=request.args.get('skip_invalid') == '1',
+                                         dry_run=request.args.get('dry_run') == '1')
+    except Exception:
+        db.session.rollback()
+        app.logger.exception('Bulk expense import failed')
+        return jsonify({'error': 'Failed to save the expenses'}), 500
+    return jsonify(report), status
+
+
+@app.route('/trip/<int:trip_id>/expenses', methods=['POST'])
+@login_required
+def upload_expenses(trip_id):
+    """CSV upload form on the expenses page."""
+    trip = Trip.query.get_or_404(trip_id)
+    if not is_trip_member(trip_id, current_user.id):
+        abort(403)
+    form = ExpenseUploadForm()
+    if not form.validate_on_submit():
+        for field, errors in form.errors.items():
+            for error in errors:
+                flash(f'{getattr(form, field).label.text}: {error}', 'danger')
+        return redirect(url_for('trip_expenses', trip_id=trip_id))
+    try:
+        records = list(parse_expense_csv(form.file.data.read().decode('utf-8-sig')))
+        report, status = ingest_expenses(trip, records, skip_invalid=form.skip_invalid.data)
+    except (UnicodeDecodeError, ValueError, csv.Error) as e:
+        flash(f'Could not read the CSV file: {e}', 'danger')
+        return redirect(url_for('trip_expenses', trip_id=trip_id))
+    except Exception:
+        db.session.rollback()
+        app.logger.exception('Expense CSV upload failed')
+        flash('An error occurred while saving the expenses', 'danger')
+        return redirect(url_for('trip_expenses', trip_id=trip_id))
+    for error in report['errors'][:10]:
+        flash(f"Row {error['row']}: {'; '.join(error['errors'])}", 'danger')
+    if report['error_count'] > 10:
+        flash(f"...and {report['error_count'] - 10} more rows with errors", 'danger')
+    if status == 422:
+        flash('No expenses were added. Fix the rows above or tick "Skip invalid rows".', 'warning')
+    else:
+        flash(f"Added {report['imported']} expense(s) from the CSV file", 'success')
+    return redirect(url_for('trip_expenses', trip_id=trip_id))
+
+# --- Static assets ---
+# `flask --app app build-assets` copies static/ (minus uploads) to static/dist/ under
+# content-hash names, e.g. css/styles.css -> css/styles.3f2a1b9c7d0e.css, with .br/.gz
+# siblings, and writes a manifest. url_for('static', ...) then points at the copy.
+ASSET_SKIP = {'uploads', 'dist'}
+ASSET_COMPRESSIBLE = {'.css', '.js', '.svg', '.json', '.map', '.txt', '.html'}
+ASSET_ENCODINGS = (('br', '.br'), ('gzip', '.gz'))  # preferred first
+
+
+def load_asset_manifest():
+    """{'css/styles.css': 'css/styles.<hash>.css', ...} from the last build ({} if none)."""
+    try:
+        with open(os.path.join(app.config['ASSET_FOLDER'], 'manifest.json')) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+asset_manifest = load_asset_manifest()
+
+
+def _compress_asset(data, encoding):
+    if encoding == 'gzip':
+        return gzip.compress(data, compresslevel=9, mtime=0)
+    if encoding == 'br' and BROTLI_ENABLED:
+        return brotli.compress(data, quality=11)
+    return None
+
+
+def _write_asset(path, data):
+    tmp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def build_assets(clean=False):
+    """Fingerprint and precompress everything under static/; returns the new manifest."""
+    static_folder, target = app.static_folder, app.config['ASSET_FOLDER']
+    manifest, written = {}, {'manifest.json'}
+    for root, dirs, files in os.walk(static_folder):
+        if root == static_folder:
+            dirs[:] = [d for d in dirs if d not in ASSET_SKIP]
+        for name in files:
+            if name.startswith('.'):
+                continue
+            source = os.path.join(root, name)
+            logical = os.path.relpath(source, static_folder).replace(os.sep, '/')
+            with open(source, 'rb') as f:
+                data = f.read()
+            stem, ext = os.path.splitext(logical)
+            built = f'{stem}.{hashlib.sha256(data).hexdigest()[:12]}{ext}'
+            path = os.path.join(target, *built.split('/'))
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            if not os.path.exists(path):
+                _write_asset(path, data)
+            written.add(built)
+            if ext.lower() in ASSET_COMPRESSIBLE:
+                for encoding, suffix in ASSET_ENCODINGS:
+                    packed = _compress_asset(data, encoding)
+                    if packed is not None and len(packed) < len(data):
+                        _write_asset(path + suffix, packed)
+                        written.add(built + suffix)
+            manifest[logical] = built
+    _write_asset(os.path.join(target, 'manifest.json'), json.dumps(manifest, indent=2, sort_keys=True).encode())
+    if clean:
+        # files from earlier builds; keep them while old pages may still be cached by clients
+        for root, dirs, files in os.walk(target):
+            for name in files:
+                path = os.path.join(root, name)
+                if os.path.relpath(path, target).replace(os.sep, '/') not in written:
+                    os.remove(path)
+    asset_manifest.clear()
+    asset_manifest.update(manifest)
+    return manifest
+
+
+@app.url_defaults
+def fingerprint_static_url(endpoint, values):
+    # the development server serves the files as they are edited
+    if endpoint == 'static' and not app.debug:
+        built = asset_manifest.get(values.get('filename'))
+        if built:
+            values['filename'] = f'dist/{built}'
+
+
+@app.route('/static/dist/<path:filename>')
+def static_asset(filename):
+    """A fingerprinted asset, precompressed when the browser accepts it, cached for good."""
+    folder = app.config['ASSET_FOLDER']
+    max_age = app.config['ASSET_MAX_AGE']
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    for encoding, suffix in ASSET_ENCODINGS:
+        if not request.accept_encodings[encoding]:
+            continue
+        try:
+            response = send_from_directory(folder, filename + suffix, mimetype=mimetype, max_age=max_age)
+        except NotFound:
+            continue
+        response.headers['Content-Encoding'] = encoding
+        break
+    else:
+        response = send_from_directory(folder, filename, max_age=max_age)
+    response.vary.add('Accept-Encoding')
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+
 # --- Routes ---
 @app.route('/')
 def home():
@@ -930,7 +2997,11 @@ def register():
             return render_template('register.html', form=form)
 
         user = User(name=form.name.data, email=normalized_email)
-        user.set_password(form.password.data)
+        try:
+            user.set_password(form.password.data)
+        except HashingBusy:
+            flash('We are busy right now, please try again in a moment.', 'warning')
+            return render_template('register.html', form=form), 503
         db.session.add(user)
         db.session.commit()
         login_user(user)
@@ -950,8 +3021,26 @@ def login():
     if form.validate_on_submit():
         # normalize email lookup to lowercase so stored lowercase addresses match
         email_lookup = (form.email.data or '').strip().lower()
+        # counted before hashing, so concurrent guesses can't all slip under the limit, and the
+        # refused ones cost us next to nothing. Tries from an address that is already over its own
+        # limit don't count towards the account's
+        address_key = f'{email_lookup} {request.remote_addr}'
+        window = app.config['LOGIN_LOCKOUT_SECONDS']
+        if (login_throttle.attempt(address_key, window) > app.config['LOGIN_MAX_FAILURES']
+                or login_throttle.attempt(email_lookup, window) > app.config['LOGIN_ACCOUNT_MAX_FAILURES']):
+            flash('Too many sign-in attempts for this account. Please try again later.', 'danger')
+            return render_template('login.html', form=form), 429
         user = User.query.filter_by(email=email_lookup).first()
-        if user and user.check_password(form.password.data):
+        try:
+            signed_in = user is not None and user.check_password(form.password.data)
+        except HashingBusy:
+            login_throttle.refund(address_key, window)
+            login_throttle.refund(email_lookup, window)
+            flash('We are busy right now, please try again in a moment.', 'warning')
+            return render_template('login.html', form=form), 503
+        if signed_in:
+            db.session.commit()  # saves the upgraded hash, if check_password made one
+            login_throttle.clear(address_key)  # the account's count stays, or guessers could reset it
             login_user(user)
             flash("Login successful!", "success")
             
@@ -974,51 +3063,62 @@ def logout():
 
 
 # --- Dashboard & Trip CRUD ---
-@app.route('/dashboard')
-@login_required
-def dashboard():
+def _trip_row(trip):
+    return {
+        'id': trip.id, 'user_id': trip.user_id, 'group_id': trip.group_id,
+        'title': trip.title, 'destination': trip.destination,
+        'start_date': trip.start_date, 'end_date': trip.end_date,
+        'cover_image': trip.cover_image,
+    }
+
+
+def get_dashboard_data(user_id):
+    """
+    Query everything the dashboard shows in two statements (plus the cached
+    membership lookup): trips bucketed by date in SQL, and groups with a
+    GROUP BY member count. Cheap enough that it isn't cached.
+    """
     today = date.today()
-    
-    # Get trips owned by the user
-    owned_trips = Trip.query.filter_by(user_id=current_user.id).all()
-    
-    # Get trips from groups the user is a member of
-    user_group_ids = [gm.group_id for gm in GroupMember.query.filter_by(user_id=current_user.id).all()]
-    group_trips = []
-    if user_group_ids:
-        group_trips = Trip.query.filter(
-            Trip.group_id.in_(user_group_ids),
-            Trip.user_id != current_user.id  # Exclude trips already owned by user
-        ).all()
-    
-    # Combine all trips and remove duplicates
-    all_trips = list(set(owned_trips + group_trips))
-    
-    # Sort by start date
-    all_trips.sort(key=lambda t: t.start_date)
-    
-    # Categorize trips
-    upcoming = [t for t in all_trips if t.start_date > today]
-    ongoing = [t for t in all_trips if t.start_date <= today <= t.end_date]
-    completed = [t for t in all_trips if t.end_date < today]
-    
-    # Get user's groups through GroupMember association
-    my_groups = (Group.query
-                .join(GroupMember)
-                .filter(GroupMember.user_id == current_user.id)
+    group_ids = active_group_ids(user_id)
+    bucket = db.case(
+        (Trip.start_date > today, 'upcoming'),
+        (Trip.end_date < today, 'completed'),
+        else_='ongoing'
+    ).label('bucket')
+    visible = Trip.user_id == user_id
+    if group_ids:
+        visible = db.or_(visible, Trip.group_id.in_(group_ids))
+    trips = {'upcoming': [], 'ongoing': [], 'completed': []}
+    for trip, trip_bucket in db.session.query(Trip, bucket).filter(visible).order_by(Trip.start_date, Trip.id):
+        trips[trip_bucket].append(_trip_row(trip))
+
+    my_groups = []
+    if group_ids:
+        member_count = db.func.count(GroupMember.id).label('member_count')
+        rows = (db.session.query(Group, member_count)
+                .join(GroupMember, db.and_(GroupMember.group_id == Group.id, GroupMember.status == 'active'))
+                .filter(Group.id.in_(group_ids))
+                .group_by(Group.id)
                 .order_by(Group.name)
                 .all())
-    
-    # Add member count to each group
-    for group in my_groups:
-        group.member_count = GroupMember.query.filter_by(group_id=group.id).count()
-        group.is_member = True  # Flag to indicate user is a member
-    
+        for group, count in rows:
+            my_groups.append({
+                'id': group.id, 'name': group.name, 'description': group.description,
+                'admin_id': group.admin_id, 'member_count': count, 'is_member': True,
+            })
+
+    return dict(trips, my_groups=my_groups)
+
+
+@app.route('/dashboard')
+@login_required
+def dashboard():
+    data = get_dashboard_data(current_user.id)
     return render_template('dashboard.html', 
-                         upcoming=upcoming, 
-                         ongoing=ongoing, 
-                         completed=completed,
-                         my_groups=my_groups)
+                         upcoming=data['upcoming'], 
+                         ongoing=data['ongoing'], 
+                         completed=data['completed'],
+                         my_groups=data['my_groups'])
 
 
 @app.route('/create_trip', methods=['GET', 'POST'])
@@ -1038,7 +3138,6 @@ def create_trip():
     
     if form.validate_on_submit():
         cover_image_path = None
-        file_path = None
         
         try:
             # Handle cover image if provided
@@ -1051,22 +3150,11 @@ def create_trip():
                         flash('Please upload only JPG or PNG images', 'danger')
                         return render_template('create_trip.html', form=form)
                     
-                    # Generate safe filename and save
-                    filename = secure_filename(f"{uuid.uuid4()}{ext}")
-                    # ensure folder exists right before saving (safer in concurrent runs)
-                    try:
-                        os.makedirs(app.config['TRIP_COVERS_FOLDER'], exist_ok=True)
-                    except Exception as makedir_err:
-                        app.logger.error(f"Failed to ensure cover folder exists: {makedir_err}")
-                    file_path = os.path.join(app.config['TRIP_COVERS_FOLDER'], filename)
-                    try:
-                        file.save(file_path)
-                        cover_image_path = f"uploads/trip_covers/{filename}"
-                        app.logger.info(f"Saved cover image: {filename}")
-                    except Exception as save_error:
-                        app.logger.exception("Error saving image")
+                    cover_image_path = save_trip_cover(file)
+                    if cover_image_path is None:
                         flash('Failed to save the image. Please try again.', 'danger')
                         return render_template('create_trip.html', form=form)
+                    app.logger.info(f"Saved cover image: {cover_image_path}")
             
             # Create trip
             group_id = form.group_id.data if form.group_id.data and form.group_id.data != 0 else None
@@ -1092,12 +3180,9 @@ def create_trip():
         
         except Exception as e:
             db.session.rollback()
-            # Clean up uploaded file if DB save failed
-            if cover_image_path and file_path and os.path.exists(file_path):
-                try:
-                    os.remove(file_path)
-                except Exception as cleanup_error:
-                    app.logger.error(f"Failed to clean up image: {cleanup_error}")
+            # Clean up uploaded file if DB save failed (kept if another trip uses the same picture)
+            if cover_image_path:
+                remove_files_later(covers=[cover_image_path])
             # log full exception with traceback
             app.logger.exception("Error creating trip")
             # provide a slightly more detailed error to the UI to help debugging (but avoid leaking internals)
@@ -1113,22 +3198,81 @@ def create_trip():
     return render_template('create_trip.html', form=form, today_str=date.today().isoformat())
 
 
+# Rendered itinerary days, per (trip, day). A day's stamp is the number of its
+# items and the sum of their versions, read in one GROUP BY; any insert, edit,
+# move or delete changes it, so only the days that changed are queried and
+# rendered again. Entries are evicted least recently used once the cached HTML
+# passes ITINERARY_CACHE_BYTES.
+_itinerary_cache = OrderedDict()  # (trip_id, day) -> (stamp, Markup)
+_itinerary_cache_bytes = 0
+_itinerary_lock = threading.Lock()
+
+
+def forget_itinerary_days(trip_id, days=None):
+    """Drop cached fragments of a trip (all days, or just these) right away."""
+    global _itinerary_cache_bytes
+    with _itinerary_lock:
+        for key in [k for k in _itinerary_cache if k[0] == trip_id and (days is None or k[1] in days)]:
+            _itinerary_cache_bytes -= len(_itinerary_cache.pop(key)[1])
+
+
+def _as_date(value):
+    return value if isinstance(value, date) else date.fromisoformat(str(value)[:10])
+
+
+def render_itinerary_days(trip_id):
+    """HTML for each day of a trip's itinerary in date order, from cache where unchanged."""
+    global _itinerary_cache_bytes
+    day_col = db.func.date(ItineraryItem.datetime)
+    stamps = [(_as_date(day), (count, total))
+              for day, count, total in (db.session.query(day_col, db.func.count(ItineraryItem.id),
+                                                         db.func.sum(ItineraryItem.version))
+                                        .filter(ItineraryItem.trip_id == trip_id)
+                                        .group_by(day_col)
+                                        .order_by(day_col))]
+    fragments = {}
+    with _itinerary_lock:
+        for day, stamp in stamps:
+            entry = _itinerary_cache.get((trip_id, day))
+            if entry and entry[0] == stamp:
+                _itinerary_cache.move_to_end((trip_id, day))
+                fragments[day] = entry[1]
+    missing = [day for day, _ in stamps if day not in fragments]
+    if missing:
+        query = ItineraryItem.query.filter(ItineraryItem.trip_id == trip_id)
+        if len(missing) < len(stamps):
+            query = query.filter(db.or_(*[db.and_(ItineraryItem.datetime >= datetime.combine(day, datetime.min.time()),
+                                                  ItineraryItem.datetime < datetime.combine(day + timedelta(days=1), datetime.min.time()))
+                                          for day in missing]))
+        grouped = defaultdict(list)
+        for item in query.order_by(ItineraryItem.datetime):
+            grouped[item.datetime.date()].append(item)
+        render_day = get_template_attribute('macros.html', 'itinerary_day')
+        stamp_of = dict(stamps)
+        with _itinerary_lock:
+            for day in missing:
+                html = Markup(render_day(day, grouped[day]))
+                fragments[day] = html
+                old = _itinerary_cache.pop((trip_id, day), None)
+                if old:
+                    _itinerary_cache_bytes -= len(old[1])
+                _itinerary_cache[(trip_id, day)] = (stamp_of[day], html)
+                _itinerary_cache_bytes += len(html)
+            while _itinerary_cache and _itinerary_cache_bytes > app.config['ITINERARY_CACHE_BYTES']:
+                _, (_, html) = _itinerary_cache.popitem(last=False)
+                _itinerary_cache_bytes -= len(html)
+    return [fragments[day] for day, _ in stamps]
+
+
 @app.route('/view_trip/<int:trip_id>')
 @login_required
+@conditional(trip_version)
 def view_trip(trip_id):
     trip = Trip.query.get_or_404(trip_id)
     # allow owner or trip members to view
     if not is_trip_member(trip_id, current_user.id):
         abort(403)
-    # show itinerary items grouped by date for the trip
-    items = ItineraryItem.query.filter_by(trip_id=trip.id).order_by(ItineraryItem.datetime).all()
-    # build a list of dates present
-    from collections import defaultdict
-    grouped = defaultdict(list)
-    for it in items:
-        grouped[it.datetime.date()].append(it)
-
-    sorted_dates = sorted(grouped.keys())
+    itinerary_days = render_itinerary_days(trip.id)
     
     # Get group info if trip is associated with a group
     group = None
@@ -1137,9 +3281,7 @@ def view_trip(trip_id):
     
     return render_template('view_trip.html', 
                          trip=trip, 
-                         itinerary_items=items, 
-                         grouped_itinerary=grouped, 
-                         itinerary_dates=sorted_dates,
+                         itinerary_days=itinerary_days,
                          group=group)
 
 
@@ -1171,6 +3313,7 @@ def create_itinerary(trip_id):
         )
         db.session.add(item)
         db.session.commit()
+        forget_itinerary_days(trip.id, {dt.date()})
         flash('Itinerary item added', 'success')
         return redirect(url_for('view_trip', trip_id=trip.id))
     return render_template('create_itinerary.html', form=form, trip=trip)
@@ -1190,6 +3333,7 @@ def edit_itinerary(item_id):
         # Parse the time string (format: HH:MM), default to 00:00 if not provided
         time_str = form.time.data if form.time.data else '00:00'
         time_obj = datetime.strptime(time_str, '%H:%M').time()
+        old_day = item.datetime.date()
         # Combine date and time
         item.title = form.title.data
         item.description = form.description.data
@@ -1198,6 +3342,7 @@ def edit_itinerary(item_id):
         item.cost = (float(form.cost.data) if form.cost.data else None)
         item.tags = form.tags.data
         db.session.commit()
+        forget_itinerary_days(trip.id, {old_day, item.datetime.date()})
         flash('Itinerary updated', 'success')
         return redirect(url_for('view_trip', trip_id=trip.id))
     return render_template('edit_itinerary.html', form=form, trip=trip, item=item)
@@ -1210,12 +3355,307 @@ def delete_itinerary(item_id):
     trip = item.trip
     if trip.user_id != current_user.id:
         abort(403)
+    day = item.datetime.date()
     db.session.delete(item)
     db.session.commit()
+    forget_itinerary_days(trip.id, {day})
     flash('Itinerary item deleted', 'info')
     return redirect(url_for('view_trip', trip_id=trip.id))
 
 
+# --- Itinerary import / export ---
+# Bulk endpoints for agencies that plan whole tours: import CSV, JSON or iCalendar
+# in one executemany transaction, export as a stream that never holds the whole
+# itinerary in memory. Both formats use the same fields as ItineraryForm.
+ITINERARY_FIELDS = ('date', 'time', 'title', 'description', 'location', 'cost', 'tags')
+ITINERARY_FORMATS = {
+    'csv': ('text/csv', '.csv'),
+    'json': ('application/json', '.json'),
+    'ics': ('text/calendar', '.ics'),
+}
+ITINERARY_IMPORT_BATCH = 1000  # rows per executemany
+ITINERARY_IMPORT_MAX_ERRORS = 100  # listed in the response; error_count has the total
+
+
+def _ics_unescape(value):
+    return re.sub(r'\\([\;,nN])', lambda m: '\n' if m.group(1) in 'nN' else m.group(1), value)
+
+
+def _ics_escape(value):
+    return (value.replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,')
+            .replace('\r\n', '\\n').replace('\n', '\\n'))
+
+
+def _ics_line(name, value):
+    """One content line, folded to 75 octets as RFC 5545 asks."""
+    data = f'{name}:{value}'.encode('utf-8')
+    parts = []
+    while len(data) > 75:
+        cut = 75 if not parts else 74
+        while cut > 1 and (data[cut] & 0xC0) == 0x80:  # don't split a UTF-8 character
+            cut -= 1
+        parts.append(data[:cut])
+        data = data[cut:]
+    parts.append(data)
+    return b'\r\n '.join(parts).decode('utf-8') + '\r\n'
+
+
+def parse_csv_records(text, required):
+    """Rows of a CSV file with a header, as dicts keyed by lower-cased column name."""
+    reader = csv.DictReader(io.StringIO(text))
+    if not reader.fieldnames or not set(required) <= {f.strip().lower() for f in reader.fieldnames if f}:
+        raise ValueError('CSV needs a header row with at least these columns: ' + ', '.join(required))
+    for record in reader:
+        yield {(key or '').strip().lower(): value for key, value in record.items()}
+
+
+def parse_itinerary_csv(text):
+    return parse_csv_records(text, ('date', 'title'))
+
+
+def parse_itinerary_json(text):
+    data = json.loads(text)
+    if isinstance(data, dict):
+        data = data.get('items')
+    if not isinstance(data, list):
+        raise ValueError('JSON must be a list of items or an object with an "items" list')
+    for record in data:
+        yield record if isinstance(record, dict) else {}
+
+
+def parse_itinerary_ics(text):
+    """VEVENTs as rows: DTSTART gives date/time, SUMMARY the title, CATEGORIES the tags."""
+    lines = []
+    for raw in text.splitlines():
+        if raw[:1] in (' ', '\t') and lines:
+            lines[-1] += raw[1:]  # unfold
+        elif raw:
+            lines.append(raw)
+    event = None
+    for line in lines:
+        name, _, value = line.partition(':')
+        name, *params = name.split(';')
+        name = name.upper()
+        if name == 'BEGIN' and value.upper() == 'VEVENT':
+            event = {}
+        elif name == 'END' and value.upper() == 'VEVENT' and event is not None:
+            yield event
+            event = None
+        elif event is not None:
+            if name == 'DTSTART':
+                # floating or TZID local time is kept as written; a UTC 'Z' suffix is dropped
+                stamp = value.rstrip('Z')
+                event['date'] = f'{stamp[0:4]}-{stamp[4:6]}-{stamp[6:8]}' if len(stamp) >= 8 else stamp
+                if 'T' in stamp:
+                    event['time'] = f'{stamp[9:11]}:{stamp[11:13]}'
+            elif name in ('SUMMARY', 'DESCRIPTION', 'LOCATION'):
+                event[{'SUMMARY': 'title'}.get(name, name.lower())] = _ics_unescape(value)
+            elif name == 'CATEGORIES':
+                event['tags'] = _ics_unescape(value)
+            elif name == 'X-TRIPMATES-COST':
+                event['cost'] = value
+
+
+ITINERARY_PARSERS = {'csv': parse_itinerary_csv, 'json': parse_itinerary_json, 'ics': parse_itinerary_ics}
+
+
+def validate_itinerary_row(record, trip):
+    """Check one imported row like ItineraryForm does; returns (values, errors)."""
+    def text(key):
+        value = record.get(key)
+        return '' if value is None else str(value).strip()
+
+    errors = []
+    title = text('title')
+    if not title or len(title) > 200:
+        errors.append('title: required, at most 200 characters')
+    description = text('description')
+    if len(description) > 500:
+        errors.append('description: at most 500 characters')
+    location = text('location')
+    if len(location) > 200:
+        errors.append('location: at most 200 characters')
+    tags = text('tags')
+    if len(tags) > 255:
+        errors.append('tags: at most 255 characters')
+    day = None
+    try:
+        day = datetime.strptime(text('date'), '%Y-%m-%d').date()
+        if day < trip.start_date:
+            errors.append("date: cannot be before the trip's start date")
+        elif day > trip.end_date:
+            errors.append("date: cannot be after the trip's end date")
+    except ValueError:
+        errors.append('date: use YYYY-MM-DD')
+    at = datetime.min.time()
+    if text('time'):
+        try:
+            at = datetime.strptime(text('time'), '%H:%M').time()
+        except ValueError:
+            errors.append('time: use HH:MM')
+    cost = None
+    if text('cost'):
+        try:
+            cost = Decimal(text('cost')).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+            if not cost.is_finite() or abs(cost) >= Decimal('1e8'):
+                raise ValueError
+        except (ArithmeticError, ValueError):
+            errors.append('cost: must be a number, e.g. 12.50')
+    if errors:
+        return None, errors
+    return {
+        'trip_id': trip.id, 'title': title, 'description': description or None,
+        'datetime': datetime.combine(day, at), 'location': location or None,
+        'cost': cost, 'tags': tags or None,
+    }, []
+
+
+def _import_format(formats):
+    """csv/json/... from ?format=, the uploaded file's extension or the Content-Type."""
+    fmt = (request.args.get('format') or '').lower()
+    upload = request.files.get('file')
+    if not fmt and upload and upload.filename:
+        fmt = os.path.splitext(upload.filename)[1].lstrip('.').lower()
+    if not fmt:
+        fmt = next((name for name, (mimetype, _) in formats.items() if request.mimetype == mimetype), '')
+    return fmt if fmt in formats else None
+
+
+@app.route('/trip/<int:trip_id>/itinerary/import', methods=['POST'])
+@login_required
+def import_itinerary(trip_id):
+    """
+    Add many itinerary items at once from CSV, JSON or iCalendar, sent as the
+    request body or as a multipart 'file' (which needs the CSRF token, see
+    import_request_error). Every row is validated first; with any invalid row
+    nothing is saved (422) unless ?skip_invalid=1 is given. ?dry_run=1 only
+    validates.
+    """
+    trip = Trip.query.get_or_404(trip_id)
+    if not is_trip_member(trip_id, current_user.id):
+        return jsonify({'error': 'Unauthorized'}), 403
+    error = import_request_error(ITINERARY_FORMATS)
+    if error:
+        return jsonify({'error': error}), 400
+    records, error = _read_import(ITINERARY_FORMATS, ITINERARY_PARSERS)
+    if error:
+        return jsonify({'error': error}), 400
+
+    rows, errors = [], []
+    for number, record in enumerate(records, start=1):
+        values, row_errors = validate_itinerary_row(record, trip)
+        if row_errors:
+            errors.append({'row': number, 'title': str(record.get('title') or '')[:80], 'errors': row_errors})
+        else:
+            rows.append(values)
+    report = {'rows': len(records), 'imported': 0, 'error_count': len(errors),
+              'errors': errors[:ITINERARY_IMPORT_MAX_ERRORS]}
+    if errors and request.args.get('skip_invalid') != '1':
+        return jsonify(report), 422
+    if request.args.get('dry_run') == '1' or not rows:
+        report['valid'] = len(rows)
+        return jsonify(report)
+
+    try:
+        table = ItineraryItem.__table__
+        for start in range(0, len(rows), ITINERARY_IMPORT_BATCH):
+            db.session.execute(table.insert(), rows[start:start + ITINERARY_IMPORT_BATCH])
+        touch_versions(trip_ids=[trip.id])  # the inserts bypass the ORM hooks
+        reindex_trip_tags([trip.id])
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        app.logger.exception('Itinerary import failed')
+        return jsonify({'error': 'Failed to save the itinerary'}), 500
+    forget_itinerary_days(trip.id, {row['datetime'].date() for row in rows})
+    report['imported'] = len(rows)
+    return jsonify(report), 201
+
+
+class _Echo:
+    """File-like object for csv.writer that hands each formatted row back."""
+    def write(self, value):
+        return value
+
+
+def _itinerary_rows(trip_id):
+    # plain rows fetched 500 at a time: only one batch is in memory while the response streams
+    return (db.session.query(ItineraryItem.id, ItineraryItem.datetime, ItineraryItem.title,
+                             ItineraryItem.description, ItineraryItem.location, ItineraryItem.cost,
+                             ItineraryItem.tags)
+            .filter(ItineraryItem.trip_id == trip_id)
+            .order_by(ItineraryItem.datetime, ItineraryItem.id)
+            .yield_per(500))
+
+
+def _export_values(item):
+    return {
+        'date': item.datetime.date().isoformat(), 'time': item.datetime.strftime('%H:%M'),
+        'title': item.title, 'description': item.description or '', 'location': item.location or '',
+        'cost': str(item.cost) if item.cost is not None else '', 'tags': item.tags or '',
+    }
+
+
+def export_itinerary_csv(trip):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(ITINERARY_FIELDS)
+    for item in _itinerary_rows(trip.id):
+        values = _export_values(item)
+        yield writer.writerow([values[field] for field in ITINERARY_FIELDS])
+
+
+def export_itinerary_json(trip):
+    head = {'trip': {'id': trip.id, 'title': trip.title, 'destination': trip.destination,
+                     'start_date': trip.start_date.isoformat(), 'end_date': trip.end_date.isoformat()}}
+    yield json.dumps(head)[:-1] + ', "items": ['
+    separator = ''
+    for item in _itinerary_rows(trip.id):
+        yield separator + json.dumps(_export_values(item))
+        separator = ', '
+    yield ']}'
+
+
+def export_itinerary_ics(trip):
+    host = request.host.split(':')[0]
+    stamp = datetime.utcnow().strftime('%Y%m%dT%H%M%SZ')
+    yield ('BEGIN:VCALENDAR\r\nVERSION:2.0\r\nPRODID:-//TripMates//Itinerary//EN\r\nCALSCALE:GREGORIAN\r\n'
+           + _ics_line('X-WR-CALNAME', _ics_escape(trip.title)))
+    for item in _itinerary_rows(trip.id):
+        lines = ['BEGIN:VEVENT\r\n',
+                 _ics_line('UID', f'itinerary-{item.id}@{host}'),
+                 _ics_line('DTSTAMP', stamp),
+                 _ics_line('DTSTART', item.datetime.strftime('%Y%m%dT%H%M%S')),
+                 _ics_line('SUMMARY', _ics_escape(item.title))]
+        for name, value in (('DESCRIPTION', item.description), ('LOCATION', item.location),
+                            ('CATEGORIES', item.tags)):
+            if value:
+                lines.append(_ics_line(name, _ics_escape(value)))
+        if item.cost is not None:
+            lines.append(_ics_line('X-TRIPMATES-COST', str(item.cost)))
+        lines.append('END:VEVENT\r\n')
+        yield ''.join(lines)
+    yield 'END:VCALENDAR\r\n'
+
+
+ITINERARY_EXPORTERS = {'csv': export_itinerary_csv, 'json': export_itinerary_json, 'ics': export_itinerary_ics}
+
+
+@app.route('/trip/<int:trip_id>/itinerary/export.<fmt>')
+@login_required
+def export_itinerary(trip_id, fmt):
+    """Download the itinerary as CSV, JSON or iCalendar, streamed row by row."""
+    trip = Trip.query.get_or_404(trip_id)
+    if not is_trip_member(trip_id, current_user.id):
+        abort(403)
+    if fmt not in ITINERARY_EXPORTERS:
+        abort(404)
+    mimetype, extension = ITINERARY_FORMATS[fmt]
+    filename = secure_filename(f'{trip.title}-itinerary') or 'itinerary'
+    response = app.response_class(stream_with_context(ITINERARY_EXPORTERS[fmt](trip)), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}{extension}"'
+    return response
+
+
 @app.route('/edit_trip/<int:trip_id>', methods=['GET', 'POST'])
 @login_required
 def edit_trip(trip_id):
@@ -1240,6 +3680,7 @@ def edit_trip(trip_id):
         if form.validate_on_submit():
             try:
                 # Update trip details
+                dates_changed = (trip.start_date, trip.end_date) != (form.start_date.data, form.end_date.data)
                 trip.title = form.title.data
                 trip.destination = form.destination.data
                 trip.start_date = form.start_date.data
@@ -1249,6 +3690,8 @@ def edit_trip(trip_id):
                 
                 # Save changes
                 db.session.commit()
+                if dates_changed:
+                    forget_itinerary_days(trip.id)
                 flash('Trip updated successfully', 'success')
                 return redirect(url_for('view_trip', trip_id=trip.id))
             except Exception as e:
@@ -1267,6 +3710,60 @@ def edit_trip(trip_id):
     return render_template('edit_trip.html', form=form, trip=trip)
 
 
+# --- Deleting trips and groups ---
+def delete_trips(trip_ids):
+    """
+    Delete the trips picked by trip_ids (a SELECT of trip ids) with their
+    expenses, participant links, balances, itinerary items and tags: one
+    DELETE per table however many trips there are. Caches are cleared and
+    cover files removed (in the background) once the caller commits.
+    """
+    trips = db.session.execute(db.select(Trip.id, Trip.user_id, Trip.group_id, Trip.cover_image)
+                               .where(Trip.id.in_(trip_ids))).all()
+    if not trips:
+        return []
+    expense_ids = db.select(Expense.id).where(Expense.trip_id.in_(trip_ids))
+    db.session.execute(expense_participants.delete().where(expense_participants.c.expense_id.in_(expense_ids)))
+    for model in (Expense, TripBalance, ItineraryTag, ItineraryItem):
+        db.session.execute(db.delete(model).where(model.trip_id.in_(trip_ids))
+                           .execution_options(synchronize_session=False))
+    # last: the statements above select their rows through the trips
+    db.session.execute(db.delete(Trip).where(Trip.id.in_(trip_ids)).execution_options(synchronize_session=False))
+    after_commit(_trips_deleted, trips)
+    return trips
+
+
+def _trips_deleted(trips):
+    for trip in trips:
+        forget_itinerary_days(trip.id)
+    remove_files_later(covers={trip.cover_image for trip in trips if trip.cover_image})
+
+
+def remove_files_later(covers=(), media=()):
+    """
+    Delete trip covers (unless another trip still uses the picture) and chat
+    photos with their variants on the media pool, so requests don't wait for the disk.
+    """
+    if covers or media:
+        media_pool.submit(_remove_files, list(covers), list(media))
+
+
+def _remove_files(covers, media):
+    with app.app_context():
+        for cover_image in covers:
+            discard_trip_cover(cover_image)
+        for filename in media:
+            if filename != os.path.basename(filename):
+                continue
+            try:
+                path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+                if os.path.exists(path):
+                    os.remove(path)
+                media_variants.discard(filename)
+            except OSError:
+                app.logger.exception(f'Failed to delete chat photo {filename}')
+
+
 @app.route('/delete_trip/<int:trip_id>', methods=['POST'])
 @login_required
 def delete_trip(trip_id):
@@ -1276,26 +3773,8 @@ def delete_trip(trip_id):
         abort(403)
         
     try:
-        # First delete all related itinerary items
-        # Use session-level bulk delete to avoid session synchronization issues
-        db.session.query(ItineraryItem).filter_by(trip_id=trip_id).delete(synchronize_session=False)
-        # Also delete expenses related to this trip (and their participant links via cascade/association)
-        db.session.query(Expense).filter_by(trip_id=trip_id).delete(synchronize_session=False)
-        
-        # Now delete the trip
-        db.session.delete(trip)
-        
-        # Clean up cover image if it exists. cover_image is stored relative to static,
-        # e.g. 'uploads/trip_covers/<filename>' so build absolute path from app.root_path
-        if trip.cover_image:
-            try:
-                file_path = os.path.join(app.root_path, 'static', trip.cover_image)
-                if os.path.exists(file_path):
-                    os.remove(file_path)
-                    app.logger.info(f"Removed cover image file: {file_path}")
-            except Exception:
-                app.logger.exception("Failed to delete cover image")
-        
+        # The trip with its itinerary, expenses and ledger; the cover file goes after the commit
+        delete_trips(db.select(Trip.id).where(Trip.id == trip_id))
         db.session.commit()
         flash('Trip and all related items deleted successfully', 'info')
         
@@ -1325,31 +3804,75 @@ def groups():
     # Get all active groups
     all_groups = Group.query.filter_by(is_active=True).order_by(Group.name).all()
     
-    # Generate QR codes for admin's groups
-    for group in admin_groups:
-        if not hasattr(group, 'qr_code'):
-            import qrcode
-            import base64
-            from io import BytesIO
-            
-            # Generate QR code
-            qr = qrcode.QRCode(version=1, box_size=10, border=5)
-            qr.add_data(group.get_join_url())
-            qr.make(fit=True)
-            
-            # Create QR code image
-            img = qr.make_image(fill_color="black", back_color="white")
-            
-            # Convert to base64 for embedding in HTML
-            buffer = BytesIO()
-            img.save(buffer, format='PNG')
-            group.qr_code = base64.b64encode(buffer.getvalue()).decode()
-
     return render_template('groups.html',
                          my_groups=my_groups,
                          admin_groups=admin_groups,
                          all_groups=all_groups)
 
+# --- Invite QR codes ---
+_qr_lock = threading.Lock()
+
+
+def _qr_key(join_url):
+    """Cache key / ETag for a join URL; changes whenever the token is rotated."""
+    return hashlib.sha256(join_url.encode('utf-8')).hexdigest()[:24]
+
+
+def _qr_path(key):
+    return os.path.join(app.config['QR_FOLDER'], f'{key}.png')
+
+
+def render_group_qr(group):
+    """
+    Return (path, key) of the PNG QR code for a group's invite link.
+    The image is rendered only the first time a given join token is seen and
+    then served from disk until reset_group_link rotates the token.
+    """
+    key = _qr_key(group.get_join_url())
+    path = _qr_path(key)
+    if not os.path.exists(path):
+        with _qr_lock:
+            if not os.path.exists(path):
+                qr = qrcode.QRCode(version=1, box_size=10, border=5)
+                qr.add_data(group.get_join_url())
+                qr.make(fit=True)
+                img = qr.make_image(fill_color="black", back_color="white")
+                # write to a temp file first so readers never see a half-written image
+                tmp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+                img.save(tmp_path, format='PNG')
+                os.replace(tmp_path, path)
+    return path, key
+
+
+def discard_group_qr(group):
+    """Delete the cached QR image for the group's current join token."""
+    try:
+        os.remove(_qr_path(_qr_key(group.get_join_url())))
+    except FileNotFoundError:
+        pass
+    except OSError:
+        app.logger.exception('Failed to delete cached QR code')
+
+
+@app.route('/groups/<int:group_id>/qr.png')
+@login_required
+def group_qr(group_id):
+    """Serve the invite QR code with an ETag so browsers can revalidate cheaply."""
+    group = Group.query.get_or_404(group_id)
+    if not group.is_member(current_user.id) and group.admin_id != current_user.id:
+        abort(403)
+    if not QRCODE_ENABLED:
+        abort(404)
+    key = _qr_key(group.get_join_url())
+    if request.if_none_match.contains(key):
+        return '', 304, {'ETag': f'"{key}"', 'Cache-Control': 'private, max-age=86400'}
+    path, key = render_group_qr(group)
+    response = send_file(path, mimetype='image/png', etag=key, conditional=True, max_age=86400)
+    response.cache_control.public = False
+    response.cache_control.private = True
+    return response
+
+
 @app.route('/groups/join/<token>')
 @app.route('/groups/<int:group_id>/join', methods=['POST'])
 @login_required
@@ -1385,24 +3908,21 @@ def join_group(token=None, group_id=None):
             status=status
         )
         db.session.add(member)
+        db.session.commit()
+        invalidate_membership(current_user.id)
         
         if status == 'active':
             # Add a welcome message to the group chat only for active members
-            welcome_msg = GroupMessage(
-                group_id=group.id,
-                user_id=current_user.id,
-                message=f"👋 {current_user.name} joined the group!",
-                timestamp=datetime.utcnow()
-            )
-            db.session.add(welcome_msg)
+            welcome_msg = post_status_message(group.id, current_user.id, f"👋 {current_user.name} joined the group!")
             
             # Emit socket event if SocketIO is enabled
-            if SOCKETIO_ENABLED and socketio:
+            if welcome_msg and SOCKETIO_ENABLED and socketio:
                 socketio.emit('new_message', {
+                    'id': welcome_msg['id'],
                     'user': current_user.name,
                     'user_id': current_user.id,
-                    'text': f"👋 {current_user.name} joined the group!",
-                    'timestamp': welcome_msg.timestamp.isoformat() + 'Z',
+                    'text': welcome_msg['message'],
+                    'timestamp': welcome_msg['timestamp'].isoformat() + 'Z',
                     'is_status': True
                 }, room=f'group_{group.id}')
             
@@ -1410,7 +3930,6 @@ def join_group(token=None, group_id=None):
         else:
             flash(f'Your request to join "{group.name}" has been sent and is awaiting admin approval.', 'info')
         
-        db.session.commit()
         return redirect(url_for('group_detail', group_id=group.id))
         
     except Exception as e:
@@ -1421,6 +3940,7 @@ def join_group(token=None, group_id=None):
 
 @app.route('/groups/<int:group_id>')
 @login_required
+@conditional(group_version)
 def group_detail(group_id):
     """Display group details, members, and chat."""
     group = Group.query.get_or_404(group_id)
@@ -1502,22 +4022,16 @@ def send_message(group_id):
         return jsonify({'error': 'Message cannot be empty'}), 400
     
     try:
-        # Create and save the message
-        message = GroupMessage(
-            group_id=group_id,
-            user_id=current_user.id,
-            message=message_text
-        )
-        db.session.add(message)
-        db.session.commit()
+        # Save the message (queued for the background writer)
+        message = post_group_message(group_id, current_user.id, message_text)
         
         # Prepare response data for real-time update
         response = {
-            'id': message.id,
+            'id': message['id'],
             'user': current_user.name,
             'user_id': current_user.id,
-            'text': message.message,
-            'timestamp': message.timestamp.isoformat() + 'Z',
+            'text': message['message'],
+            'timestamp': message['timestamp'].isoformat() + 'Z',
             'is_admin': group.admin_id == current_user.id
         }
         
@@ -1527,33 +4041,16 @@ def send_message(group_id):
         
         return jsonify(response)
         
+    except ChatBackpressure:
+        return jsonify({'error': 'Chat is busy, please try again'}), 503
     except Exception as e:
         db.session.rollback()
         app.logger.error(f'Error sending message: {str(e)}')
         return jsonify({'error': 'Failed to send message'}), 500
 
-@app.route('/groups/<int:group_id>/messages')
-@login_required
-def get_messages(group_id):
-    """Get recent messages for a group."""
-    group = Group.query.get_or_404(group_id)
-    
-    # Check if user is a member
-    if not group.is_member(current_user.id):
-        return jsonify({'error': 'Unauthorized'}), 403
-    
-    # Get messages with user info (Fetch newest first to limit)
-    messages = (db.session.query(GroupMessage, User)
-               .join(User)
-               .filter(GroupMessage.group_id == group_id)
-               .order_by(GroupMessage.timestamp.desc())
-               .limit(100)
-               .all())
-    
-    # Explicitly sort to ensure oldest to newest
-    messages = sorted(messages, key=lambda x: x[0].timestamp)
-    
-    response = [{
+def serialize_message(msg, user, group):
+    """Shape a GroupMessage the way the chat client expects it."""
+    return {
         'id': msg.id,
         'user': user.name,
         'text': msg.message,
@@ -1561,13 +4058,541 @@ def get_messages(group_id):
         'is_admin': group.admin_id == user.id,
         'user_id': msg.user_id,
         'media_filename': msg.media_filename,
+        **media_urls(msg.group_id, msg.media_filename),
         'location_lat': msg.location_lat,
         'location_lng': msg.location_lng,
         'location_label': msg.location_label,
         'is_status': 'joined' in msg.message or 'left' in msg.message
-    } for msg, user in messages]
+    }
+
+
+@app.route('/groups/<int:group_id>/messages')
+@login_required
+@conditional(group_version)
+def get_messages(group_id):
+    """
+    Page through a group's chat history using message ids as cursors.
+
+    Query parameters (all optional):
+      before_id  older messages than this id (scrolling back through history)
+      after_id   newer messages than this id
+      since      sync token from a previous response, used by reconnecting clients
+                 to fetch the messages they missed: like after_id, plus the newest
+                 older ids sent within CHAT_SYNC_LAG seconds (they may have been
+                 committed after the token was handed out; clients dedupe by id).
+                 Best effort: the window is on send time, so a message whose save
+                 was held up for longer than that only shows up on a full reload
+      limit      page size (default 50, max 200)
+
+    Messages are always returned oldest to newest. With no cursor the latest
+    page is returned.
+    """
+    group = Group.query.get_or_404(group_id)
     
-    return jsonify(response)
+    # Check if user is a member
+    if not group.is_member(current_user.id):
+        return jsonify({'error': 'Unauthorized'}), 403
+
+    before_id = request.args.get('before_id', type=int)
+    after_id = request.args.get('after_id', type=int)
+    since = request.args.get('since', type=int)
+    if after_id is None:
+        after_id = since
+    limit = max(1, min(request.args.get('limit', 50, type=int), 200))
+
+    # Keyset pagination on (group_id, id): each page is an index range scan
+    query = (db.session.query(GroupMessage, User)
+             .join(User)
+             .filter(GroupMessage.group_id == group_id))
+    if after_id is not None:
+        rows = query.filter(GroupMessage.id > after_id).order_by(GroupMessage.id.asc()).limit(limit + 1).all()
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        if since is not None and since == after_id:
+            cutoff = datetime.utcnow() - timedelta(seconds=app.config['CHAT_SYNC_LAG'])
+            # newest first, so in a busy group the limit drops rows far below the token, which the
+            # client already had, rather than the late ones just under it
+            late = (query.filter(GroupMessage.id <= since, GroupMessage.timestamp >= cutoff)
+                    .order_by(GroupMessage.id.desc()).limit(limit).all())
+            rows = late[::-1] + rows
+    else:
+        if before_id is not None:
+            query = query.filter(GroupMessage.id < before_id)
+        rows = query.order_by(GroupMessage.id.desc()).limit(limit + 1).all()
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        rows.reverse()  # oldest to newest
+
+    messages = [serialize_message(msg, user, group) for msg, user in rows]
+    newest_id = messages[-1]['id'] if messages else None
+    if after_id is not None and (newest_id is None or newest_id < after_id):
+        newest_id = after_id  # nothing new, or only late arrivals below the token
+    return jsonify({
+        'messages': messages,
+        'has_more': has_more,
+        'oldest_id': messages[0]['id'] if messages else None,
+        'newest_id': newest_id,
+        # pass back as ?since= after a reconnect; not meaningful for before_id pages
+        'sync_token': str(newest_id) if newest_id is not None and before_id is None else None,
+    })
+
+# --- Chat search ---
+# Chat history is indexed by an FTS5 table over group_message, kept in sync by
+# triggers, so every write path (the batched pipeline, direct inserts, deletes)
+# is covered. Each row also indexes a 'g<group id>' token, which lets one MATCH
+# pick a group's messages without scanning the others. SQLite only; on other
+# databases search falls back to a LIKE scan.
+CHAT_SEARCH_DDL = [
+    """CREATE VIEW IF NOT EXISTS group_message_search_source AS
+        SELECT id, message, 'g' || group_id AS group_tag FROM group_message""",
+    """CREATE VIRTUAL TABLE IF NOT EXISTS group_message_fts USING fts5(
+        message, group_tag, content='group_message_search_source', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3')""",
+    """CREATE TRIGGER IF NOT EXISTS group_message_fts_insert AFTER INSERT ON group_message BEGIN
+        INSERT INTO group_message_fts(rowid, message, group_tag) VALUES (new.id, new.message, 'g' || new.group_id);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS group_message_fts_delete AFTER DELETE ON group_message BEGIN
+        INSERT INTO group_message_fts(group_message_fts, rowid, message, group_tag)
+            VALUES ('delete', old.id, old.message, 'g' || old.group_id);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS group_message_fts_update AFTER UPDATE OF message, group_id ON group_message BEGIN
+        INSERT INTO group_message_fts(group_message_fts, rowid, message, group_tag)
+            VALUES ('delete', old.id, old.message, 'g' || old.group_id);
+        INSERT INTO group_message_fts(rowid, message, group_tag) VALUES (new.id, new.message, 'g' || new.group_id);
+    END""",
+]
+for statement in CHAT_SEARCH_DDL:
+    event.listen(GroupMessage.__table__, 'after_create', db.DDL(statement).execute_if(dialect='sqlite'))
+
+app.config['CHAT_SEARCH_PAGE_SIZE'] = 20
+# order=rank sorts the newest this-many hits by relevance, so common words stay fast in huge groups
+app.config['CHAT_SEARCH_RANK_WINDOW'] = int(os.environ.get('CHAT_SEARCH_RANK_WINDOW', 1000))
+_chat_search_fts = None
+SNIPPET_START, SNIPPET_END = '\x02', '\x03'
+BM25_K1, BM25_B = 1.2, 0.75
+
+
+def chat_search_fts():
+    """True when the FTS5 index exists (checked once per process)."""
+    global _chat_search_fts
+    if _chat_search_fts is None:
+        _chat_search_fts = db.engine.dialect.name == 'sqlite' and db.session.execute(db.text(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'group_message_fts'")).first() is not None
+    return _chat_search_fts
+
+
+def rebuild_chat_search():
+    """Create the FTS5 table and triggers if missing and bulk-load all chat history into it."""
+    global _chat_search_fts
+    with db.engine.begin() as connection:
+        for statement in CHAT_SEARCH_DDL:
+            connection.exec_driver_sql(statement)
+        connection.exec_driver_sql("INSERT INTO group_message_fts(group_message_fts) VALUES ('rebuild')")
+        connection.exec_driver_sql("INSERT INTO group_message_fts(group_message_fts) VALUES ('optimize')")
+    _chat_search_fts = True
+
+
+def search_tokens(text):
+    """Split text into lower-case words without accents, the way the FTS5 tokenizer does."""
+    text = text.casefold()
+    if not text.isascii():
+        text = ''.join(ch for ch in unicodedata.normalize('NFKD', text) if not unicodedata.combining(ch))
+    # unicode61 splits on '_' too, so it isn't part of a word here either
+    return re.findall(r'[^\W_]+', text)
+
+
+def search_terms(text):
+    """[(word, is_prefix)] for what the user typed; a trailing * asks for prefix matches."""
+    terms = []
+    for word in text.split()[:16]:
+        tokens = search_tokens(word)
+        terms.extend((token, False) for token in tokens[:-1])
+        if tokens:
+            terms.append((tokens[-1], word.endswith('*')))
+    return terms
+
+
+def fts_query(terms):
+    """Every term must match; terms are quoted, so FTS5 operators in the input are just words."""
+    return ' '.join(f'"{term}"' + ('*' if prefix else '') for term, prefix in terms)
+
+
+def relevance(tokens, terms, average_length):
+    """
+    BM25 term-frequency score of one message. Every hit contains every term, so
+    the inverse document frequency is the same for all of them and left out.
+    """
+    norm = BM25_K1 * (1 - BM25_B + BM25_B * len(tokens) / average_length)
+    counts = Counter(tokens)
+    score = 0.0
+    for term, prefix in terms:
+        tf = sum(n for token, n in counts.items() if token.startswith(term)) if prefix else counts[term]
+        score += tf * (BM25_K1 + 1) / (tf + norm)
+    return score
+
+
+def _snippet_html(snippet):
+    """Escape a snippet and turn the match markers into <mark> tags."""
+    return str(escape(snippet)).replace(SNIPPET_START, '<mark>').replace(SNIPPET_END, '</mark>')
+
+
+def search_group_messages(group_id, text, order='rank', cursor=None, limit=20):
+    """
+    Matching messages of one group, best first (order='rank') or newest first
+    (order='recent'). Returns (hits, next_cursor); pass next_cursor back to get
+    the following page. Each hit is (id, score, snippet_html).
+
+    Ranking looks at the newest CHAT_SEARCH_RANK_WINDOW hits only. The cursor
+    remembers where that window ended, so later pages rank the same messages
+    even while new ones arrive. Raises ValueError for a malformed cursor.
+    """
+    terms = search_terms(text)
+    if not terms:
+        return [], None
+    if not chat_search_fts():
+        return _search_group_messages_like(group_id, terms, cursor, limit)
+
+    # the user's words only look at the message column, or 'g1' would match every message of group 1
+    match = f'group_tag:g{int(group_id)} AND message : ({fts_query(terms)})'
+    if order == 'recent':
+        before = int(cursor) if cursor else None
+        rows = db.session.execute(db.text(
+            "SELECT rowid FROM group_message_fts WHERE group_message_fts MATCH :match"
+            + (" AND rowid < :before" if before else "") + " ORDER BY rowid DESC LIMIT :limit"),
+            {'match': match, 'before': before, 'limit': limit + 1}).all()
+        page = [(row[0], None) for row in rows[:limit]]
+        next_cursor = str(page[-1][0]) if len(rows) > limit else None
+    else:
+        # bm25() would count the group's own token across the whole index on every
+        # query, so the (small) window is scored here instead
+        top = after = None
+        if cursor:
+            score, message_id, top = cursor.split(':')
+            after = (float(score), int(message_id))
+            top = int(top)
+        window = db.session.execute(db.text(
+            "SELECT f.rowid, m.message FROM group_message_fts f CROSS JOIN group_message m ON m.id = f.rowid "
+            "WHERE group_message_fts MATCH :match" + (" AND f.rowid <= :top" if top else "")
+            + " ORDER BY f.rowid DESC LIMIT :window"),
+            {'match': match, 'top': top, 'window': app.config['CHAT_SEARCH_RANK_WINDOW']}).all()
+        if not window:
+            return [], None
+        top = top or window[0][0]
+        tokenized = [(message_id, search_tokens(message)) for message_id, message in window]
+        average_length = sum(len(tokens) for _, tokens in tokenized) / len(tokenized) or 1
+        ranked = sorted(((round(relevance(tokens, terms, average_length), 6), message_id)
+                         for message_id, tokens in tokenized), reverse=True)
+        if after:
+            ranked = [hit for hit in ranked if hit < after]
+        page = [(message_id, score) for score, message_id in ranked[:limit]]
+        next_cursor = f'{page[-1][1]!r}:{page[-1][0]}:{top}' if len(ranked) > limit else None
+
+    ids = [message_id for message_id, _ in page]
+    snippets = dict(db.session.execute(db.text(
+        f"SELECT rowid, snippet(group_message_fts, 0, :start, :end, '…', 16) FROM group_message_fts "
+        f"WHERE group_message_fts MATCH :match AND rowid BETWEEN {min(ids)} AND {max(ids)} "
+        f"AND +rowid IN ({','.join(map(str, ids))})"),
+        {'match': match, 'start': SNIPPET_START, 'end': SNIPPET_END}).all()) if ids else {}
+    hits = [(message_id, score, _snippet_html(snippets.get(message_id, ''))) for message_id, score in page]
+    return hits, next_cursor
+
+
+def _search_group_messages_like(group_id, terms, cursor, limit):
+    """Newest-first LIKE scan, for databases without FTS5."""
+    query = GroupMessage.query.filter(GroupMessage.group_id == group_id)
+    for term, _ in terms:
+        term = term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        query = query.filter(GroupMessage.message.ilike(f'%{term}%', escape='\\'))
+    if cursor:
+        query = query.filter(GroupMessage.id < int(cursor.split(':')[0]))
+    rows = query.order_by(GroupMessage.id.desc()).limit(limit + 1).all()
+    hits = [(msg.id, None, str(escape(msg.message[:200]))) for msg in rows[:limit]]
+    return hits, (str(hits[-1][0]) if len(rows) > limit else None)
+
+
+@app.route('/groups/<int:group_id>/messages/search')
+@login_required
+def search_messages(group_id):
+    """
+    Full-text search in a group's chat.
+
+    Query parameters:
+      q       words to find (all must match; end a word with * to match prefixes)
+      order   'rank' (default, best matches first) or 'recent'
+      cursor  next_cursor from the previous page
+      limit   page size (default 20, max 100)
+    """
+    group = Group.query.get_or_404(group_id)
+    if not group.is_member(current_user.id):
+        return jsonify({'error': 'Unauthorized'}), 403
+    text = (request.args.get('q') or '').strip()[:200]
+    order = 'recent' if request.args.get('order') == 'recent' else 'rank'
+    limit = max(1, min(request.args.get('limit', app.config['CHAT_SEARCH_PAGE_SIZE'], type=int), 100))
+    try:
+        hits, next_cursor = search_group_messages(group_id, text, order, request.args.get('cursor'), limit)
+    except ValueError:
+        return jsonify({'error': 'invalid cursor'}), 400
+    rows = {msg.id: (msg, user) for msg, user in
+            db.session.query(GroupMessage, User).join(User)
+            .filter(GroupMessage.id.in_([hit[0] for hit in hits]))}
+    results = []
+    for message_id, score, snippet_html in hits:
+        if message_id not in rows:
+            continue
+        msg, user = rows[message_id]
+        results.append({
+            'id': msg.id, 'user': user.name, 'user_id': msg.user_id,
+            'timestamp': msg.timestamp.isoformat() + 'Z' if msg.timestamp else None,
+            'snippet_html': snippet_html, 'score': score,
+            'media_filename': msg.media_filename,
+        })
+    return jsonify({'query': text, 'order': order, 'results': results, 'next_cursor': next_cursor})
+
+
+# --- Trip search ---
+# Trips and itinerary items are found through two FTS5 tables kept in sync by
+# triggers (like chat search) and through itinerary_tag, one row per item tag.
+# Everything is filtered by the same rule as is_trip_member.
+def fts_ddl(table, columns):
+    """An FTS5 index over some text columns of a table, and the triggers that keep it in sync."""
+    name = f'{table}_fts'
+    cols = ', '.join(columns)
+    new = ', '.join(f'new.{column}' for column in columns)
+    old = ', '.join(f'old.{column}' for column in columns)
+    return [
+        f"""CREATE VIRTUAL TABLE IF NOT EXISTS {name} USING fts5({cols}, content='{table}', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2', prefix='2 3')""",
+        f"""CREATE TRIGGER IF NOT EXISTS {name}_insert AFTER INSERT ON {table} BEGIN
+            INSERT INTO {name}(rowid, {cols}) VALUES (new.id, {new});
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS {name}_delete AFTER DELETE ON {table} BEGIN
+            INSERT INTO {name}({name}, rowid, {cols}) VALUES ('delete', old.id, {old});
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS {name}_update AFTER UPDATE OF {cols} ON {table} BEGIN
+            INSERT INTO {name}({name}, rowid, {cols}) VALUES ('delete', old.id, {old});
+            INSERT INTO {name}(rowid, {cols}) VALUES (new.id, {new});
+        END""",
+    ]
+
+
+TRIP_SEARCH_DDL = {
+    Trip.__table__: fts_ddl('trip', ('title', 'destination', 'description')),
+    ItineraryItem.__table__: fts_ddl('itinerary_item', ('title', 'location', 'description', 'tags')),
+}
+for table, statements in TRIP_SEARCH_DDL.items():
+    for statement in statements:
+        event.listen(table, 'after_create', db.DDL(statement).execute_if(dialect='sqlite'))
+
+app.config['TRIP_SEARCH_PAGE_SIZE'] = 20
+
+
+def split_tags(text):
+    """Normalized tags of a comma separated string: 'Beach, street  food,beach' -> ['beach', 'street food']."""
+    tags = []
+    for tag in (text or '').split(','):
+        tag = ' '.join(tag.casefold().split())[:60]
+        if tag and tag not in tags:
+            tags.append(tag)
+    return tags
+
+
+def index_item_tags(connection, items=(), removed=()):
+    """Rewrite the itinerary_tag rows of (item_id, trip_id, tags) items; drop those of removed item ids."""
+    table = ItineraryTag.__table__
+    items = list(items)
+    stale = [item_id for item_id, _, _ in items] + list(removed)
+    for start in range(0, len(stale), 500):
+        connection.execute(table.delete().where(table.c.item_id.in_(stale[start:start + 500])))
+    rows = [{'item_id': item_id, 'trip_id': trip_id, 'tag': tag}
+            for item_id, trip_id, tags in items for tag in split_tags(tags)]
+    if rows:
+        connection.execute(table.insert(), rows)
+
+
+def reindex_trip_tags(trip_ids, connection=None):
+    """Rebuild the tag rows of whole trips from their items; for writes that bypass the ORM (imports)."""
+    connection = connection or db.session.connection()
+    items = connection.execute(db.select(ItineraryItem.id, ItineraryItem.trip_id, ItineraryItem.tags)
+                               .where(ItineraryItem.trip_id.in_(trip_ids))).all()
+    connection.execute(ItineraryTag.__table__.delete().where(ItineraryTag.trip_id.in_(trip_ids)))
+    index_item_tags(connection, [item for item in items if item.tags])
+
+
+@event.listens_for(Session, 'before_flush')
+def _drop_deleted_item_tags(session, flush_context, instances):
+    """Remove the itinerary_tag rows of items this flush deletes; before it, as they reference the items."""
+    removed = [obj.id for obj in session.deleted if isinstance(obj, ItineraryItem)]
+    if removed:
+        index_item_tags(session.connection(), removed=removed)
+
+
+@event.listens_for(Session, 'after_flush')
+def _sync_item_tags(session, flush_context):
+    """Keep itinerary_tag in step with the items this flush added, retagged or moved."""
+    changed = []
+    for obj in list(session.new) + list(session.dirty):
+        if isinstance(obj, ItineraryItem):
+            state = db.inspect(obj)
+            if obj in session.new or state.attrs.tags.history.has_changes() or state.attrs.trip_id.history.has_changes():
+                changed.append((obj.id, obj.trip_id, obj.tags))
+    if changed:
+        index_item_tags(session.connection(), changed)
+
+
+def rebuild_trip_search():
+    """Create the trip search tables if missing and fill them from all trips and itinerary items."""
+    with db.engine.begin() as connection:
+        ItineraryTag.__table__.create(connection, checkfirst=True)
+        connection.execute(ItineraryTag.__table__.delete())
+        query = (db.select(ItineraryItem.id, ItineraryItem.trip_id, ItineraryItem.tags)
+                 .where(ItineraryItem.tags.is_not(None)).order_by(ItineraryItem.id))
+        batch = []
+        for item in connection.execute(query):
+            batch.append(item)
+            if len(batch) == 5000:
+                index_item_tags(connection, batch)
+                batch = []
+        index_item_tags(connection, batch)
+        if connection.dialect.name == 'sqlite':
+            for statements in TRIP_SEARCH_DDL.values():
+                for statement in statements:
+                    connection.exec_driver_sql(statement)
+            for name in ('trip_fts', 'itinerary_item_fts'):
+                connection.exec_driver_sql(f"INSERT INTO {name}({name}) VALUES ('rebuild')")
+                connection.exec_driver_sql(f"INSERT INTO {name}({name}) VALUES ('optimize')")
+
+
+def accessible_trips(user_id):
+    """SQL condition on Trip with the rule of is_trip_member: the owner or an active member of its group."""
+    return db.or_(Trip.user_id == user_id, Trip.group_id.in_(active_group_ids(user_id)))
+
+
+def _fts_match(name, match):
+    return db.literal_column(name).op('MATCH')(match)
+
+
+def _fts_snippet(name, column):
+    return db.func.snippet(db.literal_column(name), column, SNIPPET_START, SNIPPET_END, '…', 12)
+
+
+def search_trips(user_id, text, tag=None, limit=20):
+    """
+    Trips and itinerary items the user may see that match all words of text
+    and, if given, carry the tag. Returns {'trips': [...], 'items': [...]}
+    as plain rows, best matches first (items by date when only a tag is given).
+    """
+    terms = search_terms(text or '')
+    tag = ' '.join((tag or '').casefold().split())
+    if not terms and not tag:
+        return {'trips': [], 'items': []}
+    use_fts = terms and trip_search_fts()
+
+    trips = (db.select(Trip.id, Trip.title, Trip.destination, Trip.start_date, Trip.end_date)
+             .where(accessible_trips(user_id)).limit(limit))
+    items = (db.select(ItineraryItem.id, ItineraryItem.trip_id, ItineraryItem.title, ItineraryItem.datetime,
+                       ItineraryItem.location, ItineraryItem.tags, Trip.title.label('trip_title'))
+             .join(Trip, Trip.id == ItineraryItem.trip_id)
+             .where(accessible_trips(user_id)).limit(limit))
+    if tag:
+        tagged = db.select(ItineraryTag.item_id).where(ItineraryTag.tag == tag)
+        items = items.where(ItineraryItem.id.in_(tagged))
+        trips = trips.where(Trip.id.in_(db.select(ItineraryTag.trip_id).where(ItineraryTag.tag == tag)))
+    if use_fts:
+        match = fts_query(terms)
+        trips = (trips.add_columns(_fts_snippet('trip_fts', -1).label('snippet'))
+                 .join(db.table('trip_fts', db.column('rowid')), db.literal_column('trip_fts.rowid') == Trip.id)
+                 .where(_fts_match('trip_fts', match)).order_by(db.func.bm25(db.literal_column('trip_fts'))))
+        items = (items.add_columns(_fts_snippet('itinerary_item_fts', -1).label('snippet'))
+                 .join(db.table('itinerary_item_fts', db.column('rowid')),
+                       db.literal_column('itinerary_item_fts.rowid') == ItineraryItem.id)
+                 .where(_fts_match('itinerary_item_fts', match))
+                 .order_by(db.func.bm25(db.literal_column('itinerary_item_fts'))))
+    else:
+        # databases without FTS5 (and tag-only searches) scan the user's own trips instead
+        for term, _ in terms:
+            pattern = '%' + term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+            trips = trips.where(db.or_(*(column.ilike(pattern, escape='\\') for column in
+                                         (Trip.title, Trip.destination, Trip.description))))
+            items = items.where(db.or_(*(column.ilike(pattern, escape='\\') for column in
+                                         (ItineraryItem.title, ItineraryItem.location,
+                                          ItineraryItem.description, ItineraryItem.tags))))
+        trips = trips.order_by(Trip.start_date.desc())
+        items = items.order_by(ItineraryItem.datetime)
+    return {'trips': db.session.execute(trips).all(), 'items': db.session.execute(items).all()}
+
+
+_trip_search_fts = None
+
+
+def trip_search_fts():
+    """True when the trip and itinerary FTS5 tables exist (checked once per process)."""
+    global _trip_search_fts
+    if _trip_search_fts is None:
+        _trip_search_fts = db.engine.dialect.name == 'sqlite' and db.session.execute(db.text(
+            "SELECT count(*) FROM sqlite_master WHERE type = 'table' "
+            "AND name IN ('trip_fts', 'itinerary_item_fts')")).scalar() == 2
+    return _trip_search_fts
+
+
+def search_suggestions(user_id, text, limit=8):
+    """
+    Autocomplete for the search box: tags, trips and itinerary items starting
+    with what was typed, read straight from the tag and FTS indexes.
+    """
+    terms = search_terms(text)
+    if not terms:
+        return []
+    typed = ' '.join(text.casefold().split())
+    suggestions = []
+    tags = (db.select(ItineraryTag.tag, db.func.count().label('uses'))
+            .join(Trip, Trip.id == ItineraryTag.trip_id)
+            .where(ItineraryTag.tag >= typed, ItineraryTag.tag < typed + '\uffff', accessible_trips(user_id))
+            .group_by(ItineraryTag.tag).order_by(db.desc('uses'), ItineraryTag.tag).limit(limit))
+    for row in db.session.execute(tags):
+        suggestions.append({'kind': 'tag', 'text': row.tag, 'url': url_for('search', tag=row.tag)})
+    if trip_search_fts():
+        match = fts_query(terms[:-1] + [(terms[-1][0], True)])
+        trips = (db.select(Trip.id, Trip.title, Trip.destination)
+                 .join(db.table('trip_fts', db.column('rowid')), db.literal_column('trip_fts.rowid') == Trip.id)
+                 .where(_fts_match('trip_fts', '{title destination} : (' + match + ')'), accessible_trips(user_id))
+                 .order_by(Trip.start_date.desc()).limit(limit))
+        for row in db.session.execute(trips):
+            suggestions.append({'kind': 'trip', 'text': f'{row.title} ({row.destination})',
+                                'url': url_for('view_trip', trip_id=row.id)})
+        items = (db.select(ItineraryItem.trip_id, ItineraryItem.title, ItineraryItem.datetime)
+                 .join(Trip, Trip.id == ItineraryItem.trip_id)
+                 .join(db.table('itinerary_item_fts', db.column('rowid')),
+                       db.literal_column('itinerary_item_fts.rowid') == ItineraryItem.id)
+                 .where(_fts_match('itinerary_item_fts', '{title location} : (' + match + ')'),
+                        accessible_trips(user_id))
+                 .order_by(ItineraryItem.datetime.desc()).limit(limit))
+        for row in db.session.execute(items):
+            suggestions.append({'kind': 'item', 'text': row.title,
+                                'url': url_for('view_trip', trip_id=row.trip_id,
+                                               _anchor=f'heading-{row.datetime.date().isoformat()}')})
+    return suggestions[:limit]
+
+
+@app.route('/search')
+@login_required
+def search():
+    """Search the trips and itinerary items the user can see, by words (q) and/or tag."""
+    text = (request.args.get('q') or '').strip()[:200]
+    tag = (request.args.get('tag') or '').strip()[:60]
+    if text.startswith('#') and not tag:  # '#beach' from the autocomplete means the tag
+        text, tag = '', text[1:]
+    results = search_trips(current_user.id, text, tag, app.config['TRIP_SEARCH_PAGE_SIZE'])
+    return render_template('search.html', q=text, tag=tag, trips=results['trips'], items=results['items'],
+                           snippet_html=_snippet_html)
+
+
+@app.route('/search/suggest')
+@login_required
+def search_suggest():
+    """Autocomplete for the search box (JSON)."""
+    text = (request.args.get('q') or '').strip()[:100]
+    return jsonify({'query': text, 'suggestions': search_suggestions(current_user.id, text)})
+
 
 @app.route('/trip/<int:trip_id>/share/<token>', methods=['GET'])
 @login_required
@@ -1606,16 +4631,11 @@ def share_trip(trip_id, token):
             role='member'
         )
         db.session.add(member)
+        db.session.commit()
+        invalidate_membership(current_user.id)
         
         # Add a welcome message to the group chat
-        welcome_msg = GroupMessage(
-            group_id=group.id,
-            user_id=current_user.id,
-            message=f"👋 {current_user.name} joined via trip: {trip.title}!"
-        )
-        db.session.add(welcome_msg)
-        
-        db.session.commit()
+        post_status_message(group.id, current_user.id, f"👋 {current_user.name} joined via trip: {trip.title}!")
         
         # Emit socket event if SocketIO is enabled
         if SOCKETIO_ENABLED and socketio:
@@ -1691,6 +4711,7 @@ def leave_group(group_id):
             return redirect(url_for('group_detail', group_id=group_id))
     db.session.delete(gm)
     db.session.commit()
+    invalidate_membership(current_user.id)
     flash('Left group', 'info')
     return redirect(url_for('groups'))
 
@@ -1717,6 +4738,7 @@ def remove_member(group_id, user_id):
         user_name = member.user.name
         db.session.delete(member)
         db.session.commit()
+        invalidate_membership(user_id)
         flash(f'Member "{user_name}" removed successfully.', 'success')
     except Exception as e:
         db.session.rollback()
@@ -1738,34 +4760,27 @@ def delete_group(group_id):
         return redirect(url_for('group_detail', group_id=group_id))
     
     try:
-        # Delete all related data (cascade will handle most of it)
-        # Delete all messages
-        GroupMessage.query.filter_by(group_id=group_id).delete()
-        
-        # Delete all members
-        GroupMember.query.filter_by(group_id=group_id).delete()
-        
-        # Delete all trips associated with this group
-        trips = Trip.query.filter_by(group_id=group_id).all()
-        for trip in trips:
-            # Delete trip expenses
-            Expense.query.filter_by(trip_id=trip.id).delete()
-            # Delete itinerary items
-            ItineraryItem.query.filter_by(trip_id=trip.id).delete()
-            # Delete trip cover image if exists
-            if trip.cover_image:
-                try:
-                    file_path = os.path.join(app.root_path, 'static', trip.cover_image)
-                    if os.path.exists(file_path):
-                        os.remove(file_path)
-                except Exception:
-                    app.logger.exception("Failed to delete trip cover image")
-            # Delete the trip
-            db.session.delete(trip)
-        
-        # Delete the group
-        db.session.delete(group)
+        # Make sure no queued chat message for this group lands after the delete
+        message_pipeline.flush()
+        # Everything goes in one transaction with a fixed number of statements, however
+        # many trips and messages the group has; photos and covers are removed after the commit
+        media = [name for (name,) in db.session.query(GroupMessage.media_filename)
+                 .filter(GroupMessage.group_id == group_id, GroupMessage.media_filename.is_not(None))]
+        db.session.execute(db.delete(GroupMessage).where(GroupMessage.group_id == group_id)
+                           .execution_options(synchronize_session=False))
+
+        # Delete all members (remember who they were to drop their cached membership)
+        member_ids = [uid for (uid,) in db.session.query(GroupMember.user_id).filter_by(group_id=group_id)]
+        db.session.execute(db.delete(GroupMember).where(GroupMember.group_id == group_id)
+                           .execution_options(synchronize_session=False))
+
+        # The group's trips with their itineraries, expenses and ledgers
+        delete_trips(db.select(Trip.id).where(Trip.group_id == group_id))
+
+        db.session.execute(db.delete(Group).where(Group.id == group_id).execution_options(synchronize_session=False))
+        after_commit(remove_files_later, (), media)
         db.session.commit()
+        invalidate_membership(*member_ids)
         
         flash('Group deleted successfully', 'success')
         return redirect(url_for('groups'))
@@ -1785,6 +4800,7 @@ def reset_group_link(group_id):
         flash('Only admins can reset the invite link.', 'danger')
         return redirect(url_for('group_detail', group_id=group_id))
         
+    discard_group_qr(group)
     group.generate_join_token()
     db.session.commit()
     flash('Invitation link has been reset. Old links will no longer work.', 'success')
@@ -1818,24 +4834,20 @@ def approve_join_request(group_id, user_id):
         
     member = GroupMember.query.filter_by(group_id=group_id, user_id=user_id, status='pending').first_or_404()
     member.status = 'active'
-    
-    # Add welcome message
-    welcome_msg = GroupMessage(
-        group_id=group.id,
-        user_id=user_id,
-        message=f"👋 {member.user.name} joined the group!",
-        timestamp=datetime.utcnow()
-    )
-    db.session.add(welcome_msg)
     db.session.commit()
+    invalidate_membership(user_id)
+
+    # Add welcome message
+    welcome_msg = post_status_message(group.id, user_id, f"👋 {member.user.name} joined the group!")
 
     # Emit to room if SocketIO active
-    if SOCKETIO_ENABLED and socketio:
+    if welcome_msg and SOCKETIO_ENABLED and socketio:
         socketio.emit('new_message', {
+            'id': welcome_msg['id'],
             'user': member.user.name,
             'user_id': user_id,
-            'text': f"👋 {member.user.name} joined the group!",
-            'timestamp': welcome_msg.timestamp.isoformat() + 'Z',
+            'text': welcome_msg['message'],
+            'timestamp': welcome_msg['timestamp'].isoformat() + 'Z',
             'is_status': True
         }, room=f'group_{group_id}')
 
@@ -1856,10 +4868,91 @@ def reject_join_request(group_id, user_id):
     user_name = member.user.name
     db.session.delete(member)
     db.session.commit()
+    invalidate_membership(user_id)
     flash(f'Rejected request from {user_name}.', 'info')
     return redirect(url_for('group_detail', group_id=group_id))
 
 
+# --- CLI commands ---
+@app.cli.command('verify-ledger')
+@click.option('--trip', 'trip_id', type=int, default=None, help='Only check this trip.')
+@click.option('--fix', is_flag=True, help='Overwrite drifted ledger rows with the rebuilt values.')
+def verify_ledger(trip_id, fix):
+    """Rebuild trip balances from expenses and report drift from the stored ledger."""
+    trip_ids = [trip_id] if trip_id else [tid for (tid,) in db.session.query(Trip.id).order_by(Trip.id)]
+    drifted = 0
+    for tid in trip_ids:
+        expected = compute_balances(tid)
+        stored = get_trip_balances(tid)
+        for user_id in sorted(set(expected) | set(stored)):
+            want = expected.get(user_id, 0)
+            have = stored.get(user_id)
+            if have == want or (have is None and want == 0):
+                continue
+            drifted += 1
+            click.echo(f'trip {tid} user {user_id}: ledger={have} expected={want} (paise)')
+            if fix:
+                row = TripBalance.query.filter_by(trip_id=tid, user_id=user_id).first()
+                if row:
+                    row.balance_minor = want
+                else:
+                    db.session.add(TripBalance(trip_id=tid, user_id=user_id, balance_minor=want))
+    if fix:
+        db.session.commit()
+    click.echo(f'Checked {len(trip_ids)} trip(s), {drifted} drifted balance(s)' + (' repaired.' if fix and drifted else '.'))
+    if drifted and not fix:
+        raise SystemExit(1)
+
+
+@app.cli.command('build-assets')
+@click.option('--clean', is_flag=True, help='Also delete files left over from earlier builds.')
+def build_assets_command(clean):
+    """Copy static CSS/JS/images to static/dist under content-hash names, precompressed."""
+    manifest = build_assets(clean)
+    click.echo(f"Built {len(manifest)} asset(s) into {app.config['ASSET_FOLDER']}"
+               + ('' if BROTLI_ENABLED else ' (gzip only; pip install brotli for .br files)') + '.')
+    click.echo('Restart the server to pick up the new manifest.')
+
+
+@app.cli.command('rebuild-chat-search')
+def rebuild_chat_search_command():
+    """Create the chat search index if needed and reload it from all chat history."""
+    if db.engine.dialect.name != 'sqlite':
+        raise click.ClickException('chat search indexing needs SQLite (FTS5); other databases use a LIKE scan')
+    started = time.perf_counter()
+    rebuild_chat_search()
+    count = db.session.query(db.func.count(GroupMessage.id)).scalar()
+    click.echo(f'Indexed {count} chat message(s) in {time.perf_counter() - started:.1f}s.')
+
+
+@app.cli.command('rebuild-trip-search')
+def rebuild_trip_search_command():
+    """Create the trip search index and tag table if needed and reload them from all trips."""
+    started = time.perf_counter()
+    rebuild_trip_search()
+    tags = db.session.query(db.func.count()).select_from(ItineraryTag).scalar()
+    click.echo(f'Indexed trips, itinerary items and {tags} tag(s) in {time.perf_counter() - started:.1f}s.')
+
+
+@app.cli.command('gc-uploads')
+@click.option('--dry-run', is_flag=True, help='Only report what would be removed.')
+@click.option('--grace', type=int, default=None, help='Keep files younger than this many seconds (default UPLOAD_GC_GRACE).')
+@click.option('--pause', type=float, default=None, help='Seconds to wait between batches (default UPLOAD_GC_PAUSE).')
+def gc_uploads_command(dry_run, grace, pause):
+    """Remove uploaded files that no chat message or trip uses any more."""
+    started = time.perf_counter()
+    report = sweep_uploads(grace, dry_run, pause)
+    for folder, counts in report.items():
+        click.echo(f"{os.path.relpath(folder, app.root_path)}: {counts['removed']} of {counts['scanned']} file(s), "
+                   f"{format_bytes(counts['bytes'])}")
+    removed = sum(counts['removed'] for counts in report.values())
+    reclaimed = format_bytes(sum(counts['bytes'] for counts in report.values()))
+    if dry_run:
+        click.echo(f'Would remove {removed} file(s) and reclaim {reclaimed}.')
+    else:
+        click.echo(f'Removed {removed} file(s), {reclaimed} reclaimed in {time.perf_counter() - started:.1f}s.')
+
+
 # --- Run server ---
 if __name__ == '__main__':
     import socket
@@ -0,0 +1,55 @@
+"""add full-text search index for group chat
+
+Revision ID: add_chat_search
+Revises: add_itinerary_item_version
+Create Date: 2026-10-17 18:00:00.000000
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'add_chat_search'
+down_revision = 'add_itinerary_item_version'
+branch_labels = None
+depends_on = None
+
+
+# kept in step with CHAT_SEARCH_DDL in app.py
+CHAT_SEARCH_DDL = [
+    """CREATE VIEW IF NOT EXISTS group_message_search_source AS
+        SELECT id, message, 'g' || group_id AS group_tag FROM group_message""",
+    """CREATE VIRTUAL TABLE IF NOT EXISTS group_message_fts USING fts5(
+        message, group_tag, content='group_message_search_source', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3')""",
+    """CREATE TRIGGER IF NOT EXISTS group_message_fts_insert AFTER INSERT ON group_message BEGIN
+        INSERT INTO group_message_fts(rowid, message, group_tag) VALUES (new.id, new.message, 'g' || new.group_id);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS group_message_fts_delete AFTER DELETE ON group_message BEGIN
+        INSERT INTO group_message_fts(group_message_fts, rowid, message, group_tag)
+            VALUES ('delete', old.id, old.message, 'g' || old.group_id);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS group_message_fts_update AFTER UPDATE OF message, group_id ON group_message BEGIN
+        INSERT INTO group_message_fts(group_message_fts, rowid, message, group_tag)
+            VALUES ('delete', old.id, old.message, 'g' || old.group_id);
+        INSERT INTO group_message_fts(rowid, message, group_tag) VALUES (new.id, new.message, 'g' || new.group_id);
+    END""",
+]
+
+
+def upgrade():
+    # FTS5 is SQLite only; other databases search chat with LIKE
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    for statement in CHAT_SEARCH_DDL:
+        op.execute(statement)
+    op.execute("INSERT INTO group_message_fts(group_message_fts) VALUES ('rebuild')")
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    for trigger in ('insert', 'delete', 'update'):
+        op.execute(f'DROP TRIGGER IF EXISTS group_message_fts_{trigger}')
+    op.execute('DROP TABLE IF EXISTS group_message_fts')
+    op.execute('DROP VIEW IF EXISTS group_message_search_source')
@@ -0,0 +1,24 @@
+"""add (group_id, id) index for chat history paging
+
+Revision ID: add_group_message_cursor_index
+Revises: add_trip_balance
+Create Date: 2026-10-17 11:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'add_group_message_cursor_index'
+down_revision = 'add_trip_balance'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_group_message_group_id_id', 'group_message', ['group_id', 'id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_group_message_group_id_id', table_name='group_message')
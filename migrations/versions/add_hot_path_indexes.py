@@ -0,0 +1,37 @@
+"""add indexes for hot foreign-key filters
+
+Revision ID: add_hot_path_indexes
+Revises: add_group_message_cursor_index
+Create Date: 2026-10-17 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'add_hot_path_indexes'
+down_revision = 'add_group_message_cursor_index'
+branch_labels = None
+depends_on = None
+
+
+INDEXES = [
+    ('ix_expense_trip_id', 'expense', ['trip_id']),
+    ('ix_itinerary_item_trip_id_datetime', 'itinerary_item', ['trip_id', 'datetime']),
+    ('ix_group_message_group_id_timestamp', 'group_message', ['group_id', 'timestamp']),
+    ('ix_trip_user_id', 'trip', ['user_id']),
+    ('ix_trip_group_id', 'trip', ['group_id']),
+    ('ix_group_member_user_id_status', 'group_member', ['user_id', 'status']),
+    ('ix_expense_participants_user_id', 'expense_participants', ['user_id']),
+]
+
+
+def upgrade():
+    for name, table, columns in INDEXES:
+        op.create_index(name, table, columns, unique=False)
+
+
+def downgrade():
+    for name, table, columns in reversed(INDEXES):
+        op.drop_index(name, table_name=table)
@@ -0,0 +1,26 @@
+"""add version stamp to itinerary items
+
+Revision ID: add_itinerary_item_version
+Revises: add_version_stamps
+Create Date: 2026-10-17 15:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'add_itinerary_item_version'
+down_revision = 'add_version_stamps'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('itinerary_item', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('version', sa.BigInteger(), nullable=False, server_default='0'))
+
+
+def downgrade():
+    with op.batch_alter_table('itinerary_item', schema=None) as batch_op:
+        batch_op.drop_column('version')
@@ -0,0 +1,36 @@
+"""add trip balance ledger
+
+Revision ID: add_trip_balance
+Revises: add_group_columns
+Create Date: 2026-10-17 10:00:00.000000
+
+Existing trips start with an empty ledger; run `flask verify-ledger --fix`
+after upgrading to fill it in from the expenses already recorded.
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'add_trip_balance'
+down_revision = 'add_group_columns'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('trip_balance',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('trip_id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('balance_minor', sa.Integer(), nullable=False, server_default='0'),
+        sa.ForeignKeyConstraint(['trip_id'], ['trip.id']),
+        sa.ForeignKeyConstraint(['user_id'], ['user.id']),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('trip_id', 'user_id', name='unique_trip_balance')
+    )
+
+
+def downgrade():
+    op.drop_table('trip_balance')
@@ -0,0 +1,89 @@
+"""add trip search: itinerary tag table and full-text indexes
+
+Revision ID: add_trip_search
+Revises: add_chat_search
+Create Date: 2026-10-17 20:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'add_trip_search'
+down_revision = 'add_chat_search'
+branch_labels = None
+depends_on = None
+
+
+def fts_ddl(table, columns):
+    # kept in step with fts_ddl in app.py
+    name = f'{table}_fts'
+    cols = ', '.join(columns)
+    new = ', '.join(f'new.{column}' for column in columns)
+    old = ', '.join(f'old.{column}' for column in columns)
+    return [
+        f"""CREATE VIRTUAL TABLE IF NOT EXISTS {name} USING fts5({cols}, content='{table}', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2', prefix='2 3')""",
+        f"""CREATE TRIGGER IF NOT EXISTS {name}_insert AFTER INSERT ON {table} BEGIN
+            INSERT INTO {name}(rowid, {cols}) VALUES (new.id, {new});
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS {name}_delete AFTER DELETE ON {table} BEGIN
+            INSERT INTO {name}({name}, rowid, {cols}) VALUES ('delete', old.id, {old});
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS {name}_update AFTER UPDATE OF {cols} ON {table} BEGIN
+            INSERT INTO {name}({name}, rowid, {cols}) VALUES ('delete', old.id, {old});
+            INSERT INTO {name}(rowid, {cols}) VALUES (new.id, {new});
+        END""",
+    ]
+
+
+FTS_TABLES = {'trip': ('title', 'destination', 'description'),
+              'itinerary_item': ('title', 'location', 'description', 'tags')}
+
+
+def split_tags(text):
+    # same normalization as split_tags in app.py
+    tags = []
+    for tag in (text or '').split(','):
+        tag = ' '.join(tag.casefold().split())[:60]
+        if tag and tag not in tags:
+            tags.append(tag)
+    return tags
+
+
+def upgrade():
+    itinerary_tag = op.create_table(
+        'itinerary_tag',
+        sa.Column('item_id', sa.Integer(), sa.ForeignKey('itinerary_item.id'), primary_key=True),
+        sa.Column('tag', sa.String(length=60), primary_key=True),
+        sa.Column('trip_id', sa.Integer(), sa.ForeignKey('trip.id'), nullable=False),
+    )
+    op.create_index('ix_itinerary_tag_tag_trip_id', 'itinerary_tag', ['tag', 'trip_id'])
+    op.create_index('ix_itinerary_tag_trip_id', 'itinerary_tag', ['trip_id'])
+
+    bind = op.get_bind()
+    items = bind.execute(sa.text('SELECT id, trip_id, tags FROM itinerary_item WHERE tags IS NOT NULL')).all()
+    rows = [{'item_id': item_id, 'trip_id': trip_id, 'tag': tag}
+            for item_id, trip_id, tags in items for tag in split_tags(tags)]
+    if rows:
+        op.bulk_insert(itinerary_tag, rows)
+
+    # FTS5 is SQLite only; other databases search with LIKE
+    if bind.dialect.name != 'sqlite':
+        return
+    for table, columns in FTS_TABLES.items():
+        for statement in fts_ddl(table, columns):
+            op.execute(statement)
+        op.execute(f"INSERT INTO {table}_fts({table}_fts) VALUES ('rebuild')")
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'sqlite':
+        for table in FTS_TABLES:
+            for trigger in ('insert', 'delete', 'update'):
+                op.execute(f'DROP TRIGGER IF EXISTS {table}_fts_{trigger}')
+            op.execute(f'DROP TABLE IF EXISTS {table}_fts')
+    op.drop_index('ix_itinerary_tag_trip_id', table_name='itinerary_tag')
+    op.drop_index('ix_itinerary_tag_tag_trip_id', table_name='itinerary_tag')
+    op.drop_table('itinerary_tag')
@@ -0,0 +1,32 @@
+"""add indexes for the orphaned upload sweep
+
+Revision ID: add_upload_gc_indexes
+Revises: add_trip_search
+Create Date: 2026-10-17 21:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'add_upload_gc_indexes'
+down_revision = 'add_trip_search'
+branch_labels = None
+depends_on = None
+
+
+INDEXES = [
+    ('ix_group_message_media_filename', 'group_message', ['media_filename']),
+    ('ix_trip_cover_image', 'trip', ['cover_image']),
+]
+
+
+def upgrade():
+    for name, table, columns in INDEXES:
+        op.create_index(name, table, columns, unique=False)
+
+
+def downgrade():
+    for name, table, columns in reversed(INDEXES):
+        op.drop_index(name, table_name=table)
@@ -0,0 +1,30 @@
+"""add version stamps to trip and group
+
+Revision ID: add_version_stamps
+Revises: add_hot_path_indexes
+Create Date: 2026-10-17 14:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'add_version_stamps'
+down_revision = 'add_hot_path_indexes'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('trip', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('version', sa.BigInteger(), nullable=False, server_default='0'))
+    with op.batch_alter_table('group', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('version', sa.BigInteger(), nullable=False, server_default='0'))
+
+
+def downgrade():
+    with op.batch_alter_table('group', schema=None) as batch_op:
+        batch_op.drop_column('version')
+    with op.batch_alter_table('trip', schema=None) as batch_op:
+        batch_op.drop_column('version')
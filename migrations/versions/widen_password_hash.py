@@ -0,0 +1,29 @@
+"""widen user.password_hash for scrypt hashes
+
+Revision ID: widen_password_hash
+Revises: add_upload_gc_indexes
+Create Date: 2026-10-17 22:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'widen_password_hash'
+down_revision = 'add_upload_gc_indexes'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Werkzeug's scrypt hashes are 162 characters
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.alter_column('password_hash', existing_type=sa.String(length=128),
+                              type_=sa.String(length=255), existing_nullable=False)
+
+
+def downgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.alter_column('password_hash', existing_type=sa.String(length=255),
+                              type_=sa.String(length=128), existing_nullable=False)
@@ -0,0 +1,114 @@
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from statistics import median
+
+# Make 'app' importable when running this script from the project root or scripts/
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+WORDS = ('beach hotel train ticket dinner lunch breakfast museum taxi airport flight booking '
+         'sunset hike trek temple market bus ferry camera passport visa money cash card '
+         'tomorrow tonight morning evening early late meet lobby room check pack bags '
+         'pizza coffee tea snacks water rain sunny cold hot plan change cancel confirm').split()
+RARE = ('houseboat', 'paragliding', 'snorkel', 'rickshaw', 'monastery')
+QUERIES = ('houseboat', 'snorkel*', 'beach hotel', 'taxi', 'ta*', 'dinner tonight confirm', 'nothingmatches')
+
+
+def seed(db_file, messages, groups, rng):
+    """Create a database with messages spread over groups, most of them in the first one."""
+    os.environ['DATABASE_URL'] = f'sqlite:///{db_file}'
+    os.environ['SOCKETIO_ASYNC_MODE'] = 'threading'
+    sys.path.insert(0, ROOT)
+    from app import app, db, User, Group, GroupMessage
+
+    with app.app_context():
+        db.create_all()
+        user = User(name='Bench', email='bench@example.com', password_hash='x')
+        db.session.add(user)
+        db.session.flush()
+        group_ids = []
+        for n in range(groups):
+            group = Group(name=f'Bench {n}', admin_id=user.id, is_active=True)
+            group.generate_join_token()
+            db.session.add(group)
+            db.session.flush()
+            group_ids.append(group.id)
+        db.session.commit()
+
+        def text():
+            words = rng.choices(WORDS, k=rng.randint(3, 14))
+            if rng.random() < 0.001:
+                words.insert(rng.randrange(len(words)), rng.choice(RARE))
+            return ' '.join(words)
+
+        started = time.perf_counter()
+        batch = []
+        for i in range(messages):
+            group_id = group_ids[0] if i % 10 < 8 else rng.choice(group_ids)  # one very busy group
+            batch.append({'group_id': group_id, 'user_id': user.id, 'message': text()})
+            if len(batch) == 10000:
+                db.session.execute(db.insert(GroupMessage), batch)
+                batch = []
+        if batch:
+            db.session.execute(db.insert(GroupMessage), batch)
+        db.session.commit()
+        print(f'seeded {messages} messages (index kept by triggers) in {time.perf_counter() - started:.1f}s')
+
+
+def run(args):
+    rng = random.Random(args.seed)
+    db_file = args.db or os.path.join(tempfile.mkdtemp(), 'chat_search.db')
+    if args.db and os.path.exists(args.db):
+        sys.path.insert(0, ROOT)
+        os.environ['DATABASE_URL'] = f'sqlite:///{args.db}'
+        os.environ['SOCKETIO_ASYNC_MODE'] = 'threading'
+    else:
+        seed(db_file, args.messages, args.groups, rng)
+    from app import app, db, GroupMessage, search_group_messages, rebuild_chat_search
+
+    with app.app_context():
+        if args.rebuild:
+            started = time.perf_counter()
+            rebuild_chat_search()
+            print(f'rebuild-chat-search: {time.perf_counter() - started:.1f}s')
+        sizes = db.session.query(GroupMessage.group_id).group_by(GroupMessage.group_id) \
+            .order_by(db.func.count().desc()).all()
+        print(f"{'group':>5} {'query':<24} {'order':<7} {'hits':>5} {'p50 ms':>8} {'max ms':>8}   {'page 2 p50':>10}")
+        print('-' * 76)
+        worst = 0.0
+        for group_id in (sizes[0][0], sizes[-1][0]):  # the busiest group and the quietest one
+            count = db.session.query(db.func.count(GroupMessage.id)).filter(GroupMessage.group_id == group_id).scalar()
+            print(f'group {group_id}: {count} messages')
+            for query in QUERIES:
+                for order in ('rank', 'recent'):
+                    times, page2 = [], [0.0]
+                    for _ in range(args.rounds):
+                        started = time.perf_counter()
+                        hits, cursor = search_group_messages(group_id, query, order, limit=20)
+                        times.append((time.perf_counter() - started) * 1000)
+                        if cursor:
+                            started = time.perf_counter()
+                            search_group_messages(group_id, query, order, cursor, limit=20)
+                            page2.append((time.perf_counter() - started) * 1000)
+                    p50, page2_p50 = median(times), median(page2[1:] or page2)
+                    worst = max(worst, p50, page2_p50)
+                    print(f'{group_id:>5} {query:<24} {order:<7} {len(hits):>5} {p50:>8.2f} {max(times):>8.2f}   '
+                          f'{page2_p50:>9.2f}')
+        # medians: a single run can include a garbage-collector pause that has nothing to do with search
+        print(f'\nslowest median: {worst:.1f} ms (target {args.target} ms) -> {"OK" if worst <= args.target else "SLOW"}')
+        return 0 if worst <= args.target else 1
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Time group chat search on a large chat history.')
+    parser.add_argument('--messages', type=int, default=1_000_000, help='messages to seed')
+    parser.add_argument('--groups', type=int, default=20)
+    parser.add_argument('--rounds', type=int, default=5, help='repeats per query')
+    parser.add_argument('--target', type=float, default=50, help='latency goal in ms')
+    parser.add_argument('--db', help='reuse (or create) this database file instead of a temporary one')
+    parser.add_argument('--rebuild', action='store_true', help='also time rebuilding the index')
+    parser.add_argument('--seed', type=int, default=1)
+    sys.exit(run(parser.parse_args()))
@@ -0,0 +1,192 @@
+import argparse
+import os
+import re
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+PASSWORD = 'Bench-login-1'
+
+
+def seed(db_file, chatters, signers):
+    """Create a group of chatters plus accounts that only sign in; returns (chatter emails, signer emails, group id)."""
+    os.environ['DATABASE_URL'] = f'sqlite:///{db_file}'
+    os.environ['SOCKETIO_ASYNC_MODE'] = 'threading'  # this process only seeds the database
+    sys.path.insert(0, ROOT)
+    from werkzeug.security import generate_password_hash
+    from app import app, db, User, Group, GroupMember
+
+    # one real (default method) hash shared by every account: signing in has to pay for it, seeding doesn't
+    password_hash = generate_password_hash(PASSWORD)
+    with app.app_context():
+        db.create_all()
+        chat = [User(name=f'Chat {i}', email=f'chat{i}@example.com', password_hash=password_hash)
+                for i in range(chatters)]
+        sign = [User(name=f'Sign {i}', email=f'sign{i}@example.com', password_hash=password_hash)
+                for i in range(signers)]
+        db.session.add_all(chat + sign)
+        db.session.flush()
+        group = Group(name='Bench', admin_id=chat[0].id, is_active=True)
+        group.generate_join_token()
+        db.session.add(group)
+        db.session.flush()
+        for i, user in enumerate(chat):
+            db.session.add(GroupMember(group_id=group.id, user_id=user.id, role='admin' if i == 0 else 'member'))
+        db.session.commit()
+        return [u.email for u in chat], [u.email for u in sign], group.id
+
+
+def wait_for_port(port, timeout=30):
+    import requests
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            requests.get(f'http://127.0.0.1:{port}/login', timeout=1)
+            return
+        except requests.ConnectionError:
+            time.sleep(0.2)
+    raise RuntimeError(f'server on port {port} did not start')
+
+
+def sign_in(base, email):
+    """Log in over HTTP; returns (requests session, status of the POST, seconds it took)."""
+    import requests
+    session = requests.Session()
+    page = session.get(f'{base}/login').text
+    token = re.search(r'name="csrf_token" type="hidden" value="([^"]+)"', page)
+    data = {'email': email, 'password': PASSWORD}
+    if token:
+        data['csrf_token'] = token.group(1)
+    started = time.perf_counter()
+    response = session.post(f'{base}/login', data=data, allow_redirects=False)
+    return session, response.status_code, time.perf_counter() - started
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] * 1000 if values else 0
+
+
+def run_once(args, db_file, chat_emails, sign_emails, group_id, workers):
+    """Start a server with PASSWORD_HASH_WORKERS=workers, chat and sign in at the same time, return the numbers."""
+    import socketio
+
+    env = dict(os.environ, DATABASE_URL=f'sqlite:///{db_file}', PASSWORD_HASH_WORKERS=str(workers),
+               PASSWORD_HASH_MAX_PENDING=str(args.max_pending))
+    server = subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, 'serve.py'), '--async-mode', args.async_mode,
+         '--port', str(args.port), '--shutdown-grace', '1'],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    base = f'http://127.0.0.1:{args.port}'
+    sockets = []
+    try:
+        wait_for_port(args.port)
+        chat_latencies, sent = [], {}
+        lock = threading.Lock()
+
+        def on_message(data):
+            text = data.get('text') or ''
+            if text.startswith('ping '):
+                with lock:
+                    if text in sent:
+                        chat_latencies.append(time.perf_counter() - sent.pop(text))
+
+        for i, email in enumerate(chat_emails):
+            session, status, _ = sign_in(base, email)
+            if status != 302:
+                raise RuntimeError(f'chat login failed for {email} ({status})')
+            joined = threading.Event()
+            client = socketio.Client(http_session=session, reconnection=False)
+            client.on('joined', lambda data, joined=joined: joined.set())
+            if i == 0:
+                client.on('new_message', on_message)  # the pinger listens for its own broadcasts
+            client.connect(base, transports=['websocket'])
+            client.emit('join', {'group': group_id})
+            if not joined.wait(10):
+                raise RuntimeError(f'{email} could not join the group')
+            sockets.append(client)
+
+        stop = threading.Event()
+        login_times, statuses = [], {}
+
+        def sign_in_loop(n):
+            while not stop.is_set():
+                _, status, took = sign_in(base, sign_emails[n % len(sign_emails)])
+                with lock:
+                    statuses[status] = statuses.get(status, 0) + 1
+                    if status == 302:
+                        login_times.append(took)
+                n += args.concurrency
+
+        def ping_loop():
+            count = 0
+            while not stop.is_set():
+                text = f'ping {count}'
+                with lock:
+                    sent[text] = time.perf_counter()
+                sockets[0].emit('message', {'group': group_id, 'text': text})
+                count += 1
+                time.sleep(args.ping_interval)
+
+        threads = [threading.Thread(target=sign_in_loop, args=(n,), daemon=True) for n in range(args.concurrency)]
+        threads.append(threading.Thread(target=ping_loop, daemon=True))
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        time.sleep(args.duration)
+        stop.set()
+        for thread in threads:
+            thread.join(10)
+        elapsed = time.perf_counter() - started
+        time.sleep(0.5)  # late pings
+        with lock:
+            lost = len(sent)
+        return {'logins': len(login_times) / elapsed, 'login_p50': percentile(login_times, 0.5),
+                'login_p99': percentile(login_times, 0.99), 'chat_p50': percentile(chat_latencies, 0.5),
+                'chat_p99': percentile(chat_latencies, 0.99), 'chat_max': percentile(chat_latencies, 1.0),
+                'pings': len(chat_latencies), 'lost': lost, 'statuses': statuses}
+    finally:
+        for client in sockets:
+            try:
+                client.disconnect()
+            except Exception:
+                pass
+        server.send_signal(signal.SIGTERM)
+        server.wait(timeout=30)
+
+
+def run(args):
+    db_file = os.path.join(tempfile.mkdtemp(), 'bench_login.db')
+    chat_emails, sign_emails, group_id = seed(db_file, args.chatters, max(args.concurrency * 4, 20))
+    print(f'{args.async_mode} worker, {args.chatters} chat sockets, {args.concurrency} concurrent sign-ins '
+          f'for {args.duration:.0f}s, a chat ping every {args.ping_interval * 1000:.0f} ms')
+    print(f"{'hash workers':<14} {'logins/s':>9} {'login p50':>10} {'login p99':>10} "
+          f"{'chat p50':>9} {'chat p99':>9} {'chat max':>9}   responses")
+    print('-' * 100)
+    for workers in args.workers:
+        result = run_once(args, db_file, chat_emails, sign_emails, group_id, workers)
+        label = f'{workers}' if workers else '0 (inline)'
+        statuses = ', '.join(f'{status}: {count}' for status, count in sorted(result['statuses'].items()))
+        print(f"{label:<14} {result['logins']:>9.1f} {result['login_p50']:>8.0f}ms {result['login_p99']:>8.0f}ms "
+              f"{result['chat_p50']:>7.1f}ms {result['chat_p99']:>7.1f}ms {result['chat_max']:>7.1f}ms   {statuses}"
+              + (f", {result['lost']} ping(s) unanswered" if result['lost'] else ''))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Measure sign-in throughput and chat latency while many users sign in at once.')
+    parser.add_argument('--async-mode', choices=('eventlet', 'gevent', 'threading'), default='eventlet')
+    parser.add_argument('--workers', type=int, nargs='+', default=[0, 2],
+                        help='PASSWORD_HASH_WORKERS values to compare (0 hashes inside the request)')
+    parser.add_argument('--max-pending', type=int, default=32, help='PASSWORD_HASH_MAX_PENDING for the server')
+    parser.add_argument('--chatters', type=int, default=20, help='chat sockets in the group')
+    parser.add_argument('--concurrency', type=int, default=8, help='clients signing in at the same time')
+    parser.add_argument('--duration', type=float, default=10, help='seconds of load per run')
+    parser.add_argument('--ping-interval', type=float, default=0.05, help='seconds between chat pings')
+    parser.add_argument('--port', type=int, default=5320)
+    run(parser.parse_args())
@@ -0,0 +1,73 @@
+import argparse
+import os
+import random
+import sys
+import time
+
+# Make 'app' importable when running this script from the project root or scripts/
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from app import app, expense_deltas, _greedy_settlements, _optimal_settlements
+
+
+def random_balances(members, expenses, rng):
+    """
+    Build realistic trip balances (in paise) by replaying random expenses,
+    the same way the app's ledger does.
+    """
+    balances = {user_id: 0 for user_id in range(1, members + 1)}
+    for _ in range(expenses):
+        payer = rng.randint(1, members)
+        participants = rng.sample(range(1, members + 1), rng.randint(1, min(members, 8)))
+        amount = rng.choice([rng.randint(50, 5000), rng.randint(100, 50000) / 100])
+        for user_id, delta in expense_deltas(amount, payer, participants).items():
+            balances[user_id] += delta
+    return balances
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, (time.perf_counter() - start) * 1000
+
+
+def run(sizes, rounds, budget, seed):
+    """
+    For each group size, print the average time and number of transfers for
+    the greedy and the optimal settlement modes. 'fallback' counts how often
+    the optimal search gave up (too many people or over the time budget), in
+    which case the app would have used the greedy answer instead.
+    """
+    rng = random.Random(seed)
+    print(f"{'members':>7} | {'greedy ms':>9} {'transfers':>9} | {'optimal ms':>10} {'transfers':>9} {'fallback':>8}")
+    print('-' * 66)
+    with app.app_context():
+        for members in sizes:
+            greedy_ms = optimal_ms = 0.0
+            greedy_count = optimal_count = fallbacks = 0
+            for _ in range(rounds):
+                balances = random_balances(members, members * 5, rng)
+                greedy, ms = timed(_greedy_settlements, balances)
+                greedy_ms += ms
+                greedy_count += len(greedy)
+                optimal, ms = timed(_optimal_settlements, balances, time.monotonic() + budget)
+                optimal_ms += ms
+                if optimal is None:
+                    fallbacks += 1
+                    optimal_count += len(greedy)
+                else:
+                    optimal_count += len(optimal)
+            print(f"{members:>7} | {greedy_ms / rounds:>9.2f} {greedy_count / rounds:>9.1f} | "
+                  f"{optimal_ms / rounds:>10.2f} {optimal_count / rounds:>9.1f} {fallbacks:>5}/{rounds}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark greedy vs optimal settlements.')
+    parser.add_argument('--sizes', default='5,8,10,12,15,18,20,50,100,200',
+                        help='comma separated group sizes (default: %(default)s)')
+    parser.add_argument('--rounds', type=int, default=5, help='random trips per size (default: %(default)s)')
+    parser.add_argument('--budget', type=float, default=app.config['SETTLEMENT_TIME_BUDGET'],
+                        help='optimal search time budget in seconds (default: %(default)s)')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+    run([int(s) for s in args.sizes.split(',')], args.rounds, args.budget, args.seed)
@@ -0,0 +1,87 @@
+import os
+import random
+import sys
+import tempfile
+from datetime import date, timedelta
+
+# Use a throwaway database so this never touches instance/tripmates.db
+db_file = os.path.join(tempfile.mkdtemp(), 'query_count.db')
+os.environ['DATABASE_URL'] = f'sqlite:///{db_file}'
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from sqlalchemy import event
+
+from app import (app, db, User, Group, GroupMember, Trip, Expense, expense_participants,
+                 apply_balance_deltas, expense_deltas)
+
+EXPENSES = 500
+MEMBERS = 12
+# The expenses page must stay within this many SQL statements no matter how many expenses exist
+MAX_STATEMENTS = 10
+
+
+def seed():
+    """Create one group trip with MEMBERS people and EXPENSES expenses."""
+    db.create_all()
+    users = []
+    for i in range(MEMBERS):
+        user = User(name=f'Member {i}', email=f'member{i}@example.com')
+        user.set_password('Passw0rd!')
+        users.append(user)
+    db.session.add_all(users)
+    db.session.flush()
+    group = Group(name='Query Count', admin_id=users[0].id)
+    group.generate_join_token()
+    db.session.add(group)
+    db.session.flush()
+    db.session.add_all(GroupMember(group_id=group.id, user_id=u.id) for u in users)
+    trip = Trip(user_id=users[0].id, group_id=group.id, title='Long trip', destination='Goa',
+                start_date=date.today(), end_date=date.today() + timedelta(days=30))
+    db.session.add(trip)
+    db.session.flush()
+
+    rng = random.Random(7)
+    for i in range(EXPENSES):
+        payer = rng.choice(users)
+        participants = rng.sample(users, rng.randint(1, MEMBERS))
+        amount = rng.randint(100, 100000) / 100
+        exp = Expense(trip_id=trip.id, title=f'Expense {i}', amount=amount, payer_id=payer.id)
+        db.session.add(exp)
+        db.session.flush()
+        db.session.execute(expense_participants.insert(),
+                           [{'expense_id': exp.id, 'user_id': u.id} for u in participants])
+        apply_balance_deltas(trip.id, expense_deltas(amount, payer.id, [u.id for u in participants]))
+    db.session.commit()
+    return trip.id, users[1].email
+
+
+def main():
+    app.config['WTF_CSRF_ENABLED'] = False
+    with app.app_context():
+        trip_id, email = seed()
+        engine = db.engine
+
+    client = app.test_client()
+    client.post('/login', data={'email': email, 'password': 'Passw0rd!'})
+
+    statements = []
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine, 'before_cursor_execute', count)
+    try:
+        response = client.get(f'/trip/{trip_id}/expenses')
+    finally:
+        event.remove(engine, 'before_cursor_execute', count)
+
+    print(f'GET /trip/{trip_id}/expenses with {EXPENSES} expenses: '
+          f'status {response.status_code}, {len(statements)} SQL statements (limit {MAX_STATEMENTS})')
+    if response.status_code != 200 or len(statements) > MAX_STATEMENTS:
+        for statement in statements:
+            print('  ' + ' '.join(statement.split())[:160])
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+import os
+import sys
+import tempfile
+from datetime import date
+
+# Use a throwaway database so this never touches instance/tripmates.db
+db_file = os.path.join(tempfile.mkdtemp(), 'query_plans.db')
+os.environ['DATABASE_URL'] = f'sqlite:///{db_file}'
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from app import (app, db, User, Group, GroupMember, GroupMessage, Trip, ItineraryItem, Expense,
+                 TripBalance, expense_participants)
+
+
+def hot_queries():
+    """
+    The queries behind the busiest pages, built the same way the routes build them.
+    Each entry is (name, SQLAlchemy statement).
+    """
+    today = date.today()
+    member_count = db.func.count(GroupMember.id)
+    return [
+        ('expenses of a trip',
+         Expense.query.filter_by(trip_id=1).order_by(Expense.id.desc()).statement),
+        ('expense participants (selectin)',
+         db.select(expense_participants.c.expense_id, User.id)
+         .join(User, User.id == expense_participants.c.user_id)
+         .where(expense_participants.c.expense_id.in_([1, 2, 3]))),
+        ('expenses a user took part in',
+         db.select(expense_participants.c.expense_id).where(expense_participants.c.user_id == 1)),
+        ('trip balance ledger',
+         TripBalance.query.filter_by(trip_id=1).statement),
+        ('itinerary of a trip',
+         ItineraryItem.query.filter_by(trip_id=1).order_by(ItineraryItem.datetime).statement),
+        ('latest chat messages',
+         GroupMessage.query.filter_by(group_id=1).order_by(GroupMessage.timestamp.desc()).limit(100).statement),
+        ('chat history page',
+         GroupMessage.query.filter(GroupMessage.group_id == 1, GroupMessage.id < 500)
+         .order_by(GroupMessage.id.desc()).limit(51).statement),
+        ('active groups of a user',
+         db.session.query(GroupMember.group_id).filter_by(user_id=1, status='active').statement),
+        ('members of a group',
+         GroupMember.query.filter_by(group_id=1, status='active').statement),
+        ('trips owned by a user',
+         Trip.query.filter_by(user_id=1).statement),
+        ('dashboard trips',
+         Trip.query.filter(db.or_(Trip.user_id == 1, Trip.group_id.in_([1, 2, 3])))
+         .order_by(Trip.start_date).statement),
+        ('trips of a group',
+         Trip.query.filter_by(group_id=1).statement),
+        ('dashboard groups with member counts',
+         db.session.query(Group, member_count)
+         .join(GroupMember, db.and_(GroupMember.group_id == Group.id, GroupMember.status == 'active'))
+         .filter(Group.id.in_([1, 2, 3])).group_by(Group.id).order_by(Group.name).statement),
+    ]
+
+
+def full_scans(plan):
+    """Plan lines that read a whole table instead of searching an index."""
+    return [detail for detail in plan
+            if detail.startswith('SCAN ') and 'USING' not in detail and 'CONSTANT ROW' not in detail]
+
+
+def main():
+    failures = 0
+    with app.app_context():
+        db.create_all()
+        for name, statement in hot_queries():
+            sql = str(statement.compile(dialect=db.engine.dialect, compile_kwargs={'literal_binds': True}))
+            plan = [row[3] for row in db.session.execute(db.text(f'EXPLAIN QUERY PLAN {sql}'))]
+            scans = full_scans(plan)
+            status = 'FAIL' if scans else 'ok  '
+            print(f'{status} {name}: {"; ".join(plan)}')
+            failures += bool(scans)
+    if failures:
+        print(f'{failures} hot quer{"y does" if failures == 1 else "ies do"} a full table scan')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
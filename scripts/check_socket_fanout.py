@@ -0,0 +1,160 @@
+import argparse
+import os
+import re
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from socket_broker import make_server
+
+PASSWORD = 'Fanout-check-1'
+
+
+def seed(db_file):
+    """Create the schema with two members of one group; returns the group id."""
+    os.environ['DATABASE_URL'] = f'sqlite:///{db_file}'
+    os.environ['SOCKETIO_ASYNC_MODE'] = 'threading'  # this process only seeds the database
+    sys.path.insert(0, ROOT)
+    from app import app, db, User, Group, GroupMember
+
+    with app.app_context():
+        db.create_all()
+        users = []
+        for name in ('alice', 'bob'):
+            user = User(name=name.title(), email=f'{name}@example.com')
+            user.set_password(PASSWORD)
+            db.session.add(user)
+            users.append(user)
+        db.session.flush()
+        group = Group(name='Fanout', admin_id=users[0].id, is_active=True)
+        group.generate_join_token()
+        db.session.add(group)
+        db.session.flush()
+        for user in users:
+            db.session.add(GroupMember(group_id=group.id, user_id=user.id,
+                                       role='admin' if user is users[0] else 'member'))
+        db.session.commit()
+        return group.id
+
+
+def wait_for_port(port, timeout=20):
+    import requests
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            requests.get(f'http://127.0.0.1:{port}/login', timeout=1)
+            return
+        except requests.ConnectionError:
+            time.sleep(0.2)
+    raise RuntimeError(f'worker on port {port} did not start')
+
+
+def connect(port, email, group_id):
+    """Log in over HTTP, open a Socket.IO connection and join the group room."""
+    import requests
+    import socketio
+
+    base = f'http://127.0.0.1:{port}'
+    session = requests.Session()
+    page = session.get(f'{base}/login').text
+    token = re.search(r'name="csrf_token" type="hidden" value="([^"]+)"', page)
+    data = {'email': email, 'password': PASSWORD}
+    if token:
+        data['csrf_token'] = token.group(1)
+    response = session.post(f'{base}/login', data=data, allow_redirects=False)
+    assert response.status_code == 302, f'login failed for {email}'
+
+    received = []
+    joined = threading.Event()
+    client = socketio.Client(http_session=session)
+    client.on('joined', lambda data: joined.set())
+    client.on('new_message', lambda data: received.append(data))
+    client.connect(base)
+    client.emit('join', {'group': group_id})
+    assert joined.wait(5), f'{email} could not join the room on port {port}'
+    return client, received
+
+
+def wait_until(check, timeout=5):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if check():
+            return True
+        time.sleep(0.05)
+    return check()
+
+
+def run(messages):
+    tmp = tempfile.mkdtemp()
+    db_file = os.path.join(tmp, 'fanout.db')
+    broker_path = os.path.join(tmp, 'broker.sock')
+    group_id = seed(db_file)
+
+    broker = make_server(unix_path=broker_path)
+    threading.Thread(target=broker.serve_forever, daemon=True).start()
+
+    env = dict(os.environ, DATABASE_URL=f'sqlite:///{db_file}',
+               SOCKETIO_MESSAGE_QUEUE=f'unix://{broker_path}')
+    ports = (5301, 5302)
+    workers = [subprocess.Popen([sys.executable, os.path.join(ROOT, 'serve.py'), '--port', str(port),
+                                 '--async-mode', 'threading', '--shutdown-grace', '1'],
+                                env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+               for port in ports]
+    clients = []
+    try:
+        for port in ports:
+            wait_for_port(port)
+        alice, alice_got = connect(ports[0], 'alice@example.com', group_id)
+        bob, bob_got = connect(ports[1], 'bob@example.com', group_id)
+        clients = [alice, bob]
+
+        # worker A -> client on worker B, and the other way round
+        texts = [f'fanout {i}' for i in range(messages)]
+        for i, text in enumerate(texts):
+            (alice if i % 2 == 0 else bob).emit('message', {'group': group_id, 'text': text})
+
+        def chat(got):
+            return [m for m in got if not m.get('is_status')]
+
+        ok = True
+        for name, got in (('alice (worker A)', alice_got), ('bob (worker B)', bob_got)):
+            wait_until(lambda: len(chat(got)) >= messages)
+            seen = {m['text'] for m in chat(got)}
+            missing = [t for t in texts if t not in seen]
+            print(f'{name}: received {len(seen)}/{messages} messages')
+            ok &= not missing
+
+        ids = [m['id'] for m in chat(bob_got)]
+        print(f'message ids unique across workers: {len(ids) == len(set(ids))}')
+        ok &= len(ids) == len(set(ids))
+    finally:
+        for client in clients:
+            client.disconnect()
+        for proc in workers:
+            proc.send_signal(signal.SIGTERM)  # drains the worker and flushes the chat pipeline
+        for proc in workers:
+            proc.wait(timeout=10)
+        broker.shutdown()
+        broker.server_close()
+
+    import sqlite3
+    saved = sqlite3.connect(db_file).execute(
+        'SELECT COUNT(*), COUNT(DISTINCT id) FROM group_message WHERE message LIKE ?', ('fanout %',)).fetchone()
+    print(f'saved to the database: {saved[0]} rows, {saved[1]} distinct ids')
+    ok &= saved == (messages, messages)
+    print('OK' if ok else 'FAILED')
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Start two app workers sharing the stand-in broker and check chat reaches both.')
+    parser.add_argument('--messages', type=int, default=20)
+    args = parser.parse_args()
+    sys.exit(run(args.messages))
@@ -37,6 +37,7 @@ def create_tables():
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
             is_active BOOLEAN DEFAULT 1,           -- 1 means active, 0 means deleted
             approval_required BOOLEAN DEFAULT 0,   -- New: admin must approve
+            version INTEGER NOT NULL DEFAULT 0,    -- Goes up on every change (used for browser caching)
             FOREIGN KEY (admin_id) REFERENCES user(id) -- Link this to the 'user' table
         )
         ''')
@@ -89,6 +90,7 @@ def create_tables():
             description TEXT,
             cover_image TEXT,                      -- Path to the trip's background image
             share_token TEXT UNIQUE,               -- Unique token for sharing this trip
+            version INTEGER NOT NULL DEFAULT 0,    -- Goes up whenever the trip, its plan or expenses change
             FOREIGN KEY (user_id) REFERENCES user(id),
             FOREIGN KEY (group_id) REFERENCES "group"(id)
         )
@@ -106,6 +108,7 @@ def create_tables():
             location TEXT,
             cost NUMERIC(10,2),                    -- Estimated cost
             tags TEXT,
+            version INTEGER NOT NULL DEFAULT 0,    -- Goes up when the item is edited (for page caching)
             FOREIGN KEY (trip_id) REFERENCES trip(id)
         )
         ''')
@@ -137,10 +140,122 @@ def create_tables():
         )
         ''')
 
+        # --- 9. Trip Balances Table ---
+        # A running total of what each person is owed (or owes) on a trip, in paise.
+        # Updated every time an expense is added, edited or deleted.
+        cur.execute('''
+        CREATE TABLE IF NOT EXISTS trip_balance (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            trip_id INTEGER NOT NULL,             -- Which trip is this balance for?
+            user_id INTEGER NOT NULL,             -- Whose balance is it?
+            balance_minor INTEGER NOT NULL DEFAULT 0, -- Positive = owed money, negative = owes money
+            FOREIGN KEY (trip_id) REFERENCES trip(id),
+            FOREIGN KEY (user_id) REFERENCES user(id),
+            UNIQUE(trip_id, user_id)              -- One balance per person per trip
+        )
+        ''')
+
+        # --- 10. Itinerary Tags Table ---
+        # Each tag of an itinerary item gets its own row ('Beach, Food' -> 'beach' and 'food'),
+        # so searching by tag doesn't have to read every item. The app keeps it up to date.
+        cur.execute('''
+        CREATE TABLE IF NOT EXISTS itinerary_tag (
+            item_id INTEGER NOT NULL,             -- The itinerary item
+            tag TEXT NOT NULL,                    -- One tag, lower case
+            trip_id INTEGER NOT NULL,             -- The item's trip (to check who may see it)
+            PRIMARY KEY (item_id, tag),
+            FOREIGN KEY (item_id) REFERENCES itinerary_item(id),
+            FOREIGN KEY (trip_id) REFERENCES trip(id)
+        )
+        ''')
+
         # --- Performance Boosters (Indexes) ---
         # Indexes make searching the database much faster.
         cur.execute('CREATE INDEX IF NOT EXISTS ix_group_join_token ON "group" (join_token)')
         cur.execute('CREATE UNIQUE INDEX IF NOT EXISTS unique_group_member ON group_member (group_id, user_id)')
+        # Chat history is loaded page by page using message ids inside one group
+        cur.execute('CREATE INDEX IF NOT EXISTS ix_group_message_group_id_id ON group_message (group_id, id)')
+        cur.execute('CREATE INDEX IF NOT EXISTS ix_group_message_group_id_timestamp ON group_message (group_id, timestamp)')
+        # Each of these columns is used to look rows up on a busy page
+        cur.execute('CREATE INDEX IF NOT EXISTS ix_group_member_user_id_status ON group_member (user_id, status)')
+        cur.execute('CREATE INDEX IF NOT EXISTS ix_trip_user_id ON trip (user_id)')
+        cur.execute('CREATE INDEX IF NOT EXISTS ix_trip_group_id ON trip (group_id)')
+        cur.execute('CREATE INDEX IF NOT EXISTS ix_itinerary_item_trip_id_datetime ON itinerary_item (trip_id, datetime)')
+        cur.execute('CREATE INDEX IF NOT EXISTS ix_expense_trip_id ON expense (trip_id)')
+        cur.execute('CREATE INDEX IF NOT EXISTS ix_expense_participants_user_id ON expense_participants (user_id)')
+        # Finding items by tag (and suggesting tags as you type)
+        cur.execute('CREATE INDEX IF NOT EXISTS ix_itinerary_tag_tag_trip_id ON itinerary_tag (tag, trip_id)')
+        cur.execute('CREATE INDEX IF NOT EXISTS ix_itinerary_tag_trip_id ON itinerary_tag (trip_id)')
+        # Finding out which uploaded pictures are still used (see `flask --app app gc-uploads`)
+        cur.execute('CREATE INDEX IF NOT EXISTS ix_group_message_media_filename ON group_message (media_filename)')
+        cur.execute('CREATE INDEX IF NOT EXISTS ix_trip_cover_image ON trip (cover_image)')
+
+        # --- Chat search ---
+        # A full-text index of chat messages (SQLite's FTS5), so searching a group's chat
+        # doesn't have to read every message. The 'g<group id>' word lets one search stay inside one group.
+        cur.execute("""
+        CREATE VIEW IF NOT EXISTS group_message_search_source AS
+            SELECT id, message, 'g' || group_id AS group_tag FROM group_message
+        """)
+        cur.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS group_message_fts USING fts5(
+            message, group_tag, content='group_message_search_source', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2', prefix='2 3')
+        """)
+        # Triggers update the index automatically whenever a message is added, changed or deleted
+        cur.execute("""
+        CREATE TRIGGER IF NOT EXISTS group_message_fts_insert AFTER INSERT ON group_message BEGIN
+            INSERT INTO group_message_fts(rowid, message, group_tag) VALUES (new.id, new.message, 'g' || new.group_id);
+        END
+        """)
+        cur.execute("""
+        CREATE TRIGGER IF NOT EXISTS group_message_fts_delete AFTER DELETE ON group_message BEGIN
+            INSERT INTO group_message_fts(group_message_fts, rowid, message, group_tag)
+                VALUES ('delete', old.id, old.message, 'g' || old.group_id);
+        END
+        """)
+        cur.execute("""
+        CREATE TRIGGER IF NOT EXISTS group_message_fts_update AFTER UPDATE OF message, group_id ON group_message BEGIN
+            INSERT INTO group_message_fts(group_message_fts, rowid, message, group_tag)
+                VALUES ('delete', old.id, old.message, 'g' || old.group_id);
+            INSERT INTO group_message_fts(rowid, message, group_tag) VALUES (new.id, new.message, 'g' || new.group_id);
+        END
+        """)
+        # Load any messages that were there before the index existed
+        cur.execute("INSERT INTO group_message_fts(group_message_fts) VALUES ('rebuild')")
+
+        # --- Trip search ---
+        # Full-text indexes of trips and itinerary items, kept up to date by triggers like the chat one
+        search_columns = {
+            'trip': ['title', 'destination', 'description'],
+            'itinerary_item': ['title', 'location', 'description', 'tags'],
+        }
+        for table, columns in search_columns.items():
+            index = table + '_fts'
+            cols = ', '.join(columns)
+            new_values = ', '.join('new.' + column for column in columns)
+            old_values = ', '.join('old.' + column for column in columns)
+            cur.execute(f"""
+            CREATE VIRTUAL TABLE IF NOT EXISTS {index} USING fts5({cols}, content='{table}', content_rowid='id',
+                tokenize='unicode61 remove_diacritics 2', prefix='2 3')
+            """)
+            cur.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS {index}_insert AFTER INSERT ON {table} BEGIN
+                INSERT INTO {index}(rowid, {cols}) VALUES (new.id, {new_values});
+            END
+            """)
+            cur.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS {index}_delete AFTER DELETE ON {table} BEGIN
+                INSERT INTO {index}({index}, rowid, {cols}) VALUES ('delete', old.id, {old_values});
+            END
+            """)
+            cur.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS {index}_update AFTER UPDATE OF {cols} ON {table} BEGIN
+                INSERT INTO {index}({index}, rowid, {cols}) VALUES ('delete', old.id, {old_values});
+                INSERT INTO {index}(rowid, {cols}) VALUES (new.id, {new_values});
+            END
+            """)
+            cur.execute(f"INSERT INTO {index}({index}) VALUES ('rebuild')")
 
         # Final Step: Commit (Save) the changes.
         # SQL won't save your work unless you explicitly tell it to 'Commit'.
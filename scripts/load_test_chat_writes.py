@@ -0,0 +1,120 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+
+def worker(writers, readers, messages):
+    """
+    Runs inside a child process with DATABASE_URL / SQLITE_TUNING already set.
+    Writer threads insert chat messages one commit at a time (like handle_message),
+    while reader threads keep loading the latest page of history (like get_messages).
+    Prints one JSON line with the results.
+    """
+    sys.path.insert(0, ROOT)
+    from sqlalchemy.exc import OperationalError
+    from app import app, db, User, Group, GroupMember, GroupMessage
+
+    with app.app_context():
+        db.create_all()
+        user = User(name='Load', email='load@example.com', password_hash='x')
+        db.session.add(user)
+        db.session.flush()
+        group = Group(name='Load', admin_id=user.id)
+        group.generate_join_token()
+        db.session.add(group)
+        db.session.flush()
+        db.session.add(GroupMember(group_id=group.id, user_id=user.id))
+        db.session.commit()
+        user_id, group_id = user.id, group.id
+
+    latencies = []
+    errors = []
+    done = threading.Event()
+    lock = threading.Lock()
+
+    def write():
+        with app.app_context():
+            for i in range(messages):
+                start = time.perf_counter()
+                try:
+                    db.session.add(GroupMessage(group_id=group_id, user_id=user_id, message=f'load {i}'))
+                    db.session.commit()
+                except OperationalError as e:
+                    db.session.rollback()
+                    with lock:
+                        errors.append(str(e.orig))
+                    continue
+                with lock:
+                    latencies.append(time.perf_counter() - start)
+
+    def read():
+        with app.app_context():
+            while not done.is_set():
+                try:
+                    (GroupMessage.query.filter_by(group_id=group_id)
+                     .order_by(GroupMessage.id.desc()).limit(50).all())
+                except OperationalError:
+                    pass
+                db.session.remove()
+
+    reader_threads = [threading.Thread(target=read) for _ in range(readers)]
+    writer_threads = [threading.Thread(target=write) for _ in range(writers)]
+    for t in reader_threads:
+        t.start()
+    started = time.perf_counter()
+    for t in writer_threads:
+        t.start()
+    for t in writer_threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+    done.set()
+    for t in reader_threads:
+        t.join()
+
+    latencies.sort()
+    pick = lambda q: latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000 if latencies else 0
+    print(json.dumps({
+        'written': len(latencies),
+        'errors': len(errors),
+        'locked': sum('locked' in e for e in errors),
+        'seconds': elapsed,
+        'per_second': len(latencies) / elapsed if elapsed else 0,
+        'p50_ms': pick(0.50),
+        'p99_ms': pick(0.99),
+    }))
+
+
+def run(writers, readers, messages):
+    """Run the same workload with SQLite defaults and with the app's tuning, then compare."""
+    print(f'{writers} writers x {messages} messages, {readers} concurrent readers')
+    print(f"{'mode':<8} {'msgs/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'errors':>7} {'locked':>7}")
+    for label, tuning in (('default', '0'), ('tuned', '1')):
+        db_file = os.path.join(tempfile.mkdtemp(), 'chat_load.db')
+        env = dict(os.environ, DATABASE_URL=f'sqlite:///{db_file}', SQLITE_TUNING=tuning)
+        out = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), '--worker',
+             '--writers', str(writers), '--readers', str(readers), '--messages', str(messages)],
+            env=env, capture_output=True, text=True, check=True)
+        result = json.loads(out.stdout.strip().splitlines()[-1])
+        print(f"{label:<8} {result['per_second']:>8.0f} {result['p50_ms']:>8.2f} {result['p99_ms']:>8.2f} "
+              f"{result['errors']:>7} {result['locked']:>7}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Measure chat-write throughput with and without SQLite tuning.')
+    parser.add_argument('--writers', type=int, default=8)
+    parser.add_argument('--readers', type=int, default=4)
+    parser.add_argument('--messages', type=int, default=200, help='messages per writer')
+    parser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.worker:
+        worker(args.writers, args.readers, args.messages)
+    else:
+        run(args.writers, args.readers, args.messages)
@@ -0,0 +1,172 @@
+import argparse
+import os
+import re
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+PASSWORD = 'Load-test-1'
+
+
+def seed(db_file, clients, groups):
+    """Create clients users spread round-robin over groups; returns [(email, group_id)]."""
+    os.environ['DATABASE_URL'] = f'sqlite:///{db_file}'
+    os.environ['SOCKETIO_ASYNC_MODE'] = 'threading'  # this process only seeds the database
+    sys.path.insert(0, ROOT)
+    from werkzeug.security import generate_password_hash
+    from app import app, db, User, Group, GroupMember
+
+    # a cheap hash so logging in hundreds of users doesn't dominate the run
+    password_hash = generate_password_hash(PASSWORD, method='pbkdf2:sha256:1000')
+    with app.app_context():
+        db.create_all()
+        users = [User(name=f'Load {i}', email=f'load{i}@example.com', password_hash=password_hash)
+                 for i in range(clients)]
+        db.session.add_all(users)
+        db.session.flush()
+        group_ids = []
+        for n in range(groups):
+            group = Group(name=f'Load {n}', admin_id=users[n].id, is_active=True)
+            group.generate_join_token()
+            db.session.add(group)
+            db.session.flush()
+            group_ids.append(group.id)
+        seats = []
+        for i, user in enumerate(users):
+            group_id = group_ids[i % groups]
+            db.session.add(GroupMember(group_id=group_id, user_id=user.id,
+                                       role='admin' if i < groups else 'member'))
+            seats.append((user.email, group_id))
+        db.session.commit()
+        return seats
+
+
+def wait_for_port(port, timeout=30):
+    import requests
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            requests.get(f'http://127.0.0.1:{port}/login', timeout=1)
+            return
+        except requests.ConnectionError:
+            time.sleep(0.2)
+    raise RuntimeError(f'server on port {port} did not start')
+
+
+class ChatClient:
+    """One logged-in user with a socket joined to their group's room."""
+
+    def __init__(self, base, email, group_id, on_message):
+        import requests
+        import socketio
+
+        self.group_id = group_id
+        session = requests.Session()
+        page = session.get(f'{base}/login').text
+        token = re.search(r'name="csrf_token" type="hidden" value="([^"]+)"', page)
+        data = {'email': email, 'password': PASSWORD}
+        if token:
+            data['csrf_token'] = token.group(1)
+        response = session.post(f'{base}/login', data=data, allow_redirects=False)
+        if response.status_code != 302:
+            raise RuntimeError(f'login failed for {email}')
+        joined = threading.Event()
+        self.socket = socketio.Client(http_session=session, reconnection=False)
+        self.socket.on('joined', lambda data: joined.set())
+        self.socket.on('new_message', on_message)
+        self.socket.connect(base, transports=['websocket'])
+        self.socket.emit('join', {'group': group_id})
+        if not joined.wait(10):
+            raise RuntimeError(f'{email} could not join group {group_id}')
+
+    def send(self, text):
+        self.socket.emit('message', {'group': self.group_id, 'text': text})
+
+
+def run(args):
+    server = None
+    if args.url:
+        base = args.url.rstrip('/')
+        seats = [(f'load{i}@example.com', args.group_ids[i % len(args.group_ids)]) for i in range(args.clients)]
+    else:
+        db_file = os.path.join(tempfile.mkdtemp(), 'socket_load.db')
+        seats = seed(db_file, args.clients, args.groups)
+        # the server keeps the cheap seeded hashes instead of upgrading each one at login
+        env = dict(os.environ, DATABASE_URL=f'sqlite:///{db_file}', PASSWORD_HASH_METHOD='pbkdf2:sha256:1000')
+        server = subprocess.Popen(
+            [sys.executable, os.path.join(ROOT, 'serve.py'), '--async-mode', args.async_mode,
+             '--port', str(args.port), '--max-connections', str(args.clients * 2 + 100),
+             '--shutdown-grace', '1'],
+            env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        wait_for_port(args.port)
+        base = f'http://127.0.0.1:{args.port}'
+
+    latencies = []
+    lock = threading.Lock()
+    expected = {}  # group_id -> clients in it
+
+    def on_message(data):
+        text = data.get('text') or ''
+        if text.startswith('load '):
+            sent = float(text.split()[1])
+            with lock:
+                latencies.append(time.time() - sent)
+
+    clients = []
+    try:
+        started = time.perf_counter()
+        for email, group_id in seats:
+            clients.append(ChatClient(base, email, group_id, on_message))
+            expected[group_id] = expected.get(group_id, 0) + 1
+        print(f'{len(clients)} sockets in {len(expected)} rooms connected in {time.perf_counter() - started:.1f}s '
+              f'({args.async_mode if server else base})')
+
+        senders = clients[:args.senders]
+        total = sum(expected[c.group_id] for c in senders) * args.messages
+        started = time.perf_counter()
+        for _ in range(args.messages):
+            for client in senders:
+                client.send(f'load {time.time():.6f}')
+            time.sleep(args.interval)
+        deadline = time.monotonic() + args.timeout
+        while time.monotonic() < deadline and len(latencies) < total:
+            time.sleep(0.05)
+        elapsed = time.perf_counter() - started
+    finally:
+        # in parallel: some servers (gevent without gevent-websocket) are slow to finish the close handshake
+        closers = [threading.Thread(target=client.socket.disconnect, daemon=True) for client in clients]
+        for closer in closers:
+            closer.start()
+        deadline = time.monotonic() + 5
+        for closer in closers:
+            closer.join(max(0, deadline - time.monotonic()))
+        if server is not None:
+            server.send_signal(signal.SIGTERM)
+            server.wait(timeout=30)
+
+    latencies.sort()
+    pick = lambda q: latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000 if latencies else 0
+    print(f'{args.senders} senders x {args.messages} messages -> {len(latencies)}/{total} deliveries '
+          f'in {elapsed:.1f}s ({len(latencies) / elapsed:.0f} deliveries/s)')
+    print(f'fan-out latency: p50 {pick(0.50):.1f} ms, p99 {pick(0.99):.1f} ms, max {pick(1.0):.1f} ms')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Open many chat sockets, send messages and report fan-out latency.')
+    parser.add_argument('--clients', type=int, default=100, help='concurrent chat sockets')
+    parser.add_argument('--groups', type=int, default=5, help='rooms the clients are spread over')
+    parser.add_argument('--senders', type=int, default=10, help='clients that send messages')
+    parser.add_argument('--messages', type=int, default=20, help='messages per sender')
+    parser.add_argument('--interval', type=float, default=0.05, help='seconds between sending rounds')
+    parser.add_argument('--timeout', type=float, default=15, help='seconds to wait for deliveries')
+    parser.add_argument('--async-mode', choices=('eventlet', 'gevent', 'threading'), default='threading')
+    parser.add_argument('--port', type=int, default=5310)
+    parser.add_argument('--url', help='test a running server instead (users load0..N must exist)')
+    parser.add_argument('--group-ids', type=int, nargs='+', default=[1], help='with --url: groups to join')
+    run(parser.parse_args())
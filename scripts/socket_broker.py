@@ -0,0 +1,231 @@
+"""
+A small stand-in for Redis, for running several app workers on one machine
+(development, CI, scripts/check_socket_fanout.py) without installing a Redis server.
+
+It speaks enough of the Redis protocol (RESP2 and RESP3) for the app:
+PUBLISH/SUBSCRIBE for Socket.IO fan-out, SET NX/INCR for the shared chat-id counter,
+HINCRBY/HGETALL for presence and SET NX EX/INCRBY for counting sign-in attempts.
+Everything lives in memory, so restarting the broker means restarting the workers too.
+
+    python scripts/socket_broker.py --unix /tmp/tripmates-broker.sock
+    SOCKETIO_MESSAGE_QUEUE=unix:///tmp/tripmates-broker.sock python app.py
+"""
+
+import argparse
+import os
+import socketserver
+import threading
+import time
+
+
+class Broker:
+    """Key/value store and channel subscriptions shared by all connections."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.values = {}
+        self.expires = {}  # key -> time.monotonic() deadline
+        self.channels = {}  # channel -> set of handlers
+
+    def publish(self, channel, data):
+        with self.lock:
+            handlers = list(self.channels.get(channel, ()))
+        for handler in handlers:
+            handler.send(Push([b'message', channel, data]))
+        return len(handlers)
+
+    def subscribe(self, handler, channel):
+        with self.lock:
+            self.channels.setdefault(channel, set()).add(handler)
+
+    def unsubscribe(self, handler, channel):
+        with self.lock:
+            self.channels.get(channel, set()).discard(handler)
+
+
+class CommandError(Exception):
+    pass
+
+
+class Push(list):
+    """Out-of-band pub/sub message (a plain array in RESP2, a push frame in RESP3)."""
+
+
+def encode(value, resp3=False):
+    """Encode a reply; True is +OK, str is a simple string, bytes a bulk string."""
+    if value is None:
+        return b'_\r\n' if resp3 else b'$-1\r\n'
+    if isinstance(value, CommandError):
+        return b'-ERR ' + str(value).encode() + b'\r\n'
+    if isinstance(value, bool):
+        return b'+OK\r\n'
+    if isinstance(value, int):
+        return b':%d\r\n' % value
+    if isinstance(value, str):
+        return b'+' + value.encode() + b'\r\n'
+    if isinstance(value, dict):
+        items = [v for pair in value.items() for v in pair]
+        head = b'%%%d\r\n' % len(value) if resp3 else b'*%d\r\n' % len(items)
+        return head + b''.join(encode(v, resp3) for v in items)
+    if isinstance(value, list):
+        kind = b'>' if resp3 and isinstance(value, Push) else b'*'
+        return kind + b'%d\r\n' % len(value) + b''.join(encode(v, resp3) for v in value)
+    return b'$%d\r\n' % len(value) + value + b'\r\n'
+
+
+class ConnectionHandler(socketserver.StreamRequestHandler):
+    broker = None
+
+    def setup(self):
+        super().setup()
+        self.write_lock = threading.Lock()
+        self.subscriptions = set()
+        self.resp3 = False
+
+    def send(self, value):
+        with self.write_lock:
+            try:
+                self.wfile.write(encode(value, self.resp3))
+                self.wfile.flush()
+            except OSError:
+                pass
+
+    def read_command(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+        if not line.startswith(b'*'):
+            return line.split()  # inline command, e.g. from telnet
+        args = []
+        for _ in range(int(line[1:])):
+            size = int(self.rfile.readline()[1:])
+            args.append(self.rfile.read(size + 2)[:-2])
+        return args
+
+    def handle(self):
+        try:
+            while True:
+                args = self.read_command()
+                if args is None:
+                    return
+                if not args:
+                    continue
+                name = args[0].decode().upper()
+                if name == 'QUIT':
+                    self.send(True)
+                    return
+                reply = self.run(name, args[1:])
+                if reply is not NotImplemented:
+                    self.send(reply)
+        except (OSError, ValueError):
+            return
+        finally:
+            for channel in self.subscriptions:
+                self.broker.unsubscribe(self, channel)
+
+    def run(self, name, args):
+        broker = self.broker
+        if name == 'PING':
+            if self.subscriptions:
+                return Push([b'pong', args[0] if args else b''])
+            return args[0] if args else 'PONG'
+        if name == 'ECHO':
+            return args[0]
+        if name == 'HELLO':
+            if args and args[0] not in (b'2', b'3'):
+                return CommandError('NOPROTO unsupported protocol version')
+            self.resp3 = bool(args) and args[0] == b'3'
+            return {b'server': b'tripmates-broker', b'version': b'7.0.0',
+                    b'proto': 3 if self.resp3 else 2, b'mode': b'standalone', b'role': b'master'}
+        if name in ('SELECT', 'CLIENT', 'AUTH'):
+            return True
+        if name == 'PUBLISH':
+            return broker.publish(args[0], args[1])
+        if name == 'SUBSCRIBE':
+            for channel in args:
+                broker.subscribe(self, channel)
+                self.subscriptions.add(channel)
+                self.send(Push([b'subscribe', channel, len(self.subscriptions)]))
+            return NotImplemented
+        if name == 'UNSUBSCRIBE':
+            for channel in args or list(self.subscriptions):
+                broker.unsubscribe(self, channel)
+                self.subscriptions.discard(channel)
+                self.send(Push([b'unsubscribe', channel, len(self.subscriptions)]))
+            return NotImplemented
+        with broker.lock:
+            if args and broker.expires.get(args[0], float('inf')) <= time.monotonic():
+                broker.values.pop(args[0], None)
+                del broker.expires[args[0]]
+            if name == 'GET':
+                return broker.values.get(args[0])
+            if name == 'SET':
+                options = [a.upper() for a in args[2:]]
+                if b'NX' in options and args[0] in broker.values:
+                    return None
+                broker.values[args[0]] = args[1]
+                if b'EX' in options:
+                    broker.expires[args[0]] = time.monotonic() + int(args[2 + options.index(b'EX') + 1])
+                else:
+                    broker.expires.pop(args[0], None)
+                return True
+            if name == 'DEL':
+                for key in args:
+                    broker.expires.pop(key, None)
+                return sum(broker.values.pop(key, None) is not None for key in args)
+            if name == 'EXPIRE':
+                if args[0] not in broker.values:
+                    return 0
+                broker.expires[args[0]] = time.monotonic() + int(args[1])
+                return 1
+            if name in ('INCR', 'INCRBY'):
+                step = int(args[1]) if name == 'INCRBY' else 1
+                try:
+                    value = int(broker.values.get(args[0], b'0')) + step
+                except ValueError:
+                    return CommandError('value is not an integer or out of range')
+                broker.values[args[0]] = str(value).encode()
+                return value
+            if name == 'HINCRBY':
+                fields = broker.values.setdefault(args[0], {})
+                value = int(fields.get(args[1], b'0')) + int(args[2])
+                fields[args[1]] = str(value).encode()
+                return value
+            if name == 'HGET':
+                return broker.values.get(args[0], {}).get(args[1])
+            if name == 'HGETALL':
+                return dict(broker.values.get(args[0], {}))
+        return CommandError(f"unknown command '{name}'")
+
+
+def make_server(unix_path=None, host='127.0.0.1', port=6379):
+    """Create (but don't start) a broker server on a Unix socket or a TCP port."""
+    handler = type('Handler', (ConnectionHandler,), {'broker': Broker()})
+    if unix_path:
+        if os.path.exists(unix_path):
+            os.remove(unix_path)
+        server = socketserver.ThreadingUnixStreamServer(unix_path, handler)
+    else:
+        socketserver.ThreadingTCPServer.allow_reuse_address = True
+        server = socketserver.ThreadingTCPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run an in-memory Redis stand-in for multi-worker Socket.IO.')
+    parser.add_argument('--unix', help='listen on this Unix socket path (use unix://PATH as the queue URL)')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=6379, help='TCP port when --unix is not given')
+    args = parser.parse_args()
+    server = make_server(args.unix, args.host, args.port)
+    where = f'unix://{args.unix}' if args.unix else f'redis://{args.host}:{args.port}/0'
+    print(f'Broker listening on {where}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if args.unix and os.path.exists(args.unix):
+            os.remove(args.unix)
@@ -0,0 +1,132 @@
+"""
+Production entry point for TripMates (use `python app.py` for development).
+
+    python serve.py --async-mode eventlet --workers 4 --port 8000
+
+Each worker is a separate process on its own port (8000, 8001, ...). Socket.IO
+clients must keep talking to the same worker, so put a load balancer with sticky
+sessions in front (e.g. nginx `ip_hash`), set TRUSTED_PROXIES=1 so sign-in limits
+see the clients' addresses, and set SOCKETIO_MESSAGE_QUEUE so the workers share
+chat rooms. On SIGTERM or Ctrl+C each worker drains its sockets (clients
+reconnect elsewhere), saves queued chat messages and exits.
+The first worker also sweeps orphaned upload files every UPLOAD_GC_INTERVAL seconds.
+"""
+
+import argparse
+import os
+import signal
+import subprocess
+import sys
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Run the TripMates server.')
+    parser.add_argument('--host', default=os.environ.get('HOST', '127.0.0.1'))
+    parser.add_argument('--port', type=int, default=int(os.environ.get('PORT', 8000)),
+                        help='port of the first worker; worker N listens on port + N')
+    parser.add_argument('--async-mode', choices=('eventlet', 'gevent', 'threading'),
+                        default=os.environ.get('SOCKETIO_ASYNC_MODE', 'threading'))
+    parser.add_argument('--workers', type=int, default=int(os.environ.get('WEB_WORKERS', 1)))
+    parser.add_argument('--max-connections', type=int, default=int(os.environ.get('WEB_MAX_CONNECTIONS', 1000)),
+                        help='concurrent connections per worker (eventlet/gevent only)')
+    parser.add_argument('--shutdown-grace', type=float, default=float(os.environ.get('SHUTDOWN_GRACE', 10)),
+                        help='seconds to let chat clients move away before disconnecting them')
+    parser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--sweep-uploads', action='store_true', help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def run_worker(args):
+    """Serve one process. Monkey patching has to happen before the app is imported."""
+    os.environ['SOCKETIO_ASYNC_MODE'] = args.async_mode
+    if args.async_mode == 'eventlet':
+        import eventlet
+        import greenlet
+        eventlet.monkey_patch()
+        main_greenlet = greenlet.getcurrent()
+    elif args.async_mode == 'gevent':
+        from gevent import monkey
+        monkey.patch_all()
+
+    from app import app, socketio, drain_sockets, message_pipeline, start_upload_sweeper
+
+    if not args.worker or args.sweep_uploads:
+        start_upload_sweeper()  # one sweeper per deployment is enough
+
+    state = {'stop_requested': False, 'drained': False}
+
+    def drain_when_asked():
+        # a green thread spawned from a signal handler may not run until the hub wakes up, so poll instead
+        while not state['stop_requested']:
+            socketio.sleep(0.5)
+        try:
+            drain_sockets(args.shutdown_grace)
+        finally:
+            state['drained'] = True
+            # a signal sent to ourselves would be raised in this green thread, not the server's
+            if args.async_mode == 'eventlet':
+                main_greenlet.throw(KeyboardInterrupt)
+            elif args.async_mode == 'gevent':
+                socketio.stop()
+            else:
+                os.kill(os.getpid(), signal.SIGINT)
+
+    def on_signal(signum, frame):
+        # the first signal starts draining; a second one (or ours once drained) stops the server
+        if state['stop_requested'] or socketio is None:
+            raise KeyboardInterrupt
+        state['stop_requested'] = True
+
+    if socketio is not None:
+        socketio.start_background_task(drain_when_asked)
+    signal.signal(signal.SIGTERM, on_signal)
+    signal.signal(signal.SIGINT, on_signal)
+
+    options = {}
+    if args.async_mode == 'eventlet':
+        options['max_size'] = args.max_connections
+    elif args.async_mode == 'gevent':
+        options['spawn'] = args.max_connections
+    print(f'Worker {os.getpid()} serving on http://{args.host}:{args.port} ({args.async_mode})', flush=True)
+    try:
+        if socketio is not None:
+            socketio.run(app, host=args.host, port=args.port, debug=False, use_reloader=False,
+                         log_output=False, allow_unsafe_werkzeug=True, **options)
+        else:
+            app.run(host=args.host, port=args.port, threaded=True)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        message_pipeline.close()
+
+
+def run_workers(args):
+    """Start one process per worker and pass shutdown signals on to them."""
+    if args.workers > 1 and not os.environ.get('SOCKETIO_MESSAGE_QUEUE'):
+        sys.exit('More than one worker needs SOCKETIO_MESSAGE_QUEUE (see README) so chat reaches every client.')
+    procs = []
+    for n in range(args.workers):
+        command = [sys.executable, os.path.abspath(__file__), '--worker',
+                   '--host', args.host, '--port', str(args.port + n),
+                   '--async-mode', args.async_mode,
+                   '--max-connections', str(args.max_connections),
+                   '--shutdown-grace', str(args.shutdown_grace)] + (['--sweep-uploads'] if n == 0 else [])
+        # own session: Ctrl+C reaches only this process, which forwards a single SIGTERM
+        procs.append(subprocess.Popen(command, start_new_session=True))
+
+    def forward(signum, frame):
+        for proc in procs:
+            if proc.poll() is None:
+                proc.send_signal(signal.SIGTERM)
+
+    signal.signal(signal.SIGTERM, forward)
+    signal.signal(signal.SIGINT, forward)
+    sys.exit(max(proc.wait() for proc in procs))
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    if args.worker or args.workers == 1:
+        run_worker(args)
+    else:
+        run_workers(args)
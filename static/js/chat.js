@@ -13,6 +13,8 @@ document.addEventListener('DOMContentLoaded', () => {
   const emojiPicker = emojiPickerContainer.querySelector('emoji-picker');
   const uploadBtn = document.getElementById('upload-btn');
   const statusBadge = document.getElementById('chat-status');
+  const onlineEl = document.getElementById('chat-online');
+  const online = new Map();  // user id -> name
 
   function scrollToBottom(smooth = true) {
     messagesEl.scrollTo({
@@ -32,15 +34,20 @@ document.addEventListener('DOMContentLoaded', () => {
     }
   }
 
-  function addMessage(data) {
+  // Paging state for the history API
+  const seenIds = new Set();
+  let oldestId = null;
+  let hasOlder = false;
+  let syncToken = null;
+  let loadingOlder = false;
+
+  function buildMessage(data) {
     // Handle Status Messages (System messages)
     if (data.is_status || data.text?.includes('joined the') || data.text?.includes('left the')) {
       const li = document.createElement('li');
       li.className = 'chat-status';
       li.textContent = data.text || data.message;
-      messagesEl.appendChild(li);
-      scrollToBottom();
-      return;
+      return li;
     }
 
     const li = document.createElement('li');
@@ -57,8 +64,17 @@ document.addEventListener('DOMContentLoaded', () => {
 
     content += `<div class="text">`;
     if (data.media_filename) {
-      const url = `/static/uploads/${data.media_filename}`;
-      content += `<img src="${url}" style="max-width:100%; border-radius:4px; margin-bottom:5px; display:block;"/>`;
+      // show the small variants; the full-size original opens on click
+      const original = data.media_url || `/static/uploads/${data.media_filename}`;
+      const style = 'max-width:100%; border-radius:4px; margin-bottom:5px; display:block;';
+      content += `<a href="${original}" target="_blank" rel="noopener">`;
+      if (data.thumb_url) {
+        content += `<picture><source type="image/webp" srcset="${data.thumb_webp_url}">`
+          + `<img src="${data.thumb_url}" loading="lazy" style="${style}"/></picture>`;
+      } else {
+        content += `<img src="${original}" loading="lazy" style="${style}"/>`;
+      }
+      content += `</a>`;
     }
     if (data.text) {
       content += `<span>${data.text}</span>`;
@@ -67,25 +83,85 @@ document.addEventListener('DOMContentLoaded', () => {
     content += `</div>`;
 
     li.innerHTML = content;
-    messagesEl.appendChild(li);
+    return li;
+  }
+
+  // Returns false if the message is already on screen
+  function remember(data) {
+    if (data.id == null) return true;
+    if (seenIds.has(data.id)) return false;
+    seenIds.add(data.id);
+    if (syncToken === null || data.id > parseInt(syncToken, 10)) syncToken = String(data.id);
+    return true;
+  }
+
+  function addMessage(data) {
+    if (!remember(data)) return;
+    messagesEl.appendChild(buildMessage(data));
     scrollToBottom();
   }
 
-  // Load History
-  fetch(`/groups/${groupId}/messages`).then(r => r.json()).then(data => {
-    if (data.error) {
-      console.error('History fetch error:', data.error);
+  function fetchPage(params) {
+    const query = new URLSearchParams(params).toString();
+    return fetch(`/groups/${groupId}/messages${query ? '?' + query : ''}`).then(r => r.json());
+  }
+
+  // Load History (latest page only; older pages load when scrolling up)
+  fetchPage({}).then(page => {
+    if (page.error) {
+      console.error('History fetch error:', page.error);
       return;
     }
     messagesEl.innerHTML = '';
-    data.forEach(m => addMessage(m));
-    setTimeout(() => scrollToBottom(false), 100);
+    page.messages.forEach(m => addMessage(m));
+    oldestId = page.oldest_id;
+    if (page.sync_token) syncToken = page.sync_token;
+    setTimeout(() => {
+      scrollToBottom(false);
+      // only start paging backwards once the initial jump to the bottom is done
+      hasOlder = page.has_more;
+    }, 100);
+  });
+
+  function loadOlder() {
+    if (loadingOlder || !hasOlder || oldestId === null) return;
+    loadingOlder = true;
+    const previousHeight = messagesEl.scrollHeight;
+    fetchPage({ before_id: oldestId }).then(page => {
+      if (page.error) return;
+      const fragment = document.createDocumentFragment();
+      page.messages.forEach(m => {
+        if (remember(m)) fragment.appendChild(buildMessage(m));
+      });
+      messagesEl.insertBefore(fragment, messagesEl.firstChild);
+      // keep the view anchored on the message the user was reading
+      messagesEl.scrollTop += messagesEl.scrollHeight - previousHeight;
+      if (page.oldest_id !== null) oldestId = page.oldest_id;
+      hasOlder = page.has_more;
+    }).finally(() => {
+      loadingOlder = false;
+    });
+  }
+
+  messagesEl.addEventListener('scroll', () => {
+    if (messagesEl.scrollTop < 50) loadOlder();
   });
 
+  // After a reconnect, fetch only what was missed while offline
+  function syncMissed() {
+    if (syncToken === null) return;
+    fetchPage({ since: syncToken, limit: 200 }).then(page => {
+      if (page.error) return;
+      page.messages.forEach(m => addMessage(m));
+      if (page.has_more) syncMissed();
+    });
+  }
+
   socket.on('connect', () => {
     statusBadge.textContent = 'Connected';
     statusBadge.className = 'text-success';
     socket.emit('join', { group: groupId });
+    syncMissed();
     setSendEnabled(true);
   });
 
@@ -95,11 +171,46 @@ document.addEventListener('DOMContentLoaded', () => {
     setSendEnabled(false);
   });
 
+  // The server is restarting: move to another worker, spread out so they don't all land at once
+  function reconnectSoon(delay) {
+    setTimeout(() => socket.connect(), delay / 2 + Math.random() * delay);
+  }
+
+  socket.on('server_draining', (data) => {
+    socket.disconnect();
+    reconnectSoon((data && data.retry_ms) || 2000);
+  });
+
+  // A draining worker refuses new connections; the client won't retry those by itself
+  socket.on('connect_error', () => {
+    if (!socket.active) reconnectSoon(2000);
+  });
+
   // Real-time events
   socket.on('new_message', (data) => {
     addMessage(data);
   });
 
+  // Presence: a full list when joining, then only what changed
+  function renderOnline() {
+    if (!onlineEl) return;
+    const names = Array.from(online.values()).sort();
+    onlineEl.textContent = names.length ? names.join(', ') : '-';
+  }
+
+  socket.on('joined', (data) => {
+    online.clear();
+    (data.online || []).forEach(u => online.set(u.id, u.name));
+    renderOnline();
+  });
+
+  socket.on('presence', (data) => {
+    if (String(data.group) !== String(groupId)) return;
+    (data.online || []).forEach(u => online.set(u.id, u.name));
+    (data.offline || []).forEach(id => online.delete(id));
+    renderOnline();
+  });
+
   function setSendEnabled(enabled) {
     const sendBtn = form.querySelector('button[type="submit"]');
     if (sendBtn) sendBtn.disabled = !enabled;
@@ -145,13 +256,119 @@ document.addEventListener('DOMContentLoaded', () => {
     fileInput.click();
   });
 
+  // Chunked, resumable upload: a dropped connection only costs the current chunk,
+  // and reloading the page and picking the same file again continues where it stopped
+  const sleep = ms => new Promise(resolve => setTimeout(resolve, ms));
+
+  async function uploadFile(file) {
+    const resumeKey = `upload:${groupId}:${file.name}:${file.size}:${file.lastModified}`;
+    let upload = null;
+    const saved = localStorage.getItem(resumeKey);
+    if (saved) {
+      const r = await fetch(saved);
+      if (r.ok) upload = await r.json();
+    }
+    if (!upload) {
+      const r = await fetch(`/groups/${groupId}/uploads`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ filename: file.name, size: file.size })
+      });
+      upload = await r.json();
+      if (!r.ok) throw new Error(upload.error || 'upload failed');
+      localStorage.setItem(resumeKey, upload.url);
+    }
+    let offset = upload.offset;
+    let failures = 0;
+    while (offset < file.size) {
+      statusBadge.textContent = `Uploading ${Math.floor(100 * offset / file.size)}%`;
+      let r;
+      try {
+        r = await fetch(upload.url, {
+          method: 'PATCH',
+          headers: { 'Upload-Offset': String(offset), 'Content-Type': 'application/offset+octet-stream' },
+          body: file.slice(offset, offset + upload.chunk_size)
+        });
+      } catch (e) {
+        if (++failures > 5) throw e;
+        await sleep(1000 * failures);
+        const status = await fetch(upload.url).then(res => res.json()).catch(() => null);
+        if (status && status.offset !== undefined) offset = status.offset;
+        continue;
+      }
+      const data = await r.json();
+      if (r.status === 409) {
+        offset = data.offset;
+        continue;
+      }
+      if (!r.ok) {
+        localStorage.removeItem(resumeKey);
+        throw new Error(data.error || 'upload failed');
+      }
+      failures = 0;
+      offset = data.offset;
+    }
+    localStorage.removeItem(resumeKey);
+  }
+
   fileInput.addEventListener('change', () => {
     const file = fileInput.files[0];
     if (!file) return;
-    const fd = new FormData();
-    fd.append('file', file);
-    fetch(`/groups/${groupId}/upload`, { method: 'POST', body: fd }).then(r => r.json()).then(resp => {
+    uploadFile(file).catch(err => {
+      console.error('Upload failed:', err);
+      alert(`Upload failed: ${err.message}`);
+    }).finally(() => {
       fileInput.value = null;
+      statusBadge.textContent = socket.connected ? 'Connected' : 'Disconnected';
     });
   });
+
+  // Chat search (results come with their matches already escaped and wrapped in <mark>)
+  const searchForm = document.getElementById('chat-search');
+  const searchInput = document.getElementById('chat-search-input');
+  const searchOrder = document.getElementById('chat-search-order');
+  const resultsEl = document.getElementById('chat-search-results');
+  const resultsList = resultsEl.querySelector('ul');
+  const moreBtn = resultsEl.querySelector('button');
+  let searchCursor = null;
+
+  function runSearch(more) {
+    const q = searchInput.value.trim();
+    if (!q) {
+      resultsEl.style.display = 'none';
+      return;
+    }
+    const params = { q, order: searchOrder.value };
+    if (more && searchCursor) params.cursor = searchCursor;
+    fetch(`/groups/${groupId}/messages/search?${new URLSearchParams(params)}`)
+      .then(r => r.json())
+      .then(data => {
+        if (!more) resultsList.innerHTML = '';
+        (data.results || []).forEach(hit => {
+          const li = document.createElement('li');
+          li.className = 'list-group-item';
+          const meta = document.createElement('div');
+          meta.className = 'text-muted';
+          meta.textContent = `${hit.user} · ${hit.timestamp ? new Date(hit.timestamp).toLocaleString() : ''}`;
+          const text = document.createElement('div');
+          text.innerHTML = hit.snippet_html;
+          li.append(meta, text);
+          resultsList.appendChild(li);
+        });
+        if (!resultsList.children.length) {
+          resultsList.innerHTML = '<li class="list-group-item text-muted">No messages found.</li>';
+        }
+        searchCursor = data.next_cursor;
+        moreBtn.style.display = searchCursor ? '' : 'none';
+        resultsEl.style.display = '';
+      })
+      .catch(err => console.error('Search failed:', err));
+  }
+
+  searchForm.addEventListener('submit', e => {
+    e.preventDefault();
+    runSearch(false);
+  });
+  searchOrder.addEventListener('change', () => runSearch(false));
+  moreBtn.addEventListener('click', () => runSearch(true));
 });
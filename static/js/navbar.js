@@ -81,4 +81,37 @@ document.addEventListener('DOMContentLoaded', function() {
             });
         });
     }
+
+    // Search autocomplete: suggestions fill the shared datalist; picking a trip or item opens it
+    const suggestions = document.getElementById('search-suggestions');
+    const suggestionUrls = new Map();
+    document.querySelectorAll('input[data-suggest-url]').forEach(input => {
+        let timer;
+        input.addEventListener('input', () => {
+            const url = suggestionUrls.get(input.value);
+            if (url) {
+                window.location.href = url;
+                return;
+            }
+            clearTimeout(timer);
+            const q = input.value.trim();
+            if (q.length < 2 || !suggestions) return;
+            timer = setTimeout(() => {
+                fetch(`${input.dataset.suggestUrl}?${new URLSearchParams({ q })}`)
+                    .then(response => response.json())
+                    .then(data => {
+                        suggestions.innerHTML = '';
+                        suggestionUrls.clear();
+                        data.suggestions.forEach(s => {
+                            const option = document.createElement('option');
+                            option.value = s.kind === 'tag' ? `#${s.text}` : s.text;
+                            option.label = s.kind;
+                            suggestions.appendChild(option);
+                            suggestionUrls.set(option.value, s.url);
+                        });
+                    })
+                    .catch(() => {});
+            }, 150);
+        });
+    });
 });
\ No newline at end of file